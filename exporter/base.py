@@ -1,50 +1,83 @@
-#!/usr/bin/env python
-# Copyright 2017 The Openstack-Helm Authors.
-#
-# Licensed under the Apache License, Version 2.0 (the "License");
-# you may not use this file except in compliance with the License.
-# You may obtain a copy of the License at
-#
-#     http://www.apache.org/licenses/LICENSE-2.0
-#
-# Unless required by applicable law or agreed to in writing, software
-# distributed under the License is distributed on an "AS IS" BASIS,
-# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
-# See the License for the specific language governing permissions and
-# limitations under the License.
-
-import re
-
-
-class OSBase(object):
-    FAIL = 0
-    OK = 1
-    UNKNOWN = 2
-    GAUGE_NAME_FORMAT = "openstack_{}"
-
-    def __init__(self, oscache, osclient):
-        self.oscache = oscache
-        self.osclient = osclient
-        self.oscache.cache_me(self)
-
-    def get_cache_data(self):
-        return self.oscache.get_cache_data(self.get_cache_key())
-
-    def build_cache_data(self):
-        """ build a hash to store in cache """
-        raise NotImplemented("Must be implemented by the subclass!")
-
-    def get_cache_key(self):
-        """ cache key """
-        raise NotImplemented("Must be implemented by the subclass!")
-
-    def get_stats(self):
-        """ build stats for prometheus exporter """
-        raise NotImplemented("Must be implemented by the subclass!")
-
-    def gauge_name_sanitize(self, input):
-        if input.startswith("openstack_"):
-            return re.sub(r'[^a-zA-Z0-9:_]', '_', input)
-        else:
-            return self.GAUGE_NAME_FORMAT.format(
-                re.sub(r'[^a-zA-Z0-9:_]', '_', input))
+#!/usr/bin/env python
+# Copyright 2017 The Openstack-Helm Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+from exposition import MetricFamily
+import exposition
+import re
+
+
+class OSBase(object):
+    FAIL = 0
+    OK = 1
+    UNKNOWN = 2
+    GAUGE_NAME_FORMAT = "openstack_{}"
+    # True if the collector splits its work between the shards, otherwise
+    # it only runs on the leader
+    SHARDED = False
+    # sanitized gauge names by (format, input), shared by all the
+    # collectors
+    _gauge_names = {}
+
+    def __init__(self, oscache, osclient):
+        self.oscache = oscache
+        self.osclient = osclient
+        self.oscache.cache_me(self)
+
+    def get_cache_data(self):
+        return self.oscache.get_cache_data(self.get_cache_key())
+
+    def build_cache_data(self):
+        """ build a hash to store in cache """
+        raise NotImplemented("Must be implemented by the subclass!")
+
+    def get_cache_key(self):
+        """ cache key """
+        raise NotImplemented("Must be implemented by the subclass!")
+
+    def get_metric_families(self):
+        """ yield the MetricFamily of the stats of the collector """
+        raise NotImplemented("Must be implemented by the subclass!")
+
+    def get_stats(self):
+        """ build stats for prometheus exporter """
+        return exposition.encode(self.get_metric_families())
+
+    def stat_families(self, stats, documentation, labels, label_values):
+        """ yield a gauge family per stat_name of stats, label_values(stat)
+            returning the values of labels for a stat
+        """
+        rows = OrderedDict()
+        for stat in stats:
+            name = stat['stat_name']
+            if name not in rows:
+                rows[name] = []
+            rows[name].append((label_values(stat), stat['stat_value']))
+        for name, family_rows in rows.items():
+            yield MetricFamily(
+                self.gauge_name_sanitize(name), documentation, labels,
+                family_rows)
+
+    def gauge_name_sanitize(self, input):
+        name = self._gauge_names.get((self.GAUGE_NAME_FORMAT, input))
+        if name is not None:
+            return name
+        if input.startswith("openstack_"):
+            name = re.sub(r'[^a-zA-Z0-9:_]', '_', input)
+        else:
+            name = self.GAUGE_NAME_FORMAT.format(
+                re.sub(r'[^a-zA-Z0-9:_]', '_', input))
+        self._gauge_names[(self.GAUGE_NAME_FORMAT, input)] = name
+        return name
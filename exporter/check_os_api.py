@@ -16,7 +16,7 @@
 from base import OSBase
 
 from urlparse import urlparse
-from prometheus_client import CollectorRegistry, generate_latest, Gauge
+from exposition import MetricFamily
 import logging
 
 logger = logging.getLogger(__name__)
@@ -114,20 +114,12 @@ class CheckOSApi(OSBase):
     def get_cache_key(self):
         return "check_os_api"
 
-    def get_stats(self):
-        registry = CollectorRegistry()
+    def get_metric_families(self):
         labels = ['region', 'url', 'service']
-        check_api_data_cache = self.get_cache_data()
-        for check_api_data in check_api_data_cache:
-            label_values = [
-                check_api_data['region'],
-                check_api_data['url'],
-                check_api_data['service']]
-            gague_name = self.gauge_name_sanitize('check_api')
-            check_gauge = Gauge(
-                gague_name,
-                'Openstack API check. fail = 0, ok = 1 and unknown = 2',
-                labels,
-                registry=registry)
-            check_gauge.labels(*label_values).set(check_api_data['status'])
-        return generate_latest(registry)
+        yield MetricFamily(
+            self.gauge_name_sanitize('check_api'),
+            'Openstack API check. fail = 0, ok = 1 and unknown = 2',
+            labels,
+            [((check_api_data['region'], check_api_data['url'],
+               check_api_data['service']), check_api_data['status'])
+             for check_api_data in self.get_cache_data()])
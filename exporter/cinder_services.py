@@ -16,7 +16,7 @@
 from base import OSBase
 from collections import Counter
 from collections import defaultdict
-from prometheus_client import CollectorRegistry, generate_latest, Gauge
+from records import ServiceStat
 import logging
 
 logger = logging.getLogger(__name__)
@@ -42,41 +42,28 @@ class CinderServiceStats(OSBase):
             totalw = sum(aggregated_workers[service].values())
             for state in self.osclient.states:
                 prct = (100.0 * aggregated_workers[service][state]) / totalw
-                stats.append({
-                    'stat_name': "services_{}_{}_percent".format(service, state),
-                    'stat_value': prct,
-                    'state': state,
-                    'service': service
-                })
-                stats.append({
-                    'stat_name': "services_{}_{}_total".format(service, state),
-                    'stat_value': aggregated_workers[service][state],
-                    'state': state,
-                    'service': service
-                })
+                stats.append(ServiceStat(
+                    stat_name="services_{}_{}_percent".format(service, state),
+                    stat_value=prct,
+                    state=state,
+                    service=service))
+                stats.append(ServiceStat(
+                    stat_name="services_{}_{}_total".format(service, state),
+                    stat_value=aggregated_workers[service][state],
+                    state=state,
+                    service=service))
 
         return stats
 
     def get_cache_key(self):
         return "cinder_services_stats"
 
-    def get_stats(self):
-        registry = CollectorRegistry()
+    def get_metric_families(self):
         labels = ['region', 'host', 'service', 'state']
-        cinder_services_stats_cache = self.get_cache_data()
-        for cinder_services_stat in cinder_services_stats_cache:
-            stat_gauge = Gauge(
-                self.gauge_name_sanitize(
-                    cinder_services_stat['stat_name']),
-                'Openstack Cinder Service statistic',
-                labels,
-                registry=registry)
-            label_values = [self.osclient.region,
-                            cinder_services_stat.get('host', ''),
-                            cinder_services_stat.get('service', ''),
-                            cinder_services_stat.get('state', '')]
-            stat_gauge.labels(
-                *
-                label_values).set(
-                cinder_services_stat['stat_value'])
-        return generate_latest(registry)
+        region = self.osclient.region
+        return self.stat_families(
+            self.get_cache_data(),
+            'Openstack Cinder Service statistic',
+            labels,
+            lambda stat: (region, stat.get('host', ''),
+                          stat.get('service', ''), stat.get('state', '')))
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# Copyright 2017 The Openstack-Helm Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Circuit breakers of the OpenStack services.
+
+A breaker opens after THRESHOLD consecutive failures of its service, a
+connection error, a timeout or a 5xx response. While it is open, requests
+to the service fail immediately with CircuitOpenError. Once the backoff has
+elapsed, a single probe request is let through: the breaker closes if it
+succeeds, otherwise it opens again for twice as long, up to MAX_BACKOFF.
+
+Each service of each region has its own breaker, so an outage in one
+region does not fail the requests sent to the other regions.
+"""
+
+from http_metrics import InstrumentedHTTPAdapter
+from http_metrics import classify, is_catalog_service
+from prometheus_client import CollectorRegistry, generate_latest
+from prometheus_client import Counter, Gauge
+from requests.exceptions import ConnectionError
+from threading import Lock
+from time import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 0
+OPEN = 1
+HALF_OPEN = 2
+
+THRESHOLD = 5
+BACKOFF = 30
+MAX_BACKOFF = 600
+
+_breakers_lock = Lock()
+_breakers = {}
+
+
+class CircuitOpenError(ConnectionError):
+    pass
+
+
+def configure(threshold=THRESHOLD, backoff=BACKOFF, max_backoff=MAX_BACKOFF):
+    """ set the options of the breakers, 0 failures disables them """
+    global THRESHOLD, BACKOFF, MAX_BACKOFF
+    THRESHOLD = threshold
+    BACKOFF = backoff
+    MAX_BACKOFF = max_backoff
+
+
+def get_breaker(service, region=''):
+    with _breakers_lock:
+        if (region, service) not in _breakers:
+            _breakers[region, service] = CircuitBreaker(service, region)
+        return _breakers[region, service]
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, service, region=''):
+        self.service = service
+        self.region = region
+        self.name = '{} of {}'.format(service, region) if region else service
+        self.state = CLOSED
+        self.failures = 0
+        self.backoff = 0
+        self.opened_at = None
+        self.rejected = 0
+        self._lock = Lock()
+
+    def allow(self):
+        """ raise CircuitOpenError if a request must not be sent """
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN and time() >= self.opened_at + self.backoff:
+                logger.info(
+                    "probing service {} after {}s".format(
+                        self.name, self.backoff))
+                self.state = HALF_OPEN
+                return
+            self.rejected += 1
+        raise CircuitOpenError(
+            "circuit breaker of service {} is open".format(self.name))
+
+    def success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(
+                    "service {} recovered, closing its circuit "
+                    "breaker".format(self.name))
+            self.state = CLOSED
+            self.failures = 0
+            self.backoff = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+            elif self.state == CLOSED and THRESHOLD and \
+                    self.failures >= THRESHOLD:
+                self.backoff = BACKOFF
+            else:
+                return
+            self.state = OPEN
+            self.opened_at = time()
+        logger.warning(
+            "service {} failed {} times in a row, opening its circuit "
+            "breaker for {}s".format(self.name, self.failures,
+                                     self.backoff))
+
+
+class BreakerHTTPAdapter(InstrumentedHTTPAdapter):
+    """ HTTPAdapter failing fast when the service of a request is down.
+
+        Only the services of the Keystone catalog have a breaker.
+    """
+
+    def send(self, request, **kwargs):
+        region, service_type, _ = classify(request.url)
+        if not is_catalog_service(service_type):
+            return super(BreakerHTTPAdapter, self).send(request, **kwargs)
+        breaker = get_breaker(service_type, region)
+        breaker.allow()
+        try:
+            response = super(BreakerHTTPAdapter, self).send(
+                request, **kwargs)
+        except Exception:
+            breaker.failure()
+            raise
+        if response.status_code >= 500:
+            breaker.failure()
+        else:
+            breaker.success()
+        return response
+
+
+def get_stats():
+    registry = CollectorRegistry()
+    labels = ['region', 'service']
+    state = Gauge(
+        'openstack_exporter_circuit_breaker_state',
+        'State of the circuit breaker of an OpenStack service. '
+        'closed = 0, open = 1 and half-open = 2',
+        labels, registry=registry)
+    rejected = Counter(
+        'openstack_exporter_circuit_breaker_rejected_total',
+        'Requests failed immediately because the circuit breaker of their '
+        'service was open.',
+        labels, registry=registry)
+    with _breakers_lock:
+        breakers = sorted(_breakers.items())
+    for (region, service), breaker in breakers:
+        state.labels(region, service).set(breaker.state)
+        rejected.labels(region, service).inc(breaker.rejected)
+    return generate_latest(registry)
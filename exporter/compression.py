@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# Copyright 2017 The Openstack-Helm Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" gzip bodies assembled from separately compressed parts.
+
+Each part is compressed once into raw deflate blocks ending with a sync
+flush, which leaves the stream byte aligned so that parts can be joined in
+any order. gzip_parts wraps them with the gzip header and trailer, only
+the CRC of the uncompressed parts has to be computed again.
+"""
+
+import struct
+import zlib
+
+COMPRESSION_LEVEL = 6
+# gzip header: magic, deflate, no flags, no mtime, no extra flags, unknown OS
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+# an empty final block with fixed Huffman codes
+FINAL_BLOCK = b'\x03\x00'
+
+
+def deflate(data, level=COMPRESSION_LEVEL):
+    """ compress data into byte aligned raw deflate blocks """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def gzip_parts(parts, deflated_parts):
+    """ return the parts of a gzip body made of parts and their deflate()
+        output
+    """
+    crc = 0
+    size = 0
+    for part in parts:
+        crc = zlib.crc32(part, crc)
+        size += len(part)
+    trailer = struct.pack('<II', crc & 0xffffffff, size & 0xffffffff)
+    return [GZIP_HEADER] + list(deflated_parts) + [FINAL_BLOCK, trailer]
@@ -1,11 +1,15 @@
 from base import OSBase
-from osclient import session_adapter, get_ironic_client
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from http_metrics import register_endpoint
+from osclient import pooled_requests_session
 from os import environ
-from prometheus_client import CollectorRegistry, generate_latest, Gauge
+from exposition import MetricFamily
+from records import Record
 from utils import node_details
 import logging
 import re
-import requests
+import sharding
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +25,16 @@ LABELS = [
     'node_type',
     'project_name',
 ]
+
+
+class PortStat(Record):
+    __slots__ = tuple(['stat_name', 'stat_value'] + LABELS[1:])
+
+
+# Seconds to wait for a switch before giving up on it for the cycle.
+CORSA_TIMEOUT = 10
+# Number of switches polled at the same time.
+CORSA_CONCURRENCY = 8
 CORSA_STATS_TO_COLLECT = [
     'tx_packets',
     'tx_errors',
@@ -34,18 +48,27 @@ CORSA_STATS_TO_COLLECT = [
 
 
 class CorsaClient():
-    """Corsa API Client"""
+    """Corsa API Client
+
+    Keeps a session per switch so connections are reused between cycles.
+    """
 
-    def __init__(self, address, token, verify=None):
+    def __init__(self, address, token, verify=None, timeout=CORSA_TIMEOUT):
         self.address = address
         self.token = token
         self.verify = verify
+        self.timeout = timeout
         self.api_base = '/api/v1'
+        self.session = pooled_requests_session()
+        self.session.headers['Authorization'] = token
+        if address:
+            register_endpoint(address, 'corsa')
 
     def get_path(self, path):
-        headers = {'Authorization': self.token}
         url = '{}{}{}'.format(self.address, self.api_base, path)
-        resp = requests.get(url, headers=headers, verify=self.verify)
+        resp = self.session.get(
+            url, verify=self.verify, timeout=self.timeout)
+        resp.raise_for_status()
         return resp.json()
 
     def get_stats_ports(self, port=None):
@@ -57,48 +80,54 @@ class CorsaClient():
 
 class CorsaStats(OSBase):
     """Class to report network statistics from CorsaSwitches"""
+    SHARDED = True
 
     def __init__(self, oscache, osclient, corsa_configs):
         super(CorsaStats, self).__init__(oscache, osclient)
 
         self.corsa_configs = corsa_configs
+        self.corsa_clients = {
+            switch['name']: CorsaClient(
+                switch.get('address'),
+                switch.get('token'),
+                verify=switch.get('ssl_verify', True),
+                timeout=switch.get('timeout', CORSA_TIMEOUT))
+            for switch in corsa_configs}
 
     def build_cache_data(self):
         """Return list of stats to cache."""
         cache_stats = []
-        nodes = node_details.get_nodes()
-        node_details.add_port_info(nodes)
+        region = self.osclient.region
+        nodes = node_details.get_nodes(detail=True, region=region)
+        ports = node_details.get_ports_by_node(region=region)
+        port_index = self._index_ports(nodes, ports)
+
+        switch_names = [
+            switch['name'] for switch in self.corsa_configs
+            if sharding.owns(switch['name'])]
+        pool = ThreadPool(min(CORSA_CONCURRENCY, len(switch_names)) or 1)
+        try:
+            results = pool.map(self._get_port_stats, switch_names)
+        finally:
+            pool.close()
+
+        for switch_name, port_stats in zip(switch_names, results):
+            if port_stats is None:
+                continue
+
+            for stat in port_stats.get('stats', []):
+                node = port_index.get((switch_name, str(stat['port'])))
+
+                if not node:
+                    continue
 
-        for switch in self.corsa_configs:
-            corsa_client = CorsaClient(
-                switch.get('address'),
-                switch.get('token'),
-                verify=switch.get('ssl_verify', True))
-
-            def check_switch(switch_name):
-                return switch_name == switch['name']
-
-            switch_nodes = {
-                n.port.local_link_connection['port_id'].split()[-1]: n
-                for n in nodes
-                if check_switch(n.port.local_link_connection['switch_info'])
-            }
-
-            port_stats = corsa_client.get_stats_ports()
-
-            for stat in port_stats['stats']:
                 for key, value in stat.items():
                     if key not in CORSA_STATS_TO_COLLECT:
                         continue
 
-                    node = switch_nodes.get(stat['port'])
-
-                    if not node:
-                        continue
-
-                    corsa_stat = dict(
+                    corsa_stat = PortStat(
                         stat_name='corsa_{}'.format(key),
-                        switch=switch['name'],
+                        switch=switch_name,
                         port=stat['port'],
                         node=node.name,
                         provision_state=node.provision_state,
@@ -108,19 +137,45 @@ class CorsaStats(OSBase):
                     cache_stats.append(corsa_stat)
         return cache_stats
 
+    def _get_port_stats(self, switch_name):
+        """Return the port statistics of a switch, or None if the switch
+        cannot be reached so the other switches are still reported."""
+        try:
+            return self.corsa_clients[switch_name].get_stats_ports()
+        except Exception as e:
+            logger.warning(
+                "Could not get port stats from switch {}: {}".format(
+                    switch_name, e))
+            return None
+
+    def _index_ports(self, nodes, ports):
+        """Return dict of nodes by (switch, port) of their ironic port,
+        ports being the ironic ports by node uuid."""
+        port_index = {}
+        for node in nodes:
+            port = ports.get(node.uuid)
+            if port is None:
+                continue
+            connection = port.local_link_connection or {}
+            if 'switch_info' not in connection or 'port_id' not in connection:
+                continue
+            port_id = connection['port_id'].split()[-1]
+            port_index[(connection['switch_info'], port_id)] = node
+        return port_index
+
     def get_cache_key(self):
         return 'corsa_stats'
 
-    def get_stats(self):
-        registry = CollectorRegistry()
-        corsa_stats_cache = self.get_cache_data()
-        for corsa_stat in corsa_stats_cache:
-            stat_gauge = Gauge(
-                corsa_stat.get('stat_name'),
-                'Corsa Port Stat Statistics',
-                LABELS,
-                registry=registry)
-            label_values = [self.osclient.region] + [
-                corsa_stat.get(x, '') for x in LABELS[1:]]
-            stat_gauge.labels(*label_values).set(corsa_stat['stat_value'])
-        return generate_latest(registry)
+    def get_metric_families(self):
+        region = self.osclient.region
+        rows = OrderedDict()
+        for corsa_stat in self.get_cache_data():
+            name = corsa_stat.get('stat_name')
+            if name not in rows:
+                rows[name] = []
+            rows[name].append((
+                (region, ) + tuple(corsa_stat.get(x, '') for x in LABELS[1:]),
+                corsa_stat['stat_value']))
+        for name, family_rows in rows.items():
+            yield MetricFamily(
+                name, 'Corsa Port Stat Statistics', LABELS, family_rows)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# Copyright 2017 The Openstack-Helm Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Prometheus text exposition of the metric families of the collectors.
+
+Collectors yield MetricFamily tuples of rows, (label values, value), read
+straight from their cache instead of filling a prometheus_client registry
+with a metric object per statistic. encode() groups the rows of the
+families sharing a name under a single HELP and TYPE header, in the order
+the names were first seen, and writes each family to the output buffer as
+one block of text.
+
+Scrapes can select metric names with federation style match[] selectors,
+filter_families() keeps the samples of a rendered text they match, along
+with the HELP and TYPE lines of their families.
+"""
+
+from collections import namedtuple
+from collections import OrderedDict
+import io
+import math
+import re
+
+import six
+
+_MetricFamily = namedtuple(
+    'MetricFamily', ['name', 'documentation', 'labels', 'rows', 'type'])
+
+
+class MetricFamily(_MetricFamily):
+    """ metric name, help text, label names, rows of (label values, value)
+        and type, 'gauge' or 'counter'
+    """
+    __slots__ = ()
+
+    def __new__(cls, name, documentation, labels, rows, type='gauge'):
+        return _MetricFamily.__new__(
+            cls, name, documentation, labels, rows, type)
+
+
+# a metric name, a __name__ matcher, or both
+SELECTOR = re.compile(
+    r'^\s*(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)?\s*'
+    r'(?:\{\s*__name__\s*(?P<op>=~|=)\s*"(?P<value>(?:[^"\\]|\\.)*)"\s*,?'
+    r'\s*\})?\s*$')
+
+
+def name_matcher(selectors):
+    """ return a predicate telling if a metric name is matched by one of
+        the selectors: `name`, `{__name__="name"}` or `{__name__=~"regex"}`.
+        Raises ValueError for the selectors matching on other labels.
+    """
+    predicates = []
+    for selector in selectors:
+        match = SELECTOR.match(selector)
+        if match is None or not (match.group('name') or match.group('op')):
+            raise ValueError(
+                "unsupported metric selector {}".format(selector))
+        names = set()
+        patterns = []
+        if match.group('name'):
+            names.add(match.group('name'))
+        if match.group('op'):
+            value = re.sub(r'\\(.)', r'\1', match.group('value'))
+            if match.group('op') == '=':
+                names.add(value)
+            else:
+                try:
+                    # matchers are anchored like in Prometheus
+                    patterns.append(re.compile('(?:{})$'.format(value)))
+                except re.error as e:
+                    raise ValueError(
+                        "invalid regex in selector {}: {}".format(
+                            selector, e))
+        predicates.append((names, patterns))
+
+    def matches(name):
+        for names, patterns in predicates:
+            if len(names) > 1:
+                continue
+            if names and name not in names:
+                continue
+            if all(pattern.match(name) for pattern in patterns):
+                return True
+        return False
+    return matches
+
+
+def filter_families(text, keep):
+    """ return the samples of text, rendered by encode() or by
+        prometheus_client, whose metric name satisfies keep(name), under
+        the HELP and TYPE lines of their family. Sample names include the
+        suffixes of their family, like _count or _bucket for histograms.
+    """
+    if not text:
+        return text
+    matched = {}
+    kept = []
+    # comment lines of the current family, until one of its samples is kept
+    header = []
+    for line in text.split(b'\n'):
+        if not line:
+            continue
+        if line.startswith(b'#'):
+            if line.startswith(b'# HELP '):
+                header = []
+            header.append(line)
+            continue
+        name = re.split(b'[{ ]', line, maxsplit=1)[0]
+        if name not in matched:
+            matched[name] = keep(_text(name))
+        if matched[name]:
+            kept.extend(header)
+            header = []
+            kept.append(line)
+    if not kept:
+        return b''
+    return b'\n'.join(kept) + b'\n'
+
+
+def format_value(value):
+    """ format a sample value like the Go client does """
+    value = float(value)
+    if value == float('inf'):
+        return u'+Inf'
+    if value == float('-inf'):
+        return u'-Inf'
+    if math.isnan(value):
+        return u'NaN'
+    return six.text_type(repr(value))
+
+
+def escape_help(text):
+    return text.replace(u'\\', u'\\\\').replace(u'\n', u'\\n')
+
+
+def _text(value):
+    if isinstance(value, six.binary_type):
+        return value.decode('utf-8')
+    return six.text_type(value)
+
+
+class LabelEscaper(dict):
+    """ memo of escaped label values: the same values (region, states,
+        hosts, projects) come back in most rows
+    """
+
+    def __missing__(self, value):
+        escaped = _text(value).replace(u'\\', u'\\\\').replace(
+            u'\n', u'\\n').replace(u'"', u'\\"')
+        self[value] = escaped
+        return escaped
+
+
+def encode(families, out=None):
+    """ write the text exposition of families to out, a binary file like
+        object, and return it or the encoded bytes if out is None
+    """
+    buffer = io.BytesIO() if out is None else out
+    escape = LabelEscaper()
+    # name -> (header lines, label prefixes, sample lines) of each family
+    grouped = OrderedDict()
+    for family in families:
+        name = _text(family.name)
+        group = grouped.get(name)
+        if group is None:
+            header = [
+                u'# HELP {} {}\n'.format(
+                    name, escape_help(_text(family.documentation))),
+                u'# TYPE {} {}\n'.format(name, family.type)]
+            group = grouped[name] = (header, {}, [])
+        _, prefixes, lines = group
+        labels = tuple(family.labels)
+        prefix = prefixes.get(labels)
+        if prefix is None:
+            # "name{label1=\"", "\",label2=\"", ... "\"} " around the values
+            prefix = prefixes[labels] = [
+                u'{}{{{}="'.format(name, labels[0]) if labels else name,
+                [u'",{}="'.format(label) for label in labels[1:]]]
+        start, separators = prefix
+        append = lines.append
+        if labels:
+            for label_values, value in family.rows:
+                values = [escape[v] for v in label_values]
+                parts = [start, values[0]]
+                for separator, label_value in zip(separators, values[1:]):
+                    parts.append(separator)
+                    parts.append(label_value)
+                parts.append(u'"} ')
+                parts.append(format_value(value))
+                parts.append(u'\n')
+                append(u''.join(parts))
+        else:
+            for _, value in family.rows:
+                append(u'{} {}\n'.format(start, format_value(value)))
+
+    for header, _, lines in grouped.values():
+        buffer.write(u''.join(header + lines).encode('utf-8'))
+    if out is None:
+        return buffer.getvalue()
+    return out
@@ -1,63 +1,89 @@
 from base import OSBase
 from collections import defaultdict
-from osclient import session_adapter
+from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
+from osclient import get_json, session_adapter
 from os import environ
-from prometheus_client import CollectorRegistry, generate_latest, Gauge
+from exposition import MetricFamily
+from records import Record
 import logging
 import re
+import sharding
 
 logger = logging.getLogger(__name__)
 
 GRANULARITY = 60
-FILL = 'null'
 AGGREGATION_METHOD = 'mean'
+# Only the latest measures are used, fetch the last few points of each
+# metric in batches of BATCH_SIZE metrics, BATCH_CONCURRENCY at a time.
+WINDOW_SECONDS = 5 * GRANULARITY
+BATCH_SIZE = 200
+BATCH_CONCURRENCY = 4
 LABELS = ['region', 'stat_name', 'gpu_type', 'gpu_index']
 
 
+class GPUStat(Record):
+    __slots__ = ('stat_name', 'stat_value', 'gpu_type', 'gpu_index')
+
+
 class GPUStats(OSBase):
-    """Class to report the statistics on NVIDIA GPUs"""
+    """Class to report the statistics on NVIDIA GPUs
+
+    Each shard averages the GPUs of its own Gnocchi resources, the
+    gpu_count series gives the weight of each shard.
+    """
+    SHARDED = True
 
     def __init__(self, oscache, osclient):
         super(GPUStats, self).__init__(oscache, osclient)
 
-        self.gnocchi_api = session_adapter('metric')
+        self.gnocchi_api = session_adapter('metric', osclient.region)
 
     def build_cache_data(self):
         """Return list of stats to cache"""
         cache_stats = []
-
-        for gpu_type, metrics in self.get_metrics_by_gpu_type().items():
+        metrics_by_gpu_type = self.get_metrics_by_gpu_type()
+        latest_measures = self.get_latest_measures([
+            metric_id
+            for metrics in metrics_by_gpu_type.values()
+            for gpu_indices in metrics.values()
+            for metric_ids in gpu_indices.values()
+            for metric_id in metric_ids])
+
+        for gpu_type, metrics in metrics_by_gpu_type.items():
             iter = 0
 
             for metric, gpu_indices in metrics.items():
                 metric_name = str(metric).split('.')[-1]
 
                 for gpu, metric_ids in gpu_indices.items():
-                    stat = dict(
-                        stat_name=metric_name,
-                        gpu_type=gpu_type,
-                        gpu_index=gpu)
-
-                    stat['stat_value'] = self.get_aggregate(metric_ids)
-                    cache_stats.append(stat)
+                    values = [
+                        latest_measures[metric_id]
+                        for metric_id in metric_ids
+                        if metric_id in latest_measures]
+
+                    if values:
+                        cache_stats.append(GPUStat(
+                            stat_name=metric_name,
+                            gpu_type=gpu_type,
+                            gpu_index=gpu,
+                            stat_value=float(sum(values)) / len(values)))
 
                     # Add gpu count if first iteration
                     if iter == 0:
-                        count = dict(
+                        cache_stats.append(GPUStat(
                             stat_name='gpu_count',
                             gpu_type=gpu_type,
-                            gpu_index=gpu)
-
-                        count['stat_value'] = len(metric_ids)
-                        cache_stats.append(count)
+                            gpu_index=gpu,
+                            stat_value=len(metric_ids)))
                 iter += 1
 
         return list(cache_stats)
 
     def get_gpu_type_by_resource_id(self):
         """Return dict of blazar hosts by hypervisor hostname."""
-        blazar_api = session_adapter('reservation')
-        hosts = blazar_api.get('os-hosts?detail=True').json()['hosts']
+        hosts = get_json('reservation', 'os-hosts?detail=True',
+                         self.osclient.region)['hosts']
 
         return {
             h['hypervisor_hostname']: h['node_type']
@@ -73,7 +99,7 @@ class GPUStats(OSBase):
         resource_gpu_types = self.get_gpu_type_by_resource_id()
         metrics_by_gpu_type = {}
 
-        for resource in resources:
+        for resource in sharding.owned(resources, key=lambda r: r['id']):
             resource_id = resource['id']
             gpu_type = resource_gpu_types[resource_id]
 
@@ -93,38 +119,62 @@ class GPUStats(OSBase):
 
         return metrics_by_gpu_type
 
-    def get_aggregate(self, metric_ids):
-        """Get aggregation measures for one or more metrics."""
-        metric_params = 'metric={}'.format('&metric='.join(metric_ids))
-        aggregation_param = 'aggregation={}'.format(AGGREGATION_METHOD)
-        fill_param = 'fill={}'.format(FILL)
-        granularity_param = 'granularity={}'.format(str(GRANULARITY))
-
-        url = "{endpoint}?{metrics}&{aggregation}&{fill}&{granularity}".format(
-            endpoint='v1/aggregation/metric',
-            metrics=metric_params,
-            aggregation=aggregation_param,
-            fill=fill_param,
-            granularity=granularity_param)
-
-        req = self.gnocchi_api.get(url)
-        stat_value = req.json()[-1][-1]
-
-        return stat_value
+    def get_latest_measures(self, metric_ids):
+        """Return dict of the latest measure of each metric.
+
+        Metrics without a measure in the last WINDOW_SECONDS are left out.
+        """
+        batches = [
+            metric_ids[i:i + BATCH_SIZE]
+            for i in range(0, len(metric_ids), BATCH_SIZE)]
+        if not batches:
+            return {}
+
+        pool = ThreadPool(min(BATCH_CONCURRENCY, len(batches)))
+        try:
+            results = pool.map(self.get_batch_measures, batches)
+        finally:
+            pool.close()
+
+        latest_measures = {}
+        for result in results:
+            latest_measures.update(result)
+        return latest_measures
+
+    def get_batch_measures(self, metric_ids):
+        """Get the latest measures of a batch of metrics in one request."""
+        start = datetime.utcnow() - timedelta(seconds=WINDOW_SECONDS)
+        operations = '(metric {})'.format(' '.join(
+            '({} {})'.format(metric_id, AGGREGATION_METHOD)
+            for metric_id in metric_ids))
+
+        req = self.gnocchi_api.post(
+            'v1/aggregates',
+            params={
+                'start': start.strftime('%Y-%m-%dT%H:%M:%S'),
+                'granularity': GRANULARITY},
+            json={'operations': operations})
+        measures = req.json()
+        measures = measures.get('measures', measures)
+
+        latest_measures = {}
+        for metric_id, aggregations in measures.items():
+            points = [
+                point for point in aggregations.get(AGGREGATION_METHOD, [])
+                if point[-1] is not None]
+            if points:
+                latest_measures[metric_id] = points[-1][-1]
+        return latest_measures
 
     def get_cache_key(self):
         return 'gpu_stats'
 
-    def get_stats(self):
-        registry = CollectorRegistry()
-        gpu_stats_cache = self.get_cache_data()
-        for gpu_stat in gpu_stats_cache:
-            stat_gauge = Gauge(
-                'gnocchi_gpu_stats',
-                'Gnocchi GPU statistics',
-                LABELS,
-                registry=registry)
-            label_values = [self.osclient.region] + [
-                gpu_stat.get(x, '') for x in LABELS[1:]]
-            stat_gauge.labels(*label_values).set(gpu_stat['stat_value'])
-        return generate_latest(registry)
+    def get_metric_families(self):
+        region = self.osclient.region
+        yield MetricFamily(
+            'gnocchi_gpu_stats',
+            'Gnocchi GPU statistics',
+            LABELS,
+            [((region, ) + tuple(gpu_stat.get(x, '') for x in LABELS[1:]),
+              gpu_stat['stat_value'])
+             for gpu_stat in self.get_cache_data()])
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# Copyright 2017 The Openstack-Helm Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Latency, size and status of the requests sent to the upstream APIs.
+
+Every session of the exporter mounts InstrumentedHTTPAdapter, which times
+each request including the download of its body. Requests are labeled with
+the region and service type owning the URL and the path relative to the
+service endpoint, with ids replaced by '{id}'. Requests outside of the
+path of every endpoint, like the root URL of an API, are labeled with the
+service listening on their host and port. The endpoints of the service
+types are learned from the catalogs of the Keystone token responses going
+through the adapter, or registered with register_endpoint(). An endpoint
+listed in several regions is labeled with an empty region.
+"""
+
+from prometheus_client import CollectorRegistry, generate_latest
+from prometheus_client import Counter, Histogram
+from requests.adapters import HTTPAdapter
+from six.moves.urllib import parse as urlparse
+from threading import Lock
+from time import time
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+                   30.0, 60.0)
+LABELS = ['region', 'service', 'endpoint']
+# uuids, with or without dashes, and numeric ids
+ID_PATTERN = re.compile(
+    r'^([0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?'
+    r'[0-9a-fA-F]{12}|[0-9]+)$')
+
+registry = CollectorRegistry()
+request_duration = Histogram(
+    'openstack_exporter_upstream_request_duration_seconds',
+    'Duration of the requests to the OpenStack APIs in seconds, including '
+    'the download of the response.',
+    LABELS, buckets=LATENCY_BUCKETS, registry=registry)
+response_bytes = Counter(
+    'openstack_exporter_upstream_response_bytes_total',
+    'Size of the responses of the OpenStack APIs.',
+    LABELS, registry=registry)
+responses = Counter(
+    'openstack_exporter_upstream_responses_total',
+    'Responses of the OpenStack APIs by status code, requests that got no '
+    'response are counted with code "error".',
+    LABELS + ['code'], registry=registry)
+
+_endpoints_lock = Lock()
+# (scheme, netloc, path prefix, service type, region), longest prefixes
+# first
+_endpoints = []
+# service types found in a Keystone catalog
+_catalog_types = set(['identity'])
+
+
+def register_endpoint(url, service_type, region=''):
+    """ label the requests sent under url with service_type and region """
+    url = urlparse.urlparse(url)
+    location = (url.scheme, url.netloc, url.path.rstrip('/'), service_type)
+    with _endpoints_lock:
+        for i, endpoint in enumerate(_endpoints):
+            if endpoint[:4] != location:
+                continue
+            if endpoint[4] != region:
+                # shared by several regions
+                _endpoints[i] = location + ('', )
+            return
+        _endpoints.append(location + (region, ))
+        _endpoints.sort(key=lambda e: len(e[2]), reverse=True)
+
+
+def register_catalog(catalog):
+    """ register the endpoints of a Keystone v3 service catalog """
+    for service in catalog:
+        with _endpoints_lock:
+            _catalog_types.add(service['type'])
+        for endpoint in service.get('endpoints', []):
+            if endpoint.get('url'):
+                register_endpoint(
+                    endpoint['url'], service['type'],
+                    endpoint.get('region_id') or endpoint.get('region') or
+                    '')
+
+
+def classify(url):
+    """ return the (region, service type, normalized endpoint) of url """
+    url = urlparse.urlparse(url)
+    path = url.path.rstrip('/')
+    region = ''
+    service_type = 'unknown'
+    with _endpoints_lock:
+        endpoints = list(_endpoints)
+    # the endpoint with the shortest prefix on the same host, for requests
+    # outside of the catalog prefixes like the root URL of an API
+    host_endpoint = None
+    for scheme, netloc, prefix, endpoint_type, endpoint_region in endpoints:
+        if (scheme, netloc) != (url.scheme, url.netloc):
+            continue
+        if path == prefix or path.startswith(prefix + '/'):
+            region = endpoint_region
+            service_type = endpoint_type
+            path = path[len(prefix):]
+            break
+        host_endpoint = (endpoint_region, endpoint_type)
+    else:
+        if host_endpoint is not None:
+            region, service_type = host_endpoint
+    segments = [
+        '{id}' if ID_PATTERN.match(segment) else segment
+        for segment in path.split('/') if segment]
+    endpoint = '/'.join(segments) or '/'
+    if service_type == 'unknown' and endpoint.endswith('auth/tokens'):
+        # the token is requested before the catalog is known
+        service_type, endpoint = 'identity', 'auth/tokens'
+    return region, service_type, endpoint
+
+
+def is_catalog_service(service_type):
+    with _endpoints_lock:
+        return service_type in _catalog_types
+
+
+def observe(region, service_type, endpoint, code, duration, size):
+    labels = (region, service_type, endpoint)
+    request_duration.labels(*labels).observe(duration)
+    response_bytes.labels(*labels).inc(size)
+    responses.labels(*(labels + (str(code), ))).inc()
+
+
+def get_stats():
+    return generate_latest(registry)
+
+
+class InstrumentedHTTPAdapter(HTTPAdapter):
+    """ HTTPAdapter recording the latency, size and status of requests """
+
+    def send(self, request, stream=False, **kwargs):
+        region, service_type, endpoint = classify(request.url)
+        start_time = time()
+        try:
+            response = super(InstrumentedHTTPAdapter, self).send(
+                request, stream=stream, **kwargs)
+            size = 0
+            if not stream:
+                # read the body here so that its download is timed
+                size = len(response.content)
+        except Exception:
+            observe(region, service_type, endpoint, 'error',
+                    time() - start_time, 0)
+            raise
+        observe(region, service_type, endpoint, response.status_code,
+                time() - start_time, size)
+
+        if (request.method == 'POST' and endpoint.endswith('auth/tokens') and
+                response.status_code == 201 and not stream):
+            self._register_token_catalog(response)
+        return response
+
+    def _register_token_catalog(self, response):
+        try:
+            catalog = response.json()['token'].get('catalog', [])
+        except (ValueError, KeyError, TypeError):
+            return
+        register_catalog(catalog)
@@ -14,15 +14,28 @@
 # limitations under the License.
 
 from base import OSBase
+import sharding
 
-from prometheus_client import CollectorRegistry, generate_latest, Gauge
+from array import array
+from collections import defaultdict
+from records import Record
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+class HypervisorStat(Record):
+    __slots__ = ('stat_name', 'stat_value', 'host', 'aggregate',
+                 'aggregate_id')
+
+
 class HypervisorStats(OSBase):
-    """ Class to report the statistics on Nova hypervisors."""
+    """ Class to report the statistics on Nova hypervisors.
+
+    Each shard reports its own hypervisors, the aggregates and totals
+    covering all of them are reported by the leader.
+    """
+    SHARDED = True
     VALUE_MAP = {
         'current_workload': 'running_tasks',
         'running_vms': 'running_instances',
@@ -45,106 +58,91 @@ class HypervisorStats(OSBase):
 
     def build_cache_data(self):
         cache_stats = []
-        nova_aggregates = {}
-        r = self.osclient.get('nova', 'os-aggregates')
-        if not r:
+        # aggregate name -> id, and short host name -> aggregate names
+        aggregate_ids = {}
+        host_aggregates = defaultdict(list)
+        aggregates = self.osclient.get_json('nova', 'os-aggregates')
+        if not aggregates:
             logger.warning("Could not get nova aggregates")
         else:
-            aggregates_list = r.json().get('aggregates', [])
+            aggregates_list = aggregates.get('aggregates', [])
             for agg in aggregates_list:
-                nova_aggregates[agg['name']] = {
-                    'id': agg['id'],
-                    'hosts': [h.split('.')[0] for h in agg['hosts']],
-                    'metrics': {'free_vcpus': 0},
-                }
-                nova_aggregates[agg['name']]['metrics'].update(
-                    {v: 0 for v in self.VALUE_MAP.values()}
-                )
-
-        r = self.osclient.get('nova', 'os-hypervisors/detail')
-        if not r:
-            logger.warning("Could not get hypervisor statistics")
-            return
-
-        total_stats = {v: 0 for v in self.VALUE_MAP.values()}
-        total_stats['free_vcpus'] = 0
-        hypervisor_stats = r.json().get('hypervisors', [])
+                aggregate_ids[agg['name']] = agg['id']
+                for h in set(h.split('.')[0] for h in agg['hosts']):
+                    host_aggregates[h].append(agg['name'])
+
+        # Hypervisors are paginated from microversion 2.33
+        hypervisor_stats = self.osclient.paginate(
+            'nova', 'os-hypervisors/detail', 'hypervisors',
+            headers={'OpenStack-API-Version': 'compute 2.33'})
+
+        # One column per metric, one row per hypervisor, and the rows of the
+        # hypervisors of each aggregate.
+        metric_names = sorted(self.VALUE_MAP.values()) + ['free_vcpus']
+        columns = {v: array('d') for v in metric_names}
+        hosts = []
+        aggregate_rows = {agg: array('l') for agg in aggregate_ids}
         for stats in hypervisor_stats:
             host = stats['hypervisor_hostname']
-            for k, v in self.VALUE_MAP.iteritems():
-                m_val = stats.get(k, 0)
-                cache_stats.append({
-                    'stat_name': v,
-                    'stat_value': m_val,
-                    'host': host,
-                })
-                total_stats[v] += m_val
-                for agg in nova_aggregates.keys():
-                    agg_hosts = nova_aggregates[agg]['hosts']
-                    if host in agg_hosts:
-                        nova_aggregates[agg]['metrics'][v] += m_val
+            row = len(hosts)
+            hosts.append(host)
+            for k, v in self.VALUE_MAP.items():
+                columns[v].append(stats.get(k, 0))
             m_vcpus = stats.get('vcpus', 0)
             m_vcpus_used = stats.get('vcpus_used', 0)
-            free = (int(self.cpu_overcommit_ratio * m_vcpus)) - m_vcpus_used
-            cache_stats.append({
-                'stat_name': 'free_vcpus',
-                'stat_value': free,
-                'host': host,
-            })
-            total_stats['free_vcpus'] += free
-            for agg in nova_aggregates.keys():
-                agg_hosts = nova_aggregates[agg]['hosts']
-                if host in agg_hosts:
-                    free = ((int(self.extra_config['cpu_ratio'] *
-                                 m_vcpus)) -
-                            m_vcpus_used)
-                    nova_aggregates[agg]['metrics']['free_vcpus'] += free
+            columns['free_vcpus'].append(
+                int(self.cpu_overcommit_ratio * m_vcpus) - m_vcpus_used)
+            for agg in host_aggregates.get(host.split('.')[0], ()):
+                aggregate_rows[agg].append(row)
+
+        owned_rows = [
+            row for row, host in enumerate(hosts) if sharding.owns(host)]
+        for v in metric_names:
+            column = columns[v]
+            for row in owned_rows:
+                cache_stats.append(HypervisorStat(
+                    stat_name=v,
+                    stat_value=column[row],
+                    host=hosts[row]))
+        if not sharding.is_leader():
+            return cache_stats
 
         # Dispatch the aggregate metrics
-        for agg in nova_aggregates.keys():
-            agg_id = nova_aggregates[agg]['id']
+        for agg, rows in aggregate_rows.items():
+            agg_id = aggregate_ids[agg]
+            metrics = {
+                v: sum(columns[v][row] for row in rows)
+                for v in metric_names}
             agg_total_free_ram = (
-                nova_aggregates[agg]['metrics']['free_ram_MB'] +
-                nova_aggregates[agg]['metrics']['used_ram_MB']
-            )
+                metrics['free_ram_MB'] + metrics['used_ram_MB'])
             if agg_total_free_ram > 0:
-                nova_aggregates[agg]['metrics']['free_ram_percent'] = round(
-                    (100.0 * nova_aggregates[agg]['metrics']['free_ram_MB']) /
-                    agg_total_free_ram,
+                metrics['free_ram_percent'] = round(
+                    (100.0 * metrics['free_ram_MB']) / agg_total_free_ram,
                     2)
-            for k, v in nova_aggregates[agg]['metrics'].iteritems():
-                cache_stats.append({
-                    'stat_name': 'aggregate_{}'.format(k),
-                    'stat_value': v,
-                    'aggregate': agg,
-                    'aggregate_id': agg_id,
-                })
+            for k, v in metrics.items():
+                cache_stats.append(HypervisorStat(
+                    stat_name='aggregate_{}'.format(k),
+                    stat_value=v,
+                    aggregate=agg,
+                    aggregate_id=agg_id))
         # Dispatch the global metrics
-        for k, v in total_stats.iteritems():
-            cache_stats.append({
-                'stat_name': 'total_{}'.format(k),
-                'stat_value': v,
-            })
+        for v in metric_names:
+            cache_stats.append(HypervisorStat(
+                stat_name='total_{}'.format(v),
+                stat_value=sum(columns[v])))
 
         return cache_stats
 
     def get_cache_key(self):
         return "hypervisor_stats"
 
-    def get_stats(self):
-        registry = CollectorRegistry()
+    def get_metric_families(self):
         labels = ['region', 'host', 'aggregate', 'aggregate_id']
-        hypervisor_stats_cache = self.get_cache_data()
-        for hypervisor_stat in hypervisor_stats_cache:
-            stat_gauge = Gauge(
-                self.gauge_name_sanitize(
-                    hypervisor_stat['stat_name']),
-                'Openstack Hypervisor statistic',
-                labels,
-                registry=registry)
-            label_values = [self.osclient.region,
-                            hypervisor_stat.get('host', ''),
-                            hypervisor_stat.get('aggregate', ''),
-                            hypervisor_stat.get('aggregate_id', '')]
-            stat_gauge.labels(*label_values).set(hypervisor_stat['stat_value'])
-        return generate_latest(registry)
+        region = self.osclient.region
+        return self.stat_families(
+            self.get_cache_data(),
+            'Openstack Hypervisor statistic',
+            labels,
+            lambda stat: (region, stat.get('host', ''),
+                          stat.get('aggregate', ''),
+                          stat.get('aggregate_id', '')))
@@ -1,7 +1,6 @@
 from base import OSBase
-from osclient import session_adapter
-from prometheus_client import CollectorRegistry, generate_latest
-from prometheus_client import Counter as prometheus_counter
+from exposition import MetricFamily
+from osclient import get_paginated
 from utils import node_details
 from datetime import datetime, timedelta
 from collections import Counter, namedtuple
@@ -20,54 +19,64 @@ class LaunchFailures(OSBase):
 
     def __init__(self, oscache, osclient):
         super(LaunchFailures, self).__init__(oscache, osclient)
-        self.refresh_interval = oscache.refresh_interval
-        self.registry = CollectorRegistry()
+        self.refresh_interval = oscache.interval_for(self.get_cache_key())
+        # launch failures counted since startup, by label values
         self.project_counters = {}
+        # High-water mark per source: the latest update time processed and
+        # the ids updated at that time, so that records updated in the same
+        # second are not counted twice. The first window covers one
+        # refresh interval, like a regular refresh.
+        start = datetime.utcnow().replace(microsecond=0) - timedelta(
+            0, self.refresh_interval)
+        self.cursors = {
+            'compute': (start, frozenset()),
+            'baremetal': (start, frozenset()),
+        }
 
     def build_cache_data(self):
         """
         Return list of stats to cache.
 
-        TODO>> Add prometheus Counter paradigm to main functionality.
-
-        This does not return items to cache because prometheus Counter cannnot
-        be cached. However, this function is called in the main workflow to
+        This does not return items to cache because the failures are
+        counted. However, this function is called in the main workflow to
         initiate scraping of data so rather than return a list of data to
-        cache, it creates new prometheus counters or increments counters
-        stored in the object itself. This way get_stats need only return
-        what is generated from the registry.
+        cache, it increments the counters stored in the object itself. This
+        way get_metric_families need only return the counters.
         """
         launch_failures = self.get_launch_failures()
 
         for launch_failure in launch_failures:
-            label_values = [self.osclient.region] + [
-                getattr(launch_failure, x, '') for x in LABELS[1:]]
-            if launch_failure.project_id in self.project_counters:
-                self.project_counters[launch_failure.project_id].labels(
-                    *label_values).inc(launch_failure.stat_value)
-            else:
-                stat_counter = prometheus_counter(
-                    'launch_failure',
-                    'OpenStack Launch Failures by Project',
-                    LABELS,
-                    registry=self.registry)
-                stat_counter.labels(*label_values).inc(
-                    launch_failure.stat_value)
-                self.project_counters[
-                    launch_failure.project_id] = stat_counter
+            label_values = (self.osclient.region, ) + tuple(
+                getattr(launch_failure, x, '') for x in LABELS[1:])
+            self.project_counters[label_values] = self.project_counters.get(
+                label_values, 0) + launch_failure.stat_value
         return []
 
     def get_launch_failures(self):
-        """Return list of stats to cache."""
-        nova_api = session_adapter('compute')
-        keystone_api = session_adapter('identity')
-
-        nodes = node_details.get_nodes(detail=True)
-        servers = nova_api.get(
-            'servers/detail?all_tenants=True').json()['servers']
+        """Return list of stats to cache.
 
-        projects = keystone_api.get('v3/projects').json()['projects']
-        project_names = {p['id']: p['name'] for p in projects}
+        Only servers and nodes updated since the previous refresh are
+        processed. The cursors are moved forward once both sources have
+        been read, so a failed refresh is retried from the same point.
+        """
+        since = self.cursors['compute'][0]
+        servers = get_paginated(
+            'compute', 'servers/detail', 'servers',
+            params={
+                'all_tenants': True,
+                'changes-since': since.strftime('%Y-%m-%dT%H:%M:%SZ')},
+            region=self.osclient.region)
+        changed_servers, compute_cursor = self._changes(
+            'compute',
+            ((s['id'], s['updated'], s) for s in servers))
+
+        nodes = node_details.get_nodes(
+            detail=True, region=self.osclient.region)
+        changed_nodes, baremetal_cursor = self._changes(
+            'baremetal',
+            ((n.uuid, n.updated_at, n) for n in nodes))
+
+        project_names = node_details.get_project_names(self.osclient.region)
 
         LaunchFailure = namedtuple(
             'LaunchFailure',
@@ -78,29 +87,52 @@ class LaunchFailures(OSBase):
                 s['tenant_id'],
                 project_names.get(s['tenant_id']),
                 None)
-            for s in servers
-            if self._valid_failure(s['status'] == 'ERROR', s['updated'])]
+            for s in changed_servers
+            if s['status'] == 'ERROR']
 
         node_failures = [
             LaunchFailure(n.project_id, n.project_name, None)
-            for n in nodes
-            if self._valid_failure(n.last_error is not None, n.updated_at)
-        ]
+            for n in changed_nodes
+            if n.last_error is not None]
+
+        self.cursors['compute'] = compute_cursor
+        self.cursors['baremetal'] = baremetal_cursor
 
         return [
             k._replace(stat_value=v) for k, v
             in Counter(instance_failures + node_failures).items()]
 
-    def _valid_failure(self, error, update_time):
-        update_time = datetime.strptime(
-            update_time[:19], '%Y-%m-%dT%H:%M:%S')
-        time_since_scrape = (
-            datetime.utcnow() - timedelta(0, self.refresh_interval))
+    def _changes(self, source, records):
+        """Return the records updated after the cursor of source and the
+        cursor moved to the latest of them.
 
-        return error and (update_time > time_since_scrape)
+        records yields (id, update time, record) tuples.
+        """
+        since, seen = self.cursors[source]
+        latest, latest_ids = since, set(seen)
+        changed = []
+        for record_id, update_time, record in records:
+            if update_time is None:
+                continue
+            update_time = datetime.strptime(
+                update_time[:19], '%Y-%m-%dT%H:%M:%S')
+            if update_time < since or (
+                    update_time == since and record_id in seen):
+                continue
+            if update_time > latest:
+                latest, latest_ids = update_time, set()
+            if update_time == latest:
+                latest_ids.add(record_id)
+            changed.append(record)
+        return changed, (latest, frozenset(latest_ids))
 
     def get_cache_key(self):
         return 'launch_failures'
 
-    def get_stats(self):
-        return generate_latest(self.registry)
+    def get_metric_families(self):
+        yield MetricFamily(
+            'launch_failure',
+            'OpenStack Launch Failures by Project',
+            LABELS,
+            list(self.project_counters.items()),
+            'counter')
@@ -14,74 +14,100 @@
 # limitations under the License.
 
 import argparse
+import importlib
 import yaml
 import os
-import urlparse
-from BaseHTTPServer import BaseHTTPRequestHandler
-from BaseHTTPServer import HTTPServer
-from SocketServer import ForkingMixIn
-from prometheus_client import CONTENT_TYPE_LATEST
+import signal
+from collections import OrderedDict
+from threading import Thread
+from time import time
 
+import circuit_breaker
+import sharding
 from osclient import OSClient
+from osclient import configure_sessions
 from oscache import OSCache
-from check_os_api import CheckOSApi
-from neutron_agents import NeutronAgentStats
-from nova_services import NovaServiceStats
-from cinder_services import CinderServiceStats
-from hypervisor_stats import HypervisorStats
-from node_stats import NodeStats
-from gpu_stats import GPUStats
-from corsa_stats import CorsaStats
-from launch_failures import LaunchFailures
+from oscache import RegionalCaches
+from server import ForkingHTTPServer
+from server import OpenstackExporterHandler
+from server import ThreadingHTTPServer
 
 import logging
 logger = logging.getLogger(__name__)
 
-collectors = []
-
-
-class ForkingHTTPServer(ForkingMixIn, HTTPServer):
-    pass
-
-
-class OpenstackExporterHandler(BaseHTTPRequestHandler):
-    def __init__(self, *args, **kwargs):
-        BaseHTTPRequestHandler.__init__(self, *args, **kwargs)
-
-    def do_GET(self):
-        url = urlparse.urlparse(self.path)
-        if url.path == '/metrics':
-            output = ''
-            for collector in collectors:
-                try:
-                    stats = collector.get_stats()
-                    if stats is not None:
-                        output = output + stats
-                except BaseException:
-                    logger.warning(
-                        "Could not get stats for collector {}".format(
-                            collector.get_cache_key()))
-            self.send_response(200)
-            self.send_header('Content-Type', CONTENT_TYPE_LATEST)
-            self.end_headers()
-            self.wfile.write(output)
-        elif url.path == '/':
-            self.send_response(200)
-            self.end_headers()
-            self.wfile.write("""<html>
-            <head><title>OpenStack Exporter</title></head>
-            <body>
-            <h1>OpenStack Exporter</h1>
-            <p>Visit <code>/metrics</code> to use.</p>
-            </body>
-            </html>""")
-        else:
-            self.send_response(404)
-            self.end_headers()
-
-
-def handler(*args, **kwargs):
-    OpenstackExporterHandler(*args, **kwargs)
+# cache key -> (module, class) of each collector. Collectors are imported
+# only when enabled, along with the clients they need.
+COLLECTORS = OrderedDict([
+    ('node_stats', ('node_stats', 'NodeStats')),
+    ('gpu_stats', ('gpu_stats', 'GPUStats')),
+    ('check_os_api', ('check_os_api', 'CheckOSApi')),
+    ('neutron_agent_stats', ('neutron_agents', 'NeutronAgentStats')),
+    ('cinder_services_stats', ('cinder_services', 'CinderServiceStats')),
+    ('nova_services_stats', ('nova_services', 'NovaServiceStats')),
+    ('hypervisor_stats', ('hypervisor_stats', 'HypervisorStats')),
+    ('launch_failures', ('launch_failures', 'LaunchFailures')),
+    ('corsa_stats', ('corsa_stats', 'CorsaStats')),
+])
+
+
+def get_enabled_collectors(config):
+    """ names of the collectors to run, from ENABLED_COLLECTORS as a list or
+        comma separated names, all of them by default. Duplicates are dropped
+        and corsa_stats needs a switch_corsa section.
+    """
+    names = config.get('ENABLED_COLLECTORS', os.getenv('ENABLED_COLLECTORS'))
+    if names is None:
+        names = [name for name in COLLECTORS
+                 if name != 'corsa_stats' or 'switch_corsa' in config]
+    elif not isinstance(names, (list, tuple)):
+        names = names.split(',')
+    enabled = []
+    for name in names:
+        name = name.strip()
+        if name and name not in enabled:
+            enabled.append(name)
+    if 'corsa_stats' in enabled and 'switch_corsa' not in config:
+        logger.warning("corsa_stats needs a switch_corsa section, skipping")
+        enabled.remove('corsa_stats')
+    return enabled
+
+
+def load_collectors(names, oscache, osclient, arguments):
+    """ import and create the collectors named in names, with the extra
+        arguments of each collector found in arguments
+    """
+    loaded = set()
+    for name in names:
+        if name not in COLLECTORS:
+            logger.error("Unknown collector {}".format(name))
+            continue
+        if name in loaded:
+            logger.warning("collector {} is enabled twice".format(name))
+            continue
+        loaded.add(name)
+        module_name, class_name = COLLECTORS[name]
+        start_time = time()
+        module = importlib.import_module(module_name)
+        imported = time()
+        collector_class = getattr(module, class_name)
+        if not collector_class.SHARDED and not sharding.is_leader():
+            logger.info("collector {} only runs on shard 0".format(name))
+            continue
+        collector_class(oscache, osclient, *arguments.get(name, ()))
+        logger.info(
+            "collector {} imported in {:.3f}s, created in {:.3f}s".format(
+                name, imported - start_time, time() - imported))
+
+
+def shutdown(server):
+    """ stop accepting connections, the server loop must not be stopped from
+        its own thread.
+    """
+    def handle_signal(signum, frame):
+        logger.info("Received signal {}, shutting down".format(signum))
+        server.stopping = True
+        Thread(target=server.shutdown).start()
+    return handle_signal
 
 
 if __name__ == '__main__':
@@ -123,6 +149,16 @@ if __name__ == '__main__':
         'OS_USER_DOMAIN_NAME',
         os.getenv('OS_USER_DOMAIN_NAME'))
     os_region = config.get('OS_REGION_NAME', os.getenv('OS_REGION_NAME'))
+    os_regions = config.get('OS_REGIONS', os.getenv('OS_REGIONS'))
+    if not os_regions:
+        os_regions = [os_region]
+    elif not isinstance(os_regions, (list, tuple)):
+        os_regions = [
+            region.strip() for region in os_regions.split(',')
+            if region.strip()]
+    os_cross_region_totals = config.get(
+        'OS_CROSS_REGION_TOTALS',
+        os.getenv('OS_CROSS_REGION_TOTALS', 'false').lower() == 'true')
     os_timeout = config.get(
         'TIMEOUT_SECONDS', int(
             os.getenv(
@@ -131,7 +167,57 @@ if __name__ == '__main__':
         'OS_POLLING_INTERVAL', int(
             os.getenv(
                 'OS_POLLING_INTERVAL', 900)))
+    os_connection_pool_size = config.get(
+        'OS_CONNECTION_POOL_SIZE', int(
+            os.getenv(
+                'OS_CONNECTION_POOL_SIZE', 10)))
+    os_request_cache_ttl = config.get(
+        'OS_REQUEST_CACHE_TTL', int(
+            os.getenv(
+                'OS_REQUEST_CACHE_TTL', 60)))
+    os_polling_splay = config.get(
+        'OS_POLLING_SPLAY', float(
+            os.getenv(
+                'OS_POLLING_SPLAY', 0.1)))
     os_retries = config.get('OS_RETRIES', int(os.getenv('OS_RETRIES', 1)))
+    os_refresh_workers = config.get(
+        'OS_REFRESH_WORKERS', int(
+            os.getenv(
+                'OS_REFRESH_WORKERS', 4)))
+    os_collector_timeout = config.get(
+        'OS_COLLECTOR_TIMEOUT', int(
+            os.getenv(
+                'OS_COLLECTOR_TIMEOUT', os_polling_interval)))
+    os_breaker_threshold = config.get(
+        'OS_BREAKER_THRESHOLD', int(
+            os.getenv(
+                'OS_BREAKER_THRESHOLD', 5)))
+    os_breaker_backoff = config.get(
+        'OS_BREAKER_BACKOFF', int(
+            os.getenv(
+                'OS_BREAKER_BACKOFF', 30)))
+    os_breaker_max_backoff = config.get(
+        'OS_BREAKER_MAX_BACKOFF', int(
+            os.getenv(
+                'OS_BREAKER_MAX_BACKOFF', 600)))
+    os_max_staleness = config.get(
+        'OS_MAX_STALENESS', int(
+            os.getenv(
+                'OS_MAX_STALENESS', 0)))
+    os_cache_snapshot_path = config.get(
+        'OS_CACHE_SNAPSHOT_PATH', os.getenv('OS_CACHE_SNAPSHOT_PATH'))
+    os_cache_snapshot_interval = config.get(
+        'OS_CACHE_SNAPSHOT_INTERVAL', int(
+            os.getenv(
+                'OS_CACHE_SNAPSHOT_INTERVAL', 300)))
+    os_shard_index = config.get(
+        'OS_SHARD_INDEX', int(
+            os.getenv(
+                'OS_SHARD_INDEX', 0)))
+    os_shard_count = config.get(
+        'OS_SHARD_COUNT', int(
+            os.getenv(
+                'OS_SHARD_COUNT', 1)))
     os_cpu_overcomit_ratio = config.get(
         'OS_CPU_OC_RATIO', float(
             os.getenv(
@@ -141,48 +227,93 @@ if __name__ == '__main__':
             os.getenv(
                 'OS_RAM_OC_RATIO', 1)))
 
+    configure_sessions(os_connection_pool_size, os_request_cache_ttl,
+                       os_timeout)
+    circuit_breaker.configure(
+        os_breaker_threshold, os_breaker_backoff, os_breaker_max_backoff)
+    sharding.configure(os_shard_index, os_shard_count)
     osclient = OSClient(
         os_keystone_url,
         os_password,
         os_tenant_name,
         os_username,
         os_user_domain,
-        os_region,
+        os_regions[0],
         os_timeout,
         os_retries)
-    oscache = OSCache(os_polling_interval, os_region)
-    collectors.append(oscache)
-    node_stats = NodeStats(oscache, osclient)
-    collectors.append(node_stats)
-    gpu_stats = GPUStats(oscache, osclient)
-    collectors.append(gpu_stats)
-    check_os_api = CheckOSApi(oscache, osclient)
-    collectors.append(check_os_api)
-    neutron_agent_stats = NeutronAgentStats(oscache, osclient)
-    collectors.append(neutron_agent_stats)
-    cinder_service_stats = CinderServiceStats(oscache, osclient)
-    collectors.append(cinder_service_stats)
-    nova_service_stats = NovaServiceStats(oscache, osclient)
-    collectors.append(nova_service_stats)
-    hypervisor_stats = HypervisorStats(
-        oscache,
-        osclient,
-        os_cpu_overcomit_ratio,
-        os_ram_overcomit_ratio)
-    collectors.append(hypervisor_stats)
-    launch_failures = LaunchFailures(oscache, osclient)
-    collectors.append(launch_failures)
-
-    if 'switch_corsa' in config:
-        corsa_stats = CorsaStats(
-            oscache, osclient, config['switch_corsa']['switches'])
-        collectors.append(corsa_stats)
+    collector_intervals = {
+        name: options['interval']
+        for name, options in (config.get('collectors') or {}).items()
+        if options and 'interval' in options}
+
+    enabled_collectors = get_enabled_collectors(config)
+    collector_arguments = {
+        'hypervisor_stats': (os_cpu_overcomit_ratio, os_ram_overcomit_ratio),
+        'corsa_stats': ((config.get('switch_corsa') or {}).get(
+            'switches', []), ),
+    }
+
+    # One cache and set of collectors per region, the clients of all the
+    # regions share the Keystone token of the first one.
+    caches = []
+    for region in os_regions:
+        state_path = os_cache_snapshot_path
+        if state_path and len(os_regions) > 1:
+            state_path = '{}.{}'.format(state_path, region)
+        region_cache = OSCache(
+            os_polling_interval,
+            region,
+            os_refresh_workers,
+            os_collector_timeout,
+            collector_intervals,
+            os_polling_splay,
+            os_max_staleness,
+            state_path,
+            os_cache_snapshot_interval)
+        load_collectors(enabled_collectors, region_cache,
+                        osclient.for_region(region), collector_arguments)
+        caches.append(region_cache)
+    if len(caches) == 1:
+        oscache = caches[0]
+    else:
+        oscache = RegionalCaches(caches, os_cross_region_totals)
 
+    if os_cache_snapshot_path:
+        oscache.load_state()
     oscache.start()
 
     listen_port = config.get(
         'LISTEN_PORT', int(
             os.getenv(
                 'LISTEN_PORT', 9103)))
-    server = ForkingHTTPServer(('', listen_port), handler)
+    server_mode = config.get(
+        'SERVER_MODE', os.getenv('SERVER_MODE', 'threaded'))
+    max_requests = config.get(
+        'MAX_CONCURRENT_REQUESTS', int(
+            os.getenv(
+                'MAX_CONCURRENT_REQUESTS', 16)))
+    OpenstackExporterHandler.timeout = config.get(
+        'KEEPALIVE_TIMEOUT', int(
+            os.getenv(
+                'KEEPALIVE_TIMEOUT', 30)))
+    shutdown_timeout = config.get(
+        'SHUTDOWN_TIMEOUT', int(
+            os.getenv(
+                'SHUTDOWN_TIMEOUT', 10)))
+
+    if server_mode == 'forking':
+        server = ForkingHTTPServer(
+            ('', listen_port), OpenstackExporterHandler, oscache)
+    else:
+        server = ThreadingHTTPServer(
+            ('', listen_port), OpenstackExporterHandler, oscache,
+            max_requests)
+    signal.signal(signal.SIGTERM, shutdown(server))
+    signal.signal(signal.SIGINT, shutdown(server))
+
     server.serve_forever()
+    if not server.drain(shutdown_timeout):
+        logger.warning("Timed out waiting for requests in progress")
+    server.server_close()
+    if os_cache_snapshot_path:
+        oscache.save_state()
@@ -16,7 +16,7 @@
 from base import OSBase
 from collections import Counter
 from collections import defaultdict
-from prometheus_client import CollectorRegistry, generate_latest, Gauge
+from records import ServiceStat
 import logging
 
 logger = logging.getLogger(__name__)
@@ -44,40 +44,27 @@ class NeutronAgentStats(OSBase):
             totala = sum(aggregated_agents[service].values())
             for state in self.osclient.states:
                 prct = (100.0 * aggregated_agents[service][state]) / totala
-                stats.append({
-                    'stat_name': "services_{}_{}_percent".format(service, state),
-                    'stat_value': prct,
-                    'service': service,
-                    'state': state
-                })
-                stats.append({
-                    'stat_name': "services_{}_{}_total".format(service, state),
-                    'stat_value': aggregated_agents[service][state],
-                    'service': service,
-                    'state': state,
-                })
+                stats.append(ServiceStat(
+                    stat_name="services_{}_{}_percent".format(service, state),
+                    stat_value=prct,
+                    service=service,
+                    state=state))
+                stats.append(ServiceStat(
+                    stat_name="services_{}_{}_total".format(service, state),
+                    stat_value=aggregated_agents[service][state],
+                    service=service,
+                    state=state))
         return stats
 
     def get_cache_key(self):
         return "neutron_agent_stats"
 
-    def get_stats(self):
-        registry = CollectorRegistry()
+    def get_metric_families(self):
         labels = ['region', 'host', 'service', 'state']
-        neutron_agent_stats_cache = self.get_cache_data()
-        for neutron_agent_stat in neutron_agent_stats_cache:
-            stat_gauge = Gauge(
-                self.gauge_name_sanitize(
-                    neutron_agent_stat['stat_name']),
-                'Openstack Neutron agent statistic',
-                labels,
-                registry=registry)
-            label_values = [self.osclient.region,
-                            neutron_agent_stat.get('host', ''),
-                            neutron_agent_stat.get('service', ''),
-                            neutron_agent_stat.get('state', '')]
-            stat_gauge.labels(
-                *
-                label_values).set(
-                neutron_agent_stat['stat_value'])
-        return generate_latest(registry)
+        region = self.osclient.region
+        return self.stat_families(
+            self.get_cache_data(),
+            'Openstack Neutron agent statistic',
+            labels,
+            lambda stat: (region, stat.get('host', ''),
+                          stat.get('service', ''), stat.get('state', '')))
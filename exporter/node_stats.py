@@ -2,7 +2,9 @@ from base import OSBase
 import json
 from osclient import session_adapter, get_ironic_client
 from utils import node_details
-from prometheus_client import CollectorRegistry, generate_latest, Gauge
+import sharding
+from exposition import MetricFamily
+from records import Record
 import logging
 
 logger = logging.getLogger(__name__)
@@ -18,22 +20,30 @@ LABELS = [
     'project_name']
 
 
+class NodeStat(Record):
+    __slots__ = tuple(LABELS[1:])
+
+
 class NodeStats(OSBase):
     """Class to report the statistics on OpenStack Nodes"""
+    SHARDED = True
 
     def __init__(self, oscache, osclient):
         super(NodeStats, self).__init__(oscache, osclient)
 
     def build_cache_data(self):
         """Return list of stats to cache."""
-        nodes = node_details.get_nodes(detail=True)
+        nodes = node_details.get_nodes(
+            detail=True, region=self.osclient.region)
 
-        cache_stats = (self._apply_labels(node) for node in nodes)
+        cache_stats = (
+            self._apply_labels(node)
+            for node in sharding.owned(nodes, key=lambda n: n.uuid))
 
         return list(cache_stats)
 
     def _apply_labels(self, node):
-        return dict(
+        return NodeStat(
             name=node.name,
             node_id=node.uuid,
             maintenance=node.maintenance,
@@ -45,18 +55,12 @@ class NodeStats(OSBase):
     def get_cache_key(self):
         return 'node_stats'
 
-    def get_stats(self):
-        registry = CollectorRegistry()
-        
-        stat_gauge = Gauge(
+    def get_metric_families(self):
+        region = self.osclient.region
+        yield MetricFamily(
             'openstack_node_totals',
             'OpenStack Ironic Nodes statistic',
             LABELS,
-            registry=registry)
-
-        for node_stat in self.get_cache_data():
-            label_values = [self.osclient.region] + [
-                node_stat.get(x, '') for x in LABELS[1:]]
-            stat_gauge.labels(*label_values).set(1.0)
-
-        return generate_latest(registry)
+            [((region, ) + tuple(node_stat.get(x, '') for x in LABELS[1:]),
+              1.0)
+             for node_stat in self.get_cache_data()])
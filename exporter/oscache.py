@@ -1,82 +1,796 @@
-#!/usr/bin/env python
-# Copyright 2017 The Openstack-Helm Authors.
-#
-# Licensed under the Apache License, Version 2.0 (the "License");
-# you may not use this file except in compliance with the License.
-# You may obtain a copy of the License at
-#
-#     http://www.apache.org/licenses/LICENSE-2.0
-#
-# Unless required by applicable law or agreed to in writing, software
-# distributed under the License is distributed on an "AS IS" BASIS,
-# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
-# See the License for the specific language governing permissions and
-# limitations under the License.
-
-from threading import Thread
-from threading import Lock
-from prometheus_client import CollectorRegistry, generate_latest, Gauge
-from time import sleep, time
-import logging
-
-logger = logging.getLogger(__name__)
-
-
-class ThreadSafeDict(dict):
-    def __init__(self, * p_arg, ** n_arg):
-        dict.__init__(self, * p_arg, ** n_arg)
-        self._lock = Lock()
-
-    def __enter__(self):
-        self._lock.acquire()
-        return self
-
-    def __exit__(self, type, value, traceback):
-        self._lock.release()
-
-
-class OSCache(Thread):
-
-    def __init__(self, refresh_interval, region):
-        Thread.__init__(self)
-        self.daemon = True
-        self.duration = 0
-        self.refresh_interval = refresh_interval
-        self.cache = ThreadSafeDict()
-        self.region = region
-        self.osclients = []
-
-    def cache_me(self, osclient):
-        self.osclients.append(osclient)
-        logger.debug("new osclient added to cache")
-
-    def run(self):
-        while True:
-            start_time = time()
-            for osclient in self.osclients:
-                try:
-                    self.cache[osclient.get_cache_key(
-                    )] = osclient.build_cache_data()
-                except Exception as e:
-                    logger.error(str(e))
-                    logger.error(
-                        "failed to get data for cache key {}".format(
-                            osclient.get_cache_key()))
-            self.duration = time() - start_time
-            sleep(self.refresh_interval)
-
-    def get_cache_data(self, key):
-        if key in self.cache:
-            return self.cache[key]
-        else:
-            return []
-
-    def get_stats(self):
-        registry = CollectorRegistry()
-        labels = ['region']
-        label_values = [self.region]
-        duration = Gauge('openstack_exporter_cache_refresh_duration_seconds',
-                         'Cache refresh duration in seconds.',
-                         labels, registry=registry)
-        duration.labels(*label_values).set(self.duration)
-        return generate_latest(registry)
+#!/usr/bin/env python
+# Copyright 2017 The Openstack-Helm Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import namedtuple
+from compression import deflate, gzip_parts
+import circuit_breaker
+import http_metrics
+from records import footprint
+from multiprocessing.pool import ThreadPool
+from threading import Thread
+from threading import Lock
+from prometheus_client import CollectorRegistry, generate_latest
+from prometheus_client import Counter, Gauge
+from six.moves import cPickle as pickle
+from time import sleep, time
+import heapq
+import logging
+import os
+import random
+import tempfile
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+class Snapshot(namedtuple('Snapshot', [
+        'generation', 'parts', 'length', 'gzip_parts', 'gzip_length',
+        'etag'])):
+    """ A rendered /metrics body. Snapshots are immutable: a new one is
+        published whenever a collector's cache entry changes, and readers
+        only ever swap the reference, so they never need the cache lock.
+
+        The body is kept as the list of the parts rendered by each
+        collector, with its length, so that it is written out part by part
+        without ever being copied into a single string.
+    """
+    __slots__ = ()
+
+    @property
+    def body(self):
+        return b''.join(self.parts)
+
+    @property
+    def gzip_body(self):
+        return b''.join(self.gzip_parts)
+
+
+def make_snapshot(generation, parts, deflated_parts, etag):
+    """ return the snapshot of parts, with deflated_parts their deflate()
+        output
+    """
+    gzipped = gzip_parts(parts, deflated_parts)
+    return Snapshot(
+        generation,
+        parts,
+        sum(len(part) for part in parts),
+        gzipped,
+        sum(len(part) for part in gzipped),
+        etag)
+
+
+# Version of the state saved on disk by OSCache.save_state
+STATE_VERSION = 1
+
+
+class ThreadSafeDict(dict):
+    def __init__(self, * p_arg, ** n_arg):
+        dict.__init__(self, * p_arg, ** n_arg)
+        self._lock = Lock()
+
+    def __enter__(self):
+        self._lock.acquire()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self._lock.release()
+
+
+class OSCache(Thread):
+
+    def __init__(self, refresh_interval, region, workers=4, timeout=None,
+                 intervals=None, splay=0, max_staleness=0,
+                 state_path=None, state_interval=300):
+        Thread.__init__(self)
+        self.daemon = True
+        self.duration = 0
+        self.refresh_interval = refresh_interval
+        self.workers = workers
+        # Deadline for a single collector, counted from the start of a cycle.
+        self.timeout = timeout if timeout else refresh_interval
+        # Per collector refresh intervals, keyed by cache key.
+        self.intervals = intervals or {}
+        self.splay = splay
+        # The last good data of a collector is served while it refreshes or
+        # fails, until it is older than max_staleness seconds (0 to keep it
+        # until the next success).
+        self.max_staleness = max_staleness
+        self.cache = ThreadSafeDict()
+        self.region = region
+        self.osclients = []
+        self.rendered = ThreadSafeDict()
+        # held from reading the rendered collectors to swapping the
+        # snapshot, the scheduler and the result thread both publish
+        self._publish_lock = Lock()
+        self.generation = 0
+        self.epoch = int(time())
+        self.snapshot = make_snapshot(0, [], [], self._etag(0))
+        # cache key -> (deadline, batch) of the collectors being refreshed
+        self.in_flight = {}
+        self.timed_out = set()
+        self._batches = {}
+        # cache key -> outcome of the latest refresh and render of each
+        # collector, both guarded by the refresh_status lock
+        self.refresh_status = ThreadSafeDict()
+        self.render_status = {}
+        # collectors refreshed successfully since the process started
+        self.refreshed = set()
+        self.started_at = time()
+        # The cache is saved to state_path every state_interval seconds and
+        # restored from it on startup.
+        self.state_path = state_path
+        self.state_interval = state_interval
+        self._saved_generation = None
+        # False when the metrics of the exporter itself are rendered by
+        # RegionalCaches for all the regions
+        self.exporter_stats = True
+
+    def cache_me(self, osclient):
+        self.osclients.append(osclient)
+        logger.debug("new osclient added to cache")
+
+    def run(self):
+        pool = ThreadPool(self.workers)
+        # heap of (next due time, order, collector)
+        schedule = []
+        now = time()
+        for seq, osclient in enumerate(self.first_refresh_order()):
+            heapq.heappush(schedule, (now, seq, osclient))
+        next_save = now + self.state_interval
+        while True:
+            now = time()
+            due = []
+            while schedule and schedule[0][0] <= now:
+                _, seq, osclient = heapq.heappop(schedule)
+                due.append(osclient)
+                heapq.heappush(
+                    schedule, (now + self.next_interval(osclient), seq,
+                               osclient))
+            if due:
+                self.dispatch(pool, due)
+            self.expire()
+            self.evict_stale()
+
+            wakeup = schedule[0][0] if schedule else now + \
+                self.refresh_interval
+            eviction = self.next_eviction()
+            if eviction is not None:
+                wakeup = min(wakeup, eviction)
+            with self.refresh_status:
+                deadlines = [deadline for key, (deadline, _) in
+                             self.in_flight.items()
+                             if key not in self.timed_out]
+            if deadlines:
+                wakeup = min(wakeup, min(deadlines))
+            if self.state_path:
+                if now >= next_save:
+                    self.save_state()
+                    next_save = now + self.state_interval
+                wakeup = min(wakeup, next_save)
+            sleep(max(0, wakeup - time()))
+
+    def first_refresh_order(self):
+        """ collectors ordered so that the cheapest are refreshed first:
+            by the duration of their last refresh when it is known from a
+            saved state, then by interval
+        """
+        def cost(osclient):
+            key = osclient.get_cache_key()
+            status = self.refresh_status.get(key, {})
+            duration = status.get('duration')
+            return (duration is None, duration, self.interval_for(key))
+        return sorted(self.osclients, key=cost)
+
+    def is_ready(self):
+        """ True once every collector has been refreshed successfully
+            since startup
+        """
+        return not self.pending()
+
+    def pending(self):
+        """ cache keys of the collectors not refreshed successfully since
+            startup
+        """
+        with self.refresh_status:
+            return [osclient.get_cache_key() for osclient in self.osclients
+                    if osclient.get_cache_key() not in self.refreshed]
+
+    def failing(self):
+        """ cache key and status, failed or timeout, of the pending
+            collectors whose latest refresh did not succeed
+        """
+        pending = self.pending()
+        with self.refresh_status:
+            return [(key, self.refresh_status[key]['status'])
+                    for key in pending if key in self.refresh_status and
+                    self.refresh_status[key]['status'] != 'ok']
+
+    def interval_for(self, key):
+        return self.intervals.get(key, self.refresh_interval)
+
+    def next_interval(self, osclient):
+        """ refresh interval of a collector, randomly splayed so collectors
+            sharing an interval do not all hit the APIs at the same time
+        """
+        interval = self.interval_for(osclient.get_cache_key())
+        # nosec: the splay only spreads the load, it is not security related
+        splay = random.uniform(-self.splay, self.splay)  # nosec
+        return interval * (1 + splay)
+
+    def dispatch(self, pool, osclients):
+        """ submit collectors to the refresh pool without waiting for them.
+
+            A collector that misses its deadline keeps its worker until it
+            returns, but its result is discarded and it is not submitted
+            again until it has finished.
+        """
+        start_time = time()
+        submitted = []
+        with self.refresh_status:
+            for osclient in osclients:
+                key = osclient.get_cache_key()
+                if key in self.in_flight:
+                    logger.warning(
+                        "collector {} is still running, skipping".format(key))
+                    continue
+                self.in_flight[key] = (start_time + self.timeout, start_time)
+                submitted.append(osclient)
+            if submitted:
+                self._batches[start_time] = len(submitted)
+        for osclient in submitted:
+            pool.apply_async(self._build, (osclient, start_time),
+                             callback=self._complete)
+
+    def expire(self):
+        """ report collectors that are still running past their deadline """
+        now = time()
+        expired = []
+        with self.refresh_status:
+            for key, (deadline, batch) in self.in_flight.items():
+                if deadline <= now and key not in self.timed_out:
+                    self.timed_out.add(key)
+                    expired.append((key, batch))
+        for key, batch in expired:
+            logger.error(
+                "collector {} missed its {}s deadline".format(
+                    key, self.timeout))
+            self._report(key, 'timeout', now - batch, error='Timeout')
+            self._finish(batch)
+        if expired:
+            self.publish()
+
+    def next_eviction(self):
+        """ time at which the oldest cached data becomes too stale """
+        if not self.max_staleness:
+            return None
+        with self.refresh_status:
+            last_successes = [
+                status['last_success']
+                for key, status in self.refresh_status.items()
+                if key in self.cache and status['last_success'] is not None]
+        if not last_successes:
+            return None
+        return min(last_successes) + self.max_staleness
+
+    def evict_stale(self):
+        """ drop the data of collectors that have not refreshed
+            successfully for more than max_staleness seconds
+        """
+        if not self.max_staleness:
+            return
+        now = time()
+        with self.refresh_status:
+            stale = [
+                (key, self.cache.get(key), now - status['last_success'])
+                for key, status in self.refresh_status.items()
+                if key in self.cache and
+                status['last_success'] is not None and
+                now - status['last_success'] > self.max_staleness]
+        evicted = False
+        for key, data, age in stale:
+            with self.rendered:
+                with self.cache:
+                    # the collector may have just succeeded
+                    if self.cache.get(key) is not data:
+                        continue
+                    del self.cache[key]
+                self.rendered.pop(key, None)
+            logger.warning(
+                "dropped data of collector {}, last refreshed {:.0f}s "
+                "ago".format(key, age))
+            evicted = True
+        if evicted:
+            self.publish()
+
+    def _build(self, osclient, batch):
+        start_time = time()
+        try:
+            data = osclient.build_cache_data()
+        except Exception as e:
+            return osclient, batch, None, e, time() - start_time, 0
+        duration = time() - start_time
+        # measured here rather than in _complete, which runs in the single
+        # result thread of the pool
+        return osclient, batch, data, None, duration, footprint(data)
+
+    def _complete(self, result):
+        """ callback of the refresh pool, run in its single result thread.
+            An exception escaping it would stop that thread and every
+            later result would be lost, with the collectors left in flight.
+        """
+        key = result[0].get_cache_key()
+        batch = result[1]
+        try:
+            self._store(result)
+        except Exception:
+            logger.exception(
+                "could not store the result of collector {}".format(key))
+        finally:
+            with self.refresh_status:
+                # unless the collector was already submitted again
+                if self.in_flight.get(key, (None, None))[1] == batch:
+                    del self.in_flight[key]
+                    self.timed_out.discard(key)
+
+    def _store(self, result):
+        osclient, batch, data, error, duration, size = result
+        key = osclient.get_cache_key()
+        with self.refresh_status:
+            del self.in_flight[key]
+            late = key in self.timed_out
+            self.timed_out.discard(key)
+        if late:
+            logger.warning(
+                "discarding late result of collector {}".format(key))
+            return
+        try:
+            if error is None and data is None:
+                error = ValueError(
+                    "collector {} returned no data".format(key))
+            if error is not None:
+                # keep serving the last good data of the collector
+                logger.error(str(error))
+                logger.error(
+                    "failed to get data for cache key {}".format(key))
+                self._report(key, 'failed', duration,
+                             error=type(error).__name__)
+            else:
+                self.cache[key] = data
+                self._report(key, 'ok', duration, items=self._count(data),
+                             size=size)
+                self.render(osclient)
+        finally:
+            self._finish(batch)
+        self.publish()
+
+    def _finish(self, batch):
+        """ account for a collector of a batch, the batch duration is
+            reported once all of its collectors have completed
+        """
+        with self.refresh_status:
+            self._batches[batch] -= 1
+            if self._batches[batch] > 0:
+                return
+            del self._batches[batch]
+        self.duration = time() - batch
+
+    def _report(self, key, status, duration, items=None, error=None,
+                size=None):
+        """ record the outcome of a refresh, error is the name of the
+            exception class of a failed refresh and size the memory used
+            by the data of a successful one
+        """
+        logger.info(
+            "collector {} refresh {} after {:.3f}s".format(
+                key, status, duration))
+        now = time()
+        with self.refresh_status:
+            first_refresh = error is None and key not in self.refreshed
+            if first_refresh:
+                self.refreshed.add(key)
+            refreshed_all = first_refresh and len(self.refreshed) >= len(
+                set(osclient.get_cache_key() for osclient in self.osclients))
+            previous = self.refresh_status.get(key, {})
+            report = {
+                'status': status,
+                'duration': duration,
+                'timestamp': now,
+                'items': previous.get('items', 0),
+                'cache_bytes': previous.get('cache_bytes', 0),
+                'last_success': previous.get('last_success'),
+                'errors': dict(previous.get('errors', {})),
+            }
+            if error is None:
+                report['items'] = items
+                report['cache_bytes'] = size
+                report['last_success'] = now
+            else:
+                report['errors'][error] = report['errors'].get(error, 0) + 1
+            self.refresh_status[key] = report
+        if first_refresh:
+            logger.info(
+                "startup: first successful refresh of collector {} after "
+                "{:.3f}s, {:.3f}s after startup".format(
+                    key, duration, now - self.started_at))
+        if refreshed_all:
+            logger.info(
+                "startup: all collectors refreshed {:.3f}s after "
+                "startup".format(now - self.started_at))
+
+    @staticmethod
+    def _count(data):
+        try:
+            return len(data)
+        except TypeError:
+            return 0
+
+    def render(self, osclient):
+        """ render the exposition of a collector once per cache update """
+        key = osclient.get_cache_key()
+        start_time = time()
+        try:
+            stats = osclient.get_stats()
+        except Exception as e:
+            logger.warning(str(e))
+            logger.warning(
+                "Could not get stats for collector {}".format(key))
+            self._report_render(key, time() - start_time,
+                                error=type(e).__name__)
+            return
+        stats = stats or b''
+        deflated = deflate(stats)
+        with self.rendered:
+            generation = self.rendered.get(key, (0, ))[0] + 1
+            self.rendered[key] = (generation, stats, deflated)
+        self._report_render(key, time() - start_time, size=len(stats))
+
+    def _report_render(self, key, duration, size=None, error=None):
+        with self.refresh_status:
+            previous = self.render_status.get(key, {})
+            report = {
+                'duration': duration,
+                'bytes': previous.get('bytes', 0),
+                'errors': dict(previous.get('errors', {})),
+            }
+            if error is None:
+                report['bytes'] = size
+            else:
+                report['errors'][error] = report['errors'].get(error, 0) + 1
+            self.render_status[key] = report
+
+    def collector_keys(self):
+        return [osclient.get_cache_key() for osclient in self.osclients]
+
+    def rendered_parts(self, keys=None):
+        """ return the rendered collectors, only those of keys if given,
+            and their deflate() output
+        """
+        parts = []
+        deflated_parts = []
+        with self.rendered:
+            for osclient in self.osclients:
+                key = osclient.get_cache_key()
+                if keys is not None and key not in keys:
+                    continue
+                rendered = self.rendered.get(key)
+                if rendered is not None:
+                    parts.append(rendered[1])
+                    deflated_parts.append(rendered[2])
+        return parts, deflated_parts
+
+    def publish(self):
+        """ assemble the rendered collectors into a new snapshot, never
+            replaced by a snapshot assembled earlier
+        """
+        with self._publish_lock:
+            parts, deflated_parts = self.rendered_parts()
+            if self.exporter_stats:
+                stats = self.get_stats()
+                parts.insert(0, stats)
+                deflated_parts.insert(0, deflate(stats))
+            self.generation += 1
+            self.snapshot = make_snapshot(
+                self.generation, parts, deflated_parts,
+                self._etag(self.generation))
+
+    def get_snapshot(self):
+        return self.snapshot
+
+    def save_state(self):
+        """ write the cache, the rendered collectors and their status to
+            state_path, atomically so that a crash never leaves a partial
+            file behind
+        """
+        if self.generation == self._saved_generation:
+            return
+        generation = self.generation
+        with self.refresh_status:
+            refresh_status = dict(self.refresh_status)
+            render_status = dict(self.render_status)
+        with self.rendered:
+            rendered = dict((key, (stats, deflated)) for key, (_, stats,
+                            deflated) in self.rendered.items())
+        cache = {}
+        for key, data in list(self.cache.items()):
+            try:
+                cache[key] = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+            except Exception as e:
+                logger.warning(
+                    "Could not save data of collector {}: {}".format(key, e))
+        state = zlib.compress(pickle.dumps({
+            'version': STATE_VERSION,
+            'region': self.region,
+            'cache': cache,
+            'rendered': rendered,
+            'refresh_status': refresh_status,
+            'render_status': render_status,
+        }, pickle.HIGHEST_PROTOCOL))
+
+        directory = os.path.dirname(os.path.abspath(self.state_path))
+        try:
+            fd, path = tempfile.mkstemp(dir=directory, prefix='.oscache')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(state)
+                os.rename(path, self.state_path)
+            except Exception:
+                os.unlink(path)
+                raise
+        except (IOError, OSError) as e:
+            logger.warning("Could not save the cache to {}: {}".format(
+                self.state_path, e))
+            return
+        self._saved_generation = generation
+        logger.info("saved the cache to {} ({} bytes)".format(
+            self.state_path, len(state)))
+
+    def load_state(self):
+        """ restore the state saved by save_state with its original
+            timestamps, collectors are served from it until they refresh
+        """
+        try:
+            with open(self.state_path, 'rb') as f:
+                state = pickle.loads(zlib.decompress(f.read()))
+        except (IOError, OSError) as e:
+            logger.info("No saved cache restored from {}: {}".format(
+                self.state_path, e))
+            return False
+        except Exception as e:
+            logger.warning("Could not restore the cache from {}: {}".format(
+                self.state_path, e))
+            return False
+        if state.get('version') != STATE_VERSION or \
+                state.get('region') != self.region:
+            logger.warning("Ignoring the cache saved in {}".format(
+                self.state_path))
+            return False
+
+        keys = set(osclient.get_cache_key() for osclient in self.osclients)
+        for key, data in state['cache'].items():
+            if key in keys:
+                self.cache[key] = pickle.loads(data)
+        with self.rendered:
+            for key, (stats, deflated) in state['rendered'].items():
+                if key in keys:
+                    self.rendered[key] = (1, stats, deflated)
+        with self.refresh_status:
+            for key, status in state['refresh_status'].items():
+                if key in keys:
+                    self.refresh_status[key] = status
+            for key, status in state['render_status'].items():
+                if key in keys:
+                    self.render_status[key] = status
+        self.publish()
+        logger.info("restored {} collectors from {}".format(
+            len(self.cache), self.state_path))
+        return True
+
+    def _etag(self, generation):
+        return '"{:x}-{:x}"'.format(self.epoch, generation)
+
+    def get_cache_data(self, key):
+        if key in self.cache:
+            return self.cache[key]
+        else:
+            return []
+
+    def get_stats(self):
+        return get_exporter_stats([self])
+
+
+def get_exporter_stats(caches):
+    """ render the metrics of the exporter for the caches of all regions """
+    registry = CollectorRegistry()
+    labels = ['region']
+    duration = Gauge('openstack_exporter_cache_refresh_duration_seconds',
+                     'Cache refresh duration in seconds.',
+                     labels, registry=registry)
+
+    labels = ['region', 'collector']
+    error_labels = labels + ['exception']
+    refresh_duration = Gauge(
+        'openstack_exporter_collector_refresh_duration_seconds',
+        'Duration of the latest refresh of a collector in seconds.',
+        labels, registry=registry)
+    items = Gauge(
+        'openstack_exporter_collector_items',
+        'Number of items cached by the latest successful refresh of a '
+        'collector.',
+        labels, registry=registry)
+    last_success = Gauge(
+        'openstack_exporter_collector_last_success_timestamp_seconds',
+        'Time of the latest successful refresh of a collector.',
+        labels, registry=registry)
+    errors = Counter(
+        'openstack_exporter_collector_errors_total',
+        'Failed refreshes of a collector by exception class.',
+        error_labels, registry=registry)
+    cache_bytes = Gauge(
+        'openstack_exporter_collector_cache_bytes',
+        'Approximate memory used by the cached data of a collector.',
+        labels, registry=registry)
+    render_duration = Gauge(
+        'openstack_exporter_collector_render_duration_seconds',
+        'Duration of the latest render of a collector in seconds.',
+        labels, registry=registry)
+    rendered_bytes = Gauge(
+        'openstack_exporter_collector_rendered_bytes',
+        'Size of the latest successful render of a collector.',
+        labels, registry=registry)
+    render_errors = Counter(
+        'openstack_exporter_collector_render_errors_total',
+        'Failed renders of a collector by exception class.',
+        error_labels, registry=registry)
+
+    for oscache in caches:
+        duration.labels(oscache.region).set(oscache.duration)
+        with oscache.refresh_status:
+            refresh_status = sorted(oscache.refresh_status.items())
+            render_status = sorted(oscache.render_status.items())
+        for key, status in refresh_status:
+            label_values = [oscache.region, key]
+            refresh_duration.labels(*label_values).set(status['duration'])
+            items.labels(*label_values).set(status['items'])
+            cache_bytes.labels(*label_values).set(
+                status.get('cache_bytes', 0))
+            if status['last_success'] is not None:
+                last_success.labels(*label_values).set(
+                    status['last_success'])
+            for error, count in sorted(status['errors'].items()):
+                errors.labels(*(label_values + [error])).inc(count)
+        for key, status in render_status:
+            label_values = [oscache.region, key]
+            render_duration.labels(*label_values).set(status['duration'])
+            rendered_bytes.labels(*label_values).set(status['bytes'])
+            for error, count in sorted(status['errors'].items()):
+                render_errors.labels(*(label_values + [error])).inc(count)
+    return (generate_latest(registry) + http_metrics.get_stats() +
+            circuit_breaker.get_stats())
+
+
+class RegionalCaches(object):
+    """ The caches of several regions served as a single /metrics body.
+
+        Each region is refreshed by its own OSCache thread. The body is
+        assembled from the rendered collectors of all the regions whenever
+        one of them publishes, after a single rendering of the metrics of
+        the exporter. With cross_region_totals, the total_* hypervisor
+        statistics of the regions are also summed into
+        openstack_all_regions_total_* gauges.
+    """
+
+    def __init__(self, caches, cross_region_totals=False):
+        self.caches = caches
+        self.cross_region_totals = cross_region_totals
+        for oscache in caches:
+            oscache.exporter_stats = False
+        self.epoch = int(time())
+        self.generation = 0
+        self.snapshot = make_snapshot(0, [], [], self._etag(0))
+        self._generations = None
+        self._lock = Lock()
+
+    def start(self):
+        for oscache in self.caches:
+            oscache.start()
+
+    def load_state(self):
+        for oscache in self.caches:
+            oscache.load_state()
+
+    def save_state(self):
+        for oscache in self.caches:
+            oscache.save_state()
+
+    def is_ready(self):
+        return not self.pending()
+
+    def pending(self):
+        """ region/cache key of the collectors not refreshed successfully
+            since startup
+        """
+        return ['{}/{}'.format(oscache.region, key)
+                for oscache in self.caches for key in oscache.pending()]
+
+    def failing(self):
+        return [('{}/{}'.format(oscache.region, key), status)
+                for oscache in self.caches
+                for key, status in oscache.failing()]
+
+    def get_snapshot(self):
+        """ return the snapshot of all the regions, assembled again only
+            when one of them has published since the last call
+        """
+        generations = tuple(oscache.generation for oscache in self.caches)
+        if generations == self._generations:
+            return self.snapshot
+        with self._lock:
+            if generations != self._generations:
+                self.publish()
+                self._generations = generations
+            return self.snapshot
+
+    def collector_keys(self):
+        keys = []
+        for oscache in self.caches:
+            keys.extend(
+                key for key in oscache.collector_keys() if key not in keys)
+        return keys
+
+    def rendered_parts(self, keys=None):
+        parts = []
+        deflated_parts = []
+        for oscache in self.caches:
+            region_parts, region_deflated_parts = oscache.rendered_parts(keys)
+            parts.extend(region_parts)
+            deflated_parts.extend(region_deflated_parts)
+        return parts, deflated_parts
+
+    def publish(self):
+        stats = self.get_stats()
+        parts = [stats]
+        deflated_parts = [deflate(stats)]
+        for oscache in self.caches:
+            region_parts, region_deflated_parts = oscache.rendered_parts()
+            parts.extend(region_parts)
+            deflated_parts.extend(region_deflated_parts)
+        self.generation += 1
+        self.snapshot = make_snapshot(
+            self.generation, parts, deflated_parts,
+            self._etag(self.generation))
+
+    def _etag(self, generation):
+        return '"{:x}-{:x}"'.format(self.epoch, generation)
+
+    def get_totals(self):
+        """ return the total_* hypervisor statistics summed over regions """
+        totals = {}
+        for oscache in self.caches:
+            for stat in oscache.get_cache_data('hypervisor_stats'):
+                if stat['stat_name'].startswith('total_'):
+                    totals[stat['stat_name']] = totals.get(
+                        stat['stat_name'], 0) + stat['stat_value']
+        return totals
+
+    def get_stats(self):
+        stats = get_exporter_stats(self.caches)
+        if not self.cross_region_totals:
+            return stats
+        registry = CollectorRegistry()
+        for name, value in sorted(self.get_totals().items()):
+            Gauge('openstack_all_regions_{}'.format(name),
+                  'Openstack Hypervisor statistic summed over all the '
+                  'regions', registry=registry).set(value)
+        return stats + generate_latest(registry)
@@ -1,344 +1,574 @@
-#!/usr/bin/env python
-# Copyright 2017 The Openstack-Helm Authors.
-#
-# Licensed under the Apache License, Version 2.0 (the "License");
-# you may not use this file except in compliance with the License.
-# You may obtain a copy of the License at
-#
-#     http://www.apache.org/licenses/LICENSE-2.0
-#
-# Unless required by applicable law or agreed to in writing, software
-# distributed under the License is distributed on an "AS IS" BASIS,
-# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
-# See the License for the specific language governing permissions and
-# limitations under the License.
-
-import datetime
-import dateutil.parser
-import dateutil.tz
-import requests
-import simplejson as json
-import logging
-from keystoneauth1 import identity, session, adapter
-from os import environ
-
-logger = logging.getLogger(__name__)
-
-
-SERVICE_CLIENT_MAP = {
-    'baremetal': 'ironicclient',
-    'reservation': 'blazarclient',
-    'identity': 'keystoneclient',
-    'networks': 'neutronclient'
-}
-
-
-def get_keystone_session():
-    """Returns a Keystone session object from environment variables."""
-    os_auth_url = environ.get('OS_AUTH_URL')
-
-    if os_auth_url[-3:] != '/v3':
-        os_auth_url += '/v3'
-
-    auth = identity.v3.Password(
-        auth_url=os_auth_url,
-        username=environ.get('OS_USERNAME'),
-        password=environ.get('OS_PASSWORD'),
-        user_domain_name=environ.get('OS_USER_DOMAIN_NAME'),
-        project_name=environ.get('OS_PROJECT_NAME'),
-        project_domain_name=environ.get('OS_PROJECT_DOMAIN_NAME'))
-
-    return session.Session(auth=auth)
-
-
-def session_adapter(service_type):
-    """Returns a Keystone adapter object."""
-    return adapter.Adapter(
-        session=get_keystone_session(),
-        region_name=environ.get('OS_REGION_NAME'),
-        service_type=service_type,
-        interface='public')
-
-
-def get_client_by_service_type(service_type):
-    """Method for getting openstack clients by service type."""
-    client = __import__(
-        '{}.client'.format(SERVICE_CLIENT_MAP[service_type]),
-        fromlist=[''])
-
-    return client.Client(1, session=session_adapter(service_type))
-
-
-def get_ironic_client():
-    """Method for getting python client by service name."""
-    from ironicclient import client
-    return client.get_client(
-        1,
-        os_ironic_api_version=environ.get('OS_IRONIC_API_VERSION'),
-        os_region_name=environ['OS_REGION_NAME'],
-        os_username=environ['OS_USERNAME'],
-        os_password=environ['OS_PASSWORD'],
-        os_auth_url=environ['OS_AUTH_URL'],
-        os_project_name=environ['OS_PROJECT_NAME'],
-        os_user_domain_name=environ['OS_USER_DOMAIN_NAME'],
-        os_project_domain_name=environ['OS_PROJECT_DOMAIN_NAME'])
-
-
-class KeystoneException(Exception):
-    pass
-
-
-class OSClient(object):
-    """ Base class for querying the OpenStack API endpoints.
-
-    It uses the Keystone service catalog to discover the API endpoints.
-    """
-    EXPIRATION_TOKEN_DELTA = datetime.timedelta(0, 30)
-    states = {'up': 1, 'down': 0, 'disabled': 2}
-
-    def __init__(
-            self,
-            keystone_url,
-            password,
-            tenant_name,
-            username,
-            user_domain,
-            region,
-            timeout,
-            retries):
-        self.keystone_url = keystone_url
-        self.password = password
-        self.tenant_name = tenant_name
-        self.username = username
-        self.user_domain = user_domain
-        self.region = region
-        self.timeout = timeout
-        self.retries = retries
-        self.token = None
-        self.valid_until = None
-        self.session = requests.Session()
-        self.session.mount(
-            'http://', requests.adapters.HTTPAdapter(max_retries=retries))
-        self.session.mount(
-            'https://', requests.adapters.HTTPAdapter(max_retries=retries))
-        self._service_catalog = []
-
-    def is_valid_token(self):
-        now = datetime.datetime.now(tz=dateutil.tz.tzutc())
-        return self.token is not None and self.valid_until is not None and self.valid_until > now
-
-    def clear_token(self):
-        self.token = None
-        self.valid_until = None
-
-    def get_token(self):
-        self.clear_token()
-        data = json.dumps({
-            "auth": {
-                "identity": {
-                    "methods": ["password"],
-                    "password": {
-                        "user": {
-                            "name": self.username,
-                            "domain": {"id": self.user_domain},
-                            "password": self.password
-                        }
-                    }
-                },
-                "scope": {
-                    "project": {
-                        "name": self.tenant_name,
-                        "domain": {"id": self.user_domain}
-                    }
-                }
-            }
-        })
-        logger.info("Trying to get token from '%s'" % self.keystone_url)
-        r = self.make_request('post',
-                              '%s/auth/tokens' % self.keystone_url, data=data,
-                              token_required=False)
-        if not r:
-            logger.error(
-                "Cannot get a valid token from {}".format(
-                    self.keystone_url))
-
-        if r.status_code < 200 or r.status_code > 299:
-            logger.error(
-                "{} responded with code {}".format(
-                    self.keystone_url,
-                    r.status_code))
-
-        data = r.json()
-        self.token = r.headers.get("X-Subject-Token")
-        self.tenant_id = data['token']['project']['id']
-        self.valid_until = dateutil.parser.parse(
-            data['token']['expires_at']) - self.EXPIRATION_TOKEN_DELTA
-        self._service_catalog = []
-        for item in data['token']['catalog']:
-            internalURL = None
-            publicURL = None
-            adminURL = None
-            for endpoint in item['endpoints']:
-                if endpoint['region'] == self.region or self.region is None:
-                    if endpoint['interface'] == 'internal':
-                        internalURL = endpoint['url']
-                    elif endpoint['interface'] == 'public':
-                        publicURL = endpoint['url']
-                    elif endpoint['interface'] == 'admin':
-                        adminURL = endpoint['url']
-
-            if internalURL is None and publicURL is None:
-                logger.warning(
-                    "Service '{}' skipped because no URL can be found".format(
-                        item['name']))
-                continue
-            self._service_catalog.append({
-                'name': item['name'],
-                'region': self.region,
-                'service_type': item['type'],
-                'url': internalURL if internalURL is not None else publicURL,
-                'admin_url': adminURL,
-            })
-
-        logger.debug("Got token '%s'" % self.token)
-        return self.token
-
-    @property
-    def service_catalog(self):
-        if not self._service_catalog:
-            self.get_token()
-        return self._service_catalog
-
-    @service_catalog.setter
-    def service_catalog(self, service_catalog):
-        self._service_catalog = service_catalog
-
-    def get_service(self, service_name):
-        return next((x for x in self._service_catalog
-                     if x['name'] == service_name), None)
-
-    def raw_get(self, url, token_required=False):
-        return self.make_request('get', url,
-                                 token_required=token_required)
-
-    def make_request(self, verb, url, data=None, token_required=True,
-                     params=None):
-        kwargs = {
-            'url': url,
-            'timeout': self.timeout,
-            'headers': {'Content-type': 'application/json'}
-        }
-        if token_required and not self.is_valid_token():
-            self.get_token()
-            if not self.is_valid_token():
-                logger.error("Aborting request, no valid token")
-                return
-        if token_required:
-            kwargs['headers']['X-Auth-Token'] = self.token
-
-        if data is not None:
-            kwargs['data'] = data
-
-        if params is not None:
-            kwargs['params'] = params
-
-        func = getattr(self.session, verb.lower())
-
-        try:
-            r = func(**kwargs)
-        except Exception as e:
-            logger.error("Got exception for '%s': '%s'" %
-                         (kwargs['url'], e))
-            return
-
-        logger.info("%s responded with status code %d" %
-                    (kwargs['url'], r.status_code))
-
-        return r
-
-    def get(self, service, resource, params=None):
-        url = self._build_url(service, resource)
-        if not url:
-            return
-        logger.info('GET({}) {}'.format(url, params))
-        return self.make_request('get', url, params=params)
-
-    def _build_url(self, service, resource):
-        s = (self.get_service(service) or {})
-        url = s.get('url')
-        # v3 API must be used in order to obtain tenants in multi-domain envs
-        if service == 'keystone' and (resource in ['projects',
-                                                   'users', 'roles']):
-            url = url.replace('v2.0', 'v3')
-
-        if url:
-            if url[-1] != '/':
-                url += '/'
-            url = "%s%s" % (url, resource)
-        else:
-            logger.error("Service '%s' not found in catalog" % service)
-        return url
-
-    def get_workers(self, service):
-        """ Return the list of workers and their state
-
-        Here is an example of returned dictionnary:
-        {
-          'host': 'node.example.com',
-          'service': 'nova-compute',
-          'state': 'up'
-        }
-
-        where 'state' can be 'up', 'down' or 'disabled'
-        """
-        worker_metrics = []
-        if service == 'neutron':
-            endpoint = 'v2.0/agents'
-            entry = 'agents'
-        else:
-            endpoint = 'os-services'
-            entry = 'services'
-
-        ost_services_r = self.get(service, endpoint)
-
-        msg = "Cannot get state of {} workers".format(service)
-        if ost_services_r is None:
-            logger.warning(msg)
-        elif ost_services_r.status_code != 200:
-            msg = "{}: Got {} ({})".format(
-                msg, ost_services_r.status_code, ost_services_r.content)
-            logger.warning(msg)
-        else:
-            try:
-                r_json = ost_services_r.json()
-            except ValueError:
-                r_json = {}
-
-            if entry not in r_json:
-                msg = "{}: couldn't find '{}' key".format(msg, entry)
-                logger.warning(msg)
-            else:
-                for val in r_json[entry]:
-                    data = {'host': val['host'], 'service': val['binary']}
-
-                    if service == 'neutron':
-                        if not val['admin_state_up']:
-                            data['state'] = 'disabled'
-                        else:
-                            data['state'] = 'up' if val['alive'] else 'down'
-                    else:
-                        if val['status'] == 'disabled':
-                            data['state'] = 'disabled'
-                        elif val['state'] == 'up' or val['state'] == 'down':
-                            data['state'] = val['state']
-                        else:
-                            data['state'] = 'unknown'
-                            msg = "Unknown state for {} workers:{}".format(
-                                service, val['state'])
-                            logger.warning(msg)
-                            continue
-                    data['stat_value'] = self.states[data['state']]
-                    data['stat_name'] = "services_{}_{}".format(
-                        service, val['binary'])
-                    worker_metrics.append(data)
-        return worker_metrics
+#!/usr/bin/env python
+# Copyright 2017 The Openstack-Helm Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import dateutil.parser
+import dateutil.tz
+import requests
+import simplejson as json
+import logging
+from circuit_breaker import BreakerHTTPAdapter
+from os import environ
+from records import ServiceStat
+from request_cache import RequestCache
+from six.moves.urllib import parse as urlparse
+from threading import RLock
+
+logger = logging.getLogger(__name__)
+
+
+SERVICE_CLIENT_MAP = {
+    'baremetal': 'ironicclient',
+    'reservation': 'blazarclient',
+    'identity': 'keystoneclient',
+    'networks': 'neutronclient'
+}
+
+
+# Sessions are shared by every collector of the process: keystoneauth
+# caches the token and re-authenticates shortly before it expires, and the
+# underlying connection pools are reused across refreshes.
+CONNECTION_POOL_SIZE = 10
+# Seconds to wait for the APIs called through the Keystone session
+REQUEST_TIMEOUT = None
+_sessions_lock = RLock()
+_keystone_session = None
+_adapters = {}
+_ironic_clients = {}
+
+# Number of records requested per page from paginated list endpoints.
+PAGE_SIZE = 1000
+
+# Responses shared by the collectors refreshed within REQUEST_CACHE_TTL
+# seconds of each other, keyed by (region, service type, path).
+REQUEST_CACHE_TTL = 60
+request_cache = RequestCache(REQUEST_CACHE_TTL)
+
+
+def configure_sessions(pool_size, request_cache_ttl=REQUEST_CACHE_TTL,
+                       timeout=REQUEST_TIMEOUT):
+    """Set the size of the connection pools of the shared sessions, their
+    timeout and how long API responses are shared between collectors."""
+    global CONNECTION_POOL_SIZE, REQUEST_TIMEOUT
+    CONNECTION_POOL_SIZE = pool_size
+    REQUEST_TIMEOUT = timeout
+    request_cache.ttl = request_cache_ttl
+
+
+def pooled_requests_session(retries=0):
+    """Returns a requests session with connection pools sized for the
+    concurrent collectors, recording the latency of its requests and
+    failing fast on the services that are down."""
+    requests_session = requests.Session()
+    for prefix in ('http://', 'https://'):
+        requests_session.mount(prefix, BreakerHTTPAdapter(
+            pool_connections=CONNECTION_POOL_SIZE,
+            pool_maxsize=CONNECTION_POOL_SIZE,
+            max_retries=retries))
+    return requests_session
+
+
+def get_keystone_session():
+    """Returns the Keystone session shared by the process, created from
+    environment variables on first use."""
+    global _keystone_session
+    with _sessions_lock:
+        if _keystone_session is None:
+            from keystoneauth1 import identity, session
+
+            os_auth_url = environ.get('OS_AUTH_URL')
+
+            if os_auth_url[-3:] != '/v3':
+                os_auth_url += '/v3'
+
+            auth = identity.v3.Password(
+                auth_url=os_auth_url,
+                username=environ.get('OS_USERNAME'),
+                password=environ.get('OS_PASSWORD'),
+                user_domain_name=environ.get('OS_USER_DOMAIN_NAME'),
+                project_name=environ.get('OS_PROJECT_NAME'),
+                project_domain_name=environ.get('OS_PROJECT_DOMAIN_NAME'))
+
+            _keystone_session = session.Session(
+                auth=auth, session=pooled_requests_session(),
+                timeout=REQUEST_TIMEOUT)
+        return _keystone_session
+
+
+def get_region(region=None):
+    """Returns region, or the region of the environment if None."""
+    return region if region is not None else environ.get('OS_REGION_NAME')
+
+
+def session_adapter(service_type, region=None):
+    """Returns a Keystone adapter object for the service of a region."""
+    region = get_region(region)
+    with _sessions_lock:
+        if (service_type, region) not in _adapters:
+            from keystoneauth1 import adapter
+
+            _adapters[(service_type, region)] = adapter.Adapter(
+                session=get_keystone_session(),
+                region_name=region,
+                service_type=service_type,
+                interface='public')
+        return _adapters[(service_type, region)]
+
+
+def get_json(service_type, path, region=None):
+    """Returns the decoded response of a GET through the shared session.
+
+    Identical requests made by collectors refreshed together are sent once.
+    """
+    region = get_region(region)
+
+    def fetch():
+        return session_adapter(service_type, region).get(path).json()
+    return request_cache.get((region, service_type, path), fetch)
+
+
+def paginate(get, path, entry, params=None, limit=PAGE_SIZE):
+    """Yields the records of a paginated list endpoint.
+
+    Pages of `limit` records are requested with get(path, params), which
+    returns the decoded body. The next page is found in the '<entry>_links'
+    (Nova) or 'links' (Keystone) section of the body. When that link carries
+    a marker, the request is repeated with the marker so that our own
+    endpoint is kept. Only one page is held in memory at a time.
+    """
+    params = dict(params or {})
+    if limit:
+        params['limit'] = limit
+    # next links already followed, a server repeating one would loop
+    followed = set()
+    while path:
+        body = get(path, params)
+        records = body.get(entry, [])
+        for record in records:
+            yield record
+
+        next_url = _next_link(body, entry)
+        if not next_url or not records or next_url in followed:
+            return
+        followed.add(next_url)
+        query = urlparse.parse_qs(urlparse.urlparse(next_url).query)
+        if 'marker' in query:
+            if query['marker'][0] == params.get('marker'):
+                return
+            params['marker'] = query['marker'][0]
+        else:
+            # the link carries the whole query of the next page
+            path, params = next_url, {}
+
+
+def _next_link(body, entry):
+    links = body.get('{}_links'.format(entry), body.get('links'))
+    if isinstance(links, dict):
+        return links.get('next')
+    for link in links or []:
+        if link.get('rel') == 'next':
+            return link.get('href')
+    return None
+
+
+def get_paginated(service_type, path, entry, params=None, limit=PAGE_SIZE,
+                  region=None):
+    """Yields the records of a paginated list through the shared session."""
+    api = session_adapter(service_type, region)
+
+    def get(path, params):
+        return api.get(path, params=params).json()
+    return paginate(get, path, entry, params, limit)
+
+
+def get_client_by_service_type(service_type):
+    """Method for getting openstack clients by service type."""
+    client = __import__(
+        '{}.client'.format(SERVICE_CLIENT_MAP[service_type]),
+        fromlist=[''])
+
+    return client.Client(1, session=session_adapter(service_type))
+
+
+def get_ironic_client(region=None):
+    """Method for getting python client by service name."""
+    region = get_region(region)
+    with _sessions_lock:
+        if region not in _ironic_clients:
+            from ironicclient import client
+            _ironic_clients[region] = client.get_client(
+                1,
+                session=get_keystone_session(),
+                os_ironic_api_version=environ.get('OS_IRONIC_API_VERSION'),
+                os_region_name=region)
+        return _ironic_clients[region]
+
+
+class KeystoneException(Exception):
+    pass
+
+
+class PaginationException(Exception):
+    pass
+
+
+class KeystoneToken(object):
+    """ Token and service catalog shared by the clients of all regions """
+
+    def __init__(self):
+        self.token = None
+        self.valid_until = None
+        self.tenant_id = None
+        self.catalog = []
+        # incremented whenever a new catalog is received
+        self.generation = 0
+        # Collectors refresh concurrently and share the token, only one of
+        # them should go to Keystone when it expires.
+        self.lock = RLock()
+
+
+class OSClient(object):
+    """ Base class for querying the OpenStack API endpoints.
+
+    It uses the Keystone service catalog to discover the API endpoints of
+    its region. The clients of other regions created with for_region()
+    share its token.
+    """
+    EXPIRATION_TOKEN_DELTA = datetime.timedelta(0, 30)
+    states = {'up': 1, 'down': 0, 'disabled': 2}
+
+    def __init__(
+            self,
+            keystone_url,
+            password,
+            tenant_name,
+            username,
+            user_domain,
+            region,
+            timeout,
+            retries,
+            keystone_token=None):
+        self.keystone_url = keystone_url
+        self.password = password
+        self.tenant_name = tenant_name
+        self.username = username
+        self.user_domain = user_domain
+        self.region = region
+        self.timeout = timeout
+        self.retries = retries
+        self._keystone_token = keystone_token or KeystoneToken()
+        self._token_lock = self._keystone_token.lock
+        self.session = pooled_requests_session(retries)
+        self._service_catalog = []
+        self._catalog_generation = None
+
+    def for_region(self, region):
+        """ return a client of another region sharing this client's token
+        """
+        return OSClient(
+            self.keystone_url, self.password, self.tenant_name, self.username,
+            self.user_domain, region, self.timeout, self.retries,
+            self._keystone_token)
+
+    @property
+    def token(self):
+        return self._keystone_token.token
+
+    @property
+    def valid_until(self):
+        return self._keystone_token.valid_until
+
+    @property
+    def tenant_id(self):
+        return self._keystone_token.tenant_id
+
+    def is_valid_token(self):
+        now = datetime.datetime.now(tz=dateutil.tz.tzutc())
+        return self.token is not None and self.valid_until is not None and self.valid_until > now
+
+    def clear_token(self):
+        self._keystone_token.token = None
+        self._keystone_token.valid_until = None
+
+    def get_token(self):
+        self.clear_token()
+        data = json.dumps({
+            "auth": {
+                "identity": {
+                    "methods": ["password"],
+                    "password": {
+                        "user": {
+                            "name": self.username,
+                            "domain": {"id": self.user_domain},
+                            "password": self.password
+                        }
+                    }
+                },
+                "scope": {
+                    "project": {
+                        "name": self.tenant_name,
+                        "domain": {"id": self.user_domain}
+                    }
+                }
+            }
+        })
+        logger.info("Trying to get token from '%s'" % self.keystone_url)
+        r = self.make_request('post',
+                              '%s/auth/tokens' % self.keystone_url, data=data,
+                              token_required=False)
+        if not r:
+            logger.error(
+                "Cannot get a valid token from {}".format(
+                    self.keystone_url))
+
+        if r.status_code < 200 or r.status_code > 299:
+            logger.error(
+                "{} responded with code {}".format(
+                    self.keystone_url,
+                    r.status_code))
+
+        data = r.json()
+        keystone_token = self._keystone_token
+        keystone_token.token = r.headers.get("X-Subject-Token")
+        keystone_token.tenant_id = data['token']['project']['id']
+        keystone_token.valid_until = dateutil.parser.parse(
+            data['token']['expires_at']) - self.EXPIRATION_TOKEN_DELTA
+        keystone_token.catalog = data['token']['catalog']
+        keystone_token.generation += 1
+
+        logger.debug("Got token '%s'" % self.token)
+        return self.token
+
+    def _region_catalog(self, catalog):
+        """ return the services of the client's region in catalog """
+        service_catalog = []
+        for item in catalog:
+            internalURL = None
+            publicURL = None
+            adminURL = None
+            for endpoint in item['endpoints']:
+                if endpoint['region'] == self.region or self.region is None:
+                    if endpoint['interface'] == 'internal':
+                        internalURL = endpoint['url']
+                    elif endpoint['interface'] == 'public':
+                        publicURL = endpoint['url']
+                    elif endpoint['interface'] == 'admin':
+                        adminURL = endpoint['url']
+
+            if internalURL is None and publicURL is None:
+                logger.warning(
+                    "Service '{}' skipped because no URL can be found".format(
+                        item['name']))
+                continue
+            service_catalog.append({
+                'name': item['name'],
+                'region': self.region,
+                'service_type': item['type'],
+                'url': internalURL if internalURL is not None else publicURL,
+                'admin_url': adminURL,
+            })
+        return service_catalog
+
+    @property
+    def service_catalog(self):
+        keystone_token = self._keystone_token
+        with self._token_lock:
+            if not keystone_token.catalog:
+                self.get_token()
+            if self._catalog_generation != keystone_token.generation:
+                self._service_catalog = self._region_catalog(
+                    keystone_token.catalog)
+                self._catalog_generation = keystone_token.generation
+        return self._service_catalog
+
+    @service_catalog.setter
+    def service_catalog(self, service_catalog):
+        self._service_catalog = service_catalog
+        self._catalog_generation = self._keystone_token.generation
+
+    def get_service(self, service_name):
+        return next((x for x in self.service_catalog
+                     if x['name'] == service_name), None)
+
+    def raw_get(self, url, token_required=False):
+        return self.make_request('get', url,
+                                 token_required=token_required)
+
+    def make_request(self, verb, url, data=None, token_required=True,
+                     params=None, headers=None):
+        kwargs = {
+            'url': url,
+            'timeout': self.timeout,
+            'headers': {'Content-type': 'application/json'}
+        }
+        if headers is not None:
+            kwargs['headers'].update(headers)
+        if token_required and not self.is_valid_token():
+            with self._token_lock:
+                if not self.is_valid_token():
+                    self.get_token()
+            if not self.is_valid_token():
+                logger.error("Aborting request, no valid token")
+                return
+        if token_required:
+            kwargs['headers']['X-Auth-Token'] = self.token
+
+        if data is not None:
+            kwargs['data'] = data
+
+        if params is not None:
+            kwargs['params'] = params
+
+        func = getattr(self.session, verb.lower())
+
+        try:
+            r = func(**kwargs)
+        except Exception as e:
+            logger.error("Got exception for '%s': '%s'" %
+                         (kwargs['url'], e))
+            return
+
+        logger.info("%s responded with status code %d" %
+                    (kwargs['url'], r.status_code))
+
+        return r
+
+    def get(self, service, resource, params=None, headers=None):
+        url = self._build_url(service, resource)
+        if not url:
+            return
+        logger.info('GET({}) {}'.format(url, params))
+        return self.make_request('get', url, params=params, headers=headers)
+
+    def paginate(self, service, resource, entry, params=None, headers=None,
+                 limit=PAGE_SIZE):
+        """ Yields the records of a paginated list endpoint.
+
+            Raises PaginationException if a page cannot be retrieved, so
+            that a partial list is never mistaken for a complete one.
+        """
+        def get(path, params):
+            if '://' in path:
+                r = self.make_request('get', path, params=params,
+                                      headers=headers)
+            else:
+                r = self.get(service, path, params=params, headers=headers)
+            if not r:
+                raise PaginationException(
+                    "Cannot get {} from {}".format(path, service))
+            return r.json()
+        return paginate(get, resource, entry, params, limit)
+
+    def get_json(self, service, resource):
+        """ GET a resource and return its decoded body, or None if the
+            request failed.
+
+            Responses are shared with the collectors using get_json() for the
+            same region, service type and path.
+        """
+        s = (self.get_service(service) or {})
+
+        def fetch():
+            r = self.get(service, resource)
+            if not r:
+                return None
+            try:
+                return r.json()
+            except ValueError:
+                logger.warning(
+                    "Invalid JSON returned by {} {}".format(service, resource))
+                return None
+        return request_cache.get(
+            (self.region, s.get('service_type', service), resource), fetch)
+
+    def _build_url(self, service, resource):
+        s = (self.get_service(service) or {})
+        url = s.get('url')
+        # v3 API must be used in order to obtain tenants in multi-domain envs
+        if service == 'keystone' and (resource in ['projects',
+                                                   'users', 'roles']):
+            url = url.replace('v2.0', 'v3')
+
+        if url:
+            if url[-1] != '/':
+                url += '/'
+            url = "%s%s" % (url, resource)
+        else:
+            logger.error("Service '%s' not found in catalog" % service)
+        return url
+
+    def get_workers(self, service):
+        """ Return the list of workers and their state
+
+        Here is an example of returned dictionnary:
+        {
+          'host': 'node.example.com',
+          'service': 'nova-compute',
+          'state': 'up'
+        }
+
+        where 'state' can be 'up', 'down' or 'disabled'
+        """
+        worker_metrics = []
+        if service == 'neutron':
+            endpoint = 'v2.0/agents'
+            entry = 'agents'
+        else:
+            endpoint = 'os-services'
+            entry = 'services'
+
+        ost_services_r = self.get(service, endpoint)
+
+        msg = "Cannot get state of {} workers".format(service)
+        if ost_services_r is None:
+            logger.warning(msg)
+        elif ost_services_r.status_code != 200:
+            msg = "{}: Got {} ({})".format(
+                msg, ost_services_r.status_code, ost_services_r.content)
+            logger.warning(msg)
+        else:
+            try:
+                r_json = ost_services_r.json()
+            except ValueError:
+                r_json = {}
+
+            if entry not in r_json:
+                msg = "{}: couldn't find '{}' key".format(msg, entry)
+                logger.warning(msg)
+            else:
+                for val in r_json[entry]:
+                    data = ServiceStat(host=val['host'], service=val['binary'])
+
+                    if service == 'neutron':
+                        if not val['admin_state_up']:
+                            data['state'] = 'disabled'
+                        else:
+                            data['state'] = 'up' if val['alive'] else 'down'
+                    else:
+                        if val['status'] == 'disabled':
+                            data['state'] = 'disabled'
+                        elif val['state'] == 'up' or val['state'] == 'down':
+                            data['state'] = val['state']
+                        else:
+                            data['state'] = 'unknown'
+                            msg = "Unknown state for {} workers:{}".format(
+                                service, val['state'])
+                            logger.warning(msg)
+                            continue
+                    data['stat_value'] = self.states[data['state']]
+                    data['stat_name'] = "services_{}_{}".format(
+                        service, val['binary'])
+                    worker_metrics.append(data)
+        return worker_metrics
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# Copyright 2017 The Openstack-Helm Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Compact records for the cached statistics.
+
+Collectors cache tens of thousands of statistics, a record stores their
+fields in __slots__ instead of a dict per statistic and interns its string
+values, so that the label values repeated across statistics (stat names,
+states, project names, aggregates) are stored once. Records are read like
+the dicts they replace, with get() and item access.
+"""
+
+import sys
+
+import six
+from six.moves import intern
+
+
+def intern_label(value):
+    """ return the interned copy of a string value, other values as is """
+    if isinstance(value, six.text_type) and six.PY2:
+        # only byte strings can be interned on Python 2, ASCII unicode
+        # strings compare and hash equal to their encoding
+        try:
+            value = value.encode('ascii')
+        except UnicodeEncodeError:
+            return value
+    if isinstance(value, str):
+        return intern(value)
+    return value
+
+
+class Record(object):
+    """ Statistic with the fields listed in the __slots__ of subclasses,
+        fields that are not set are missing like the keys of a dict
+    """
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        for name, value in fields.items():
+            setattr(self, name, intern_label(value))
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+
+    def __setitem__(self, name, value):
+        setattr(self, name, intern_label(value))
+
+    def __contains__(self, name):
+        return hasattr(self, name)
+
+    def keys(self):
+        return [name for name in self.__slots__ if hasattr(self, name)]
+
+    def items(self):
+        return [(name, getattr(self, name)) for name in self.keys()]
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join(
+            '{}={!r}'.format(name, value) for name, value in self.items()))
+
+    def __getstate__(self):
+        return dict(self.items())
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, intern_label(value))
+
+
+class ServiceStat(Record):
+    """ State of an OpenStack service worker, or of all the workers of a
+        service
+    """
+    __slots__ = ('stat_name', 'stat_value', 'host', 'service', 'state')
+
+
+def footprint(data):
+    """ return the approximate memory used by data in bytes, counting the
+        objects shared between its items once
+    """
+    seen = set()
+    size = 0
+    stack = [data]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif isinstance(obj, Record):
+            stack.extend(value for _, value in obj.items())
+        elif hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+    return size
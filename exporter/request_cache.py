@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# Copyright 2017 The Openstack-Helm Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from threading import Event
+from threading import Lock
+from time import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class RequestCache(object):
+    """ Single flight cache of decoded API responses.
+
+        Collectors refreshed around the same time share one fetch per key:
+        concurrent callers wait for the request in flight, and the decoded
+        result is reused for `ttl` seconds. Cached values are shared between
+        collectors and must not be modified.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = Lock()
+        self._entries = {}
+        self._in_flight = {}
+
+    def get(self, key, fetch):
+        """ return the cached value of key, calling fetch() to get it when
+            it is missing or expired. None results are not cached.
+        """
+        while True:
+            with self._lock:
+                now = time()
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > now:
+                    return entry[1]
+                event = self._in_flight.get(key)
+                if event is None:
+                    event = self._in_flight[key] = Event()
+                    break
+            # another caller is fetching the same key, use its result or
+            # fetch it ourselves if it failed
+            event.wait()
+
+        value = None
+        try:
+            value = fetch()
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                if value is not None and self.ttl > 0:
+                    self._prune(now)
+                    self._entries[key] = (time() + self.ttl, value)
+            event.set()
+        logger.debug("fetched {} for the request cache".format(key))
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _prune(self, now):
+        for key, (expires, _) in list(self._entries.items()):
+            if expires <= now:
+                del self._entries[key]
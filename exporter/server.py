@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+# Copyright 2017 The Openstack-Helm Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler
+from six.moves.BaseHTTPServer import HTTPServer
+from six.moves.socketserver import ForkingMixIn
+from six.moves.socketserver import ThreadingMixIn
+from six.moves.urllib import parse as urlparse
+from threading import BoundedSemaphore
+from threading import Lock
+from time import sleep, time
+from prometheus_client import CONTENT_TYPE_LATEST
+import socket
+import zlib
+
+from compression import COMPRESSION_LEVEL
+from compression import deflate
+from compression import gzip_parts
+from exposition import filter_families
+from exposition import name_matcher
+
+import logging
+logger = logging.getLogger(__name__)
+
+# pseudo collector serving the statistics of the exporter itself
+EXPORTER_STATS = 'exporter'
+
+
+class ForkingHTTPServer(ForkingMixIn, HTTPServer):
+
+    def __init__(self, server_address, handler_class, oscache):
+        HTTPServer.__init__(self, server_address, handler_class)
+        self.oscache = oscache
+        self.stopping = False
+
+    def wait_request(self, handler):
+        return not self.stopping
+
+    def begin_request(self, handler):
+        pass
+
+    def end_request(self, handler, serving):
+        pass
+
+    def drain(self, timeout):
+        return True
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """ HTTP server handling each connection in a thread.
+
+        At most max_requests requests are served at once, further requests
+        wait for a slot in the thread of their connection. Connections
+        waiting for their next request hold no slot, and are closed when
+        the server drains.
+    """
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class, oscache,
+                 max_requests=16):
+        HTTPServer.__init__(self, server_address, handler_class)
+        self.oscache = oscache
+        self.stopping = False
+        self.max_requests = max_requests
+        self._slots = BoundedSemaphore(max_requests)
+        # handlers waiting for the next request of their connection
+        self._idle = set()
+        self._idle_lock = Lock()
+
+    def wait_request(self, handler):
+        """ register handler as idle until its next request is read,
+            False if the server is stopping and the connection must close
+        """
+        with self._idle_lock:
+            if self.stopping:
+                return False
+            self._idle.add(handler)
+            return True
+
+    def begin_request(self, handler):
+        with self._idle_lock:
+            self._idle.discard(handler)
+        self._slots.acquire()
+
+    def end_request(self, handler, serving):
+        with self._idle_lock:
+            self._idle.discard(handler)
+        if serving:
+            self._slots.release()
+
+    def drain(self, timeout):
+        """ close the idle connections and wait for the requests in
+            progress to be served
+        """
+        with self._idle_lock:
+            self.stopping = True
+            idle = list(self._idle)
+        for handler in idle:
+            try:
+                # wakes up the thread blocked reading the next request
+                handler.connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        deadline = time() + timeout
+        acquired = 0
+        while acquired < self.max_requests and time() < deadline:
+            if self._slots.acquire(False):
+                acquired += 1
+            else:
+                sleep(0.1)
+        for _ in range(acquired):
+            self._slots.release()
+        return acquired == self.max_requests
+
+
+class OpenstackExporterHandler(BaseHTTPRequestHandler):
+    # Keep connections alive between scrapes, an idle connection is closed
+    # after `timeout` seconds.
+    protocol_version = 'HTTP/1.1'
+    timeout = 30
+
+    def __init__(self, *args, **kwargs):
+        self._serving = False
+        BaseHTTPRequestHandler.__init__(self, *args, **kwargs)
+
+    def handle_one_request(self):
+        """ serve the next request of the connection, the connection is
+            closed instead once the server is stopping
+        """
+        if not self.server.wait_request(self):
+            self.close_connection = True
+            return
+        self._serving = False
+        try:
+            BaseHTTPRequestHandler.handle_one_request(self)
+        finally:
+            self.server.end_request(self, self._serving)
+
+    def parse_request(self):
+        # the request line has been read, the request takes a slot
+        self.server.begin_request(self)
+        self._serving = True
+        return BaseHTTPRequestHandler.parse_request(self)
+
+    def do_GET(self):
+        if self.server.stopping:
+            self.close_connection = True
+        url = urlparse.urlparse(self.path)
+        query = urlparse.parse_qs(url.query)
+        if url.path == '/metrics' and not (
+                query.get('collector') or query.get('match[]')):
+            snapshot = self.server.oscache.get_snapshot()
+            gzipped = self._accepts_gzip()
+            if gzipped:
+                parts = snapshot.gzip_parts
+                length = snapshot.gzip_length
+                # each content coding needs its own strong validator
+                etag = snapshot.etag[:-1] + '-gzip"'
+            else:
+                parts = snapshot.parts
+                length = snapshot.length
+                etag = snapshot.etag
+            if self._etag_matches(etag):
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Vary', 'Accept-Encoding')
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE_LATEST)
+            if gzipped:
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(length))
+            self.send_header('ETag', etag)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            # the parts are shared with the snapshot, write them one by one
+            # rather than joining a copy of the body
+            for part in parts:
+                self.wfile.write(part)
+        elif url.path == '/metrics' or url.path.startswith('/metrics/'):
+            self._scoped_metrics(url.path[len('/metrics/'):], query)
+        elif url.path == '/ready':
+            # ready once every collector has refreshed successfully since
+            # startup, a restored cache is served in the meantime
+            pending = self.server.oscache.pending()
+            if pending:
+                body = 'waiting for {}\n'.format(', '.join(sorted(pending)))
+                failing = self.server.oscache.failing()
+                if failing:
+                    body += 'not refreshed: {}\n'.format(', '.join(
+                        '{} ({})'.format(key, status)
+                        for key, status in sorted(failing)))
+                self._send_text(503, body)
+            else:
+                self._send_text(200, 'ready\n')
+        elif url.path == '/':
+            body = """<html>
+            <head><title>OpenStack Exporter</title></head>
+            <body>
+            <h1>OpenStack Exporter</h1>
+            <p>Visit <code>/metrics</code> to use.</p>
+            </body>
+            </html>"""
+            self._send_text(200, body, 'text/html')
+        else:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    def _scoped_metrics(self, path_collectors, query):
+        """ serve the collectors named in the path, as /metrics/a,b, or in
+            collector parameters, keeping only the metric families matched
+            by the match[] selectors if any
+        """
+        oscache = self.server.oscache
+        keys = [
+            key.strip() for value in [path_collectors] + query.get(
+                'collector', [])
+            for key in value.split(',') if key.strip()]
+        known = oscache.collector_keys() + [EXPORTER_STATS]
+        unknown = [key for key in keys if key not in known]
+        if unknown:
+            return self._send_text(404, 'unknown collector {}\n'.format(
+                ', '.join(unknown)))
+        try:
+            keep = name_matcher(query['match[]']) \
+                if query.get('match[]') else None
+        except ValueError as e:
+            return self._send_text(400, '{}\n'.format(e))
+
+        if keys:
+            # only the requested collectors, as last rendered
+            parts, deflated_parts = oscache.rendered_parts(keys)
+            if EXPORTER_STATS in keys:
+                stats = oscache.get_stats()
+                parts.insert(0, stats)
+                deflated_parts.insert(0, deflate(stats))
+        else:
+            snapshot = oscache.get_snapshot()
+            parts = list(snapshot.parts)
+            deflated_parts = None
+        gzipped = self._accepts_gzip()
+        if keep is not None:
+            parts = [filter_families(part, keep) for part in parts]
+            parts = [part for part in parts if part]
+            deflated_parts = None
+        if gzipped:
+            if deflated_parts is None:
+                compressor = zlib.compressobj(
+                    COMPRESSION_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+                parts = [compressor.compress(part) for part in parts] + [
+                    compressor.flush()]
+            else:
+                parts = gzip_parts(parts, deflated_parts)
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE_LATEST)
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(sum(len(p) for p in parts)))
+        self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+        for part in parts:
+            self.wfile.write(part)
+
+    def _send_text(self, code, body, content_type='text/plain'):
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _accepts_gzip(self):
+        accept_encoding = self.headers.get('Accept-Encoding') or ''
+        for coding in accept_encoding.split(','):
+            params = coding.split(';')
+            if params[0].strip().lower() not in ('gzip', '*'):
+                continue
+            for param in params[1:]:
+                name, _, value = param.strip().partition('=')
+                if name == 'q':
+                    try:
+                        return float(value) > 0
+                    except ValueError:
+                        return False
+            return True
+        return False
+
+    def _etag_matches(self, etag):
+        if_none_match = self.headers.get('If-None-Match')
+        if not if_none_match:
+            return False
+        for candidate in if_none_match.split(','):
+            candidate = candidate.strip()
+            if candidate.startswith('W/'):
+                candidate = candidate[2:]
+            if candidate in ('*', etag):
+                return True
+        return False
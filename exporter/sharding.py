@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# Copyright 2017 The Openstack-Helm Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Work sharding between several replicas of the exporter.
+
+Each replica is given its index among SHARD_COUNT replicas. Hypervisors,
+Ironic nodes, Gnocchi resources and switches are spread over the replicas
+by consistent hashing of their name or id, so that a replica only collects
+its own share and adding a replica only moves about 1/SHARD_COUNT of them.
+Series covering the whole cloud, and the collectors that only produce such
+series, are left to the leader, shard 0.
+"""
+
+from bisect import bisect
+import hashlib
+import logging
+
+import six
+
+logger = logging.getLogger(__name__)
+
+# points of each shard on the ring, more points spread keys more evenly
+VIRTUAL_NODES = 500
+
+SHARD_INDEX = 0
+SHARD_COUNT = 1
+
+_ring = None
+
+
+def _hash(key):
+    # a well mixed hash spreads the near identical names of the virtual
+    # nodes evenly, sha256 is not flagged as a weak hash by bandit
+    if isinstance(key, six.text_type):
+        key = key.encode('utf-8')
+    return int(hashlib.sha256(key).hexdigest()[:8], 16)
+
+
+class ShardRing(object):
+    """ Consistent hash ring mapping keys to shards 0..shards-1 """
+
+    def __init__(self, shards, virtual_nodes=VIRTUAL_NODES):
+        points = sorted(
+            (_hash('{}-{}'.format(shard, vnode)), shard)
+            for shard in range(shards)
+            for vnode in range(virtual_nodes))
+        self._hashes = [h for h, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, key):
+        """ return the shard owning key """
+        i = bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._shards[i]
+
+
+def configure(index=0, count=1):
+    """ set the shard of this replica, a single shard collects everything """
+    global SHARD_INDEX, SHARD_COUNT, _ring
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(
+            "invalid shard {} of {}".format(index, count))
+    SHARD_INDEX = index
+    SHARD_COUNT = count
+    _ring = ShardRing(count) if count > 1 else None
+    if count > 1:
+        logger.info("collecting shard {} of {}".format(index, count))
+
+
+def is_leader():
+    """ True if this replica collects the series of the whole cloud """
+    return SHARD_INDEX == 0
+
+
+def owns(key):
+    """ True if key is collected by this replica """
+    return _ring is None or _ring.shard_for(key) == SHARD_INDEX
+
+
+def owned(items, key):
+    """ return the items whose key(item) is collected by this replica """
+    if _ring is None:
+        return list(items)
+    return [item for item in items if owns(key(item))]
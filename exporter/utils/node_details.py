@@ -1,28 +1,31 @@
-from osclient import get_ironic_client, session_adapter
+from osclient import get_ironic_client, get_json, get_paginated
+from osclient import get_region, request_cache
 
 FREEPOOL_AGGREGATE_ID = 1
 
 
-def get_nodes(detail=False):
-    """Return list of ironic client node objects."""
-    ironic_client = get_ironic_client()
+def get_nodes(detail=False, region=None):
+    """Return list of ironic client node objects of a region.
 
-    nodes = ironic_client.node.list(detail=detail)
-    add_project_names(nodes)
-    add_node_type(nodes)
+    The nodes are shared by the collectors refreshed together.
+    """
+    region = get_region(region)
 
-    return nodes
+    def fetch():
+        nodes = get_ironic_client(region).node.list(detail=detail, limit=0)
+        add_project_names(nodes, region)
+        add_node_type(nodes, region)
+        return nodes
 
+    path = 'nodes/detail' if detail else 'nodes'
+    return request_cache.get((region, 'baremetal', path), fetch)
 
-def add_project_names(nodes):
-    """Add project names to list of ironic client node objects."""
-    nova_api = session_adapter('compute')
-    keystone_api = session_adapter('identity')
 
-    aggregates = nova_api.get('os-aggregates').json()['aggregates']
-    projects = keystone_api.get('v3/projects').json()['projects']
-
-    project_names = {p['id']: p['name'] for p in projects}
+def add_project_names(nodes, region=None):
+    """Add the id and name of the project reserving each node to list of
+    ironic client node objects."""
+    aggregates = get_json('compute', 'os-aggregates', region)['aggregates']
+    project_names = get_project_names(region)
     reservations = dict()
 
     for agg in aggregates:
@@ -33,19 +36,30 @@ def add_project_names(nodes):
         project_id = agg['metadata']['blazar:owner']
 
         for node_id in agg['hosts']:
-            reservations[node_id] = project_names[project_id]
+            reservations[node_id] = (project_id, project_names[project_id])
 
     for node in nodes:
-        if node.uuid in reservations:
-            setattr(node, 'project_name', reservations[node.uuid])
-        else:
-            setattr(node, 'project_name', None)
+        project_id, project_name = reservations.get(node.uuid, (None, None))
+        setattr(node, 'project_id', project_id)
+        setattr(node, 'project_name', project_name)
+
+
+def get_project_names(region=None):
+    """Return dict of project names by project id."""
+    region = get_region(region)
 
+    def fetch():
+        projects = get_paginated('identity', 'v3/projects', 'projects',
+                                 region=region)
+        return {p['id']: p['name'] for p in projects}
 
-def add_node_type(nodes):
+    return request_cache.get((region, 'identity', 'v3/projects'), fetch)
+
+
+def add_node_type(nodes, region=None):
     """Add node_type to list of ironic client node objects."""
-    blazar_api = session_adapter('reservation')
-    hosts = blazar_api.get('os-hosts?detail=True').json()['hosts']
+    hosts = get_json(
+        'reservation', 'os-hosts?detail=True', region)['hosts']
 
     node_types = {h['hypervisor_hostname']: h['node_type'] for h in hosts}
 
@@ -53,12 +67,12 @@ def add_node_type(nodes):
         setattr(node, 'node_type', node_types[node.uuid])
 
 
-def add_port_info(nodes, detail=True):
-    """Add ironic port object to list of ironic client node objects."""
-    ironic_client = get_ironic_client()
-    ports = ironic_client.port.list(detail=detail)
+def get_ports_by_node(detail=True, region=None):
+    """Return dict of ironic port objects by node uuid.
 
-    ports_by_node = {p.node_uuid: p for p in ports}
+    The shared nodes of get_nodes() are left untouched.
+    """
+    ironic_client = get_ironic_client(region)
+    ports = ironic_client.port.list(detail=detail, limit=0)
 
-    for node in nodes:
-        setattr(node, 'port', ports_by_node[node.uuid])
+    return {p.node_uuid: p for p in ports}
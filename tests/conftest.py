@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+# The exporter modules import each other as top level modules, the way
+# they are loaded when main.py is run.
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'exporter'))
+
+from exporter.oscache import OSCache  # noqa: E402
+
+
+class FakeCollector(object):
+    """ collector caching and rendering a fixed body """
+
+    def __init__(self, oscache, key, body):
+        self.key = key
+        self.body = body
+        oscache.cache_me(self)
+
+    def get_cache_key(self):
+        return self.key
+
+    def build_cache_data(self):
+        return [self.body]
+
+    def get_stats(self):
+        return self.body
+
+
+def rendered_cache(bodies, **kwargs):
+    """ return an OSCache of RegionOne with a rendered FakeCollector for
+        each (key, body) of bodies
+    """
+    oscache = OSCache(60, 'RegionOne', **kwargs)
+    for key, body in bodies:
+        oscache.render(FakeCollector(oscache, key, body))
+    return oscache
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from exporter import circuit_breaker
+from exporter.circuit_breaker import CircuitBreaker, CircuitOpenError
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_breaker_opens_and_probes_with_backoff(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker, 'time', clock)
+    monkeypatch.setattr(circuit_breaker, 'THRESHOLD', 3)
+    monkeypatch.setattr(circuit_breaker, 'BACKOFF', 10)
+    monkeypatch.setattr(circuit_breaker, 'MAX_BACKOFF', 15)
+    breaker = CircuitBreaker('compute')
+
+    for _ in range(3):
+        breaker.allow()
+        breaker.failure()
+    assert breaker.state == circuit_breaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    # one probe after the backoff, failing doubles the backoff
+    clock.now += 10
+    breaker.allow()
+    assert breaker.state == circuit_breaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.failure()
+    assert breaker.backoff == 15
+    clock.now += 10
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    clock.now += 5
+    breaker.allow()
+    breaker.success()
+    assert breaker.state == circuit_breaker.CLOSED
+    breaker.allow()
+    assert breaker.rejected == 3
+
+
+def test_each_region_has_its_own_breakers(monkeypatch):
+    monkeypatch.setattr(circuit_breaker, '_breakers', {})
+    monkeypatch.setattr(circuit_breaker, 'THRESHOLD', 1)
+    circuit_breaker.get_breaker('compute', 'RegionTwo').failure()
+
+    assert circuit_breaker.get_breaker('compute', 'RegionTwo').state == \
+        circuit_breaker.OPEN
+    circuit_breaker.get_breaker('compute', 'RegionOne').allow()
+    assert (b'openstack_exporter_circuit_breaker_state'
+            b'{region="RegionTwo",service="compute"} 1.0') in \
+        circuit_breaker.get_stats()
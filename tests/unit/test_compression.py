@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import io
+
+from exporter.compression import deflate, gzip_parts
+
+
+def test_gzip_parts_are_a_single_gzip_stream():
+    parts = [b'first 1.0\n', b'', b'second 2.0\n' * 1000]
+    body = b''.join(gzip_parts(parts, [deflate(part) for part in parts]))
+
+    with gzip.GzipFile(fileobj=io.BytesIO(body)) as f:
+        assert f.read() == b''.join(parts)
+
+
+def test_gzip_parts_of_nothing_are_empty():
+    body = b''.join(gzip_parts([], []))
+    with gzip.GzipFile(fileobj=io.BytesIO(body)) as f:
+        assert f.read() == b''
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+from exporter import corsa_stats
+from exporter.corsa_stats import CorsaStats
+from exporter.oscache import OSCache
+from exporter.osclient import OSClient
+
+
+class Node(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.uuid = name
+        self.provision_state = 'active'
+        self.project_name = 'project'
+
+
+class Port(object):
+
+    def __init__(self, switch_info, port_id):
+        self.local_link_connection = {
+            'switch_info': switch_info, 'port_id': port_id}
+
+
+class FakeClient(object):
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def get_stats_ports(self):
+        if self.stats is None:
+            raise IOError("switch unreachable")
+        return {'stats': self.stats}
+
+
+def test_unreachable_switch_does_not_stop_the_others(monkeypatch):
+    nodes = [Node('node-1'), Node('node-2')]
+    ports = {'node-1': Port('switch-1', 'Ethernet 1'),
+             'node-2': Port('switch-2', 'Ethernet 1')}
+    monkeypatch.setattr(
+        corsa_stats.node_details, 'get_nodes',
+        lambda detail, region: nodes)
+    monkeypatch.setattr(
+        corsa_stats.node_details, 'get_ports_by_node',
+        lambda region: ports)
+    collector = CorsaStats(
+        OSCache(60, 'RegionOne'),
+        OSClient(None, None, None, None, None, 'RegionOne', None, None),
+        [{'name': 'switch-1'}, {'name': 'switch-2'}])
+    collector.corsa_clients = {
+        'switch-1': FakeClient([{'port': 1, 'tx_bytes': 10, 'ignored': 0}]),
+        'switch-2': FakeClient(None),
+    }
+
+    stats = collector.build_cache_data()
+
+    assert stats == [{
+        'stat_name': 'corsa_tx_bytes',
+        'switch': 'switch-1',
+        'port': 1,
+        'node': 'node-1',
+        'provision_state': 'active',
+        'project_name': 'project',
+        'stat_value': 10,
+    }]
+    assert not any(hasattr(node, 'port') for node in nodes)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import io
+
+from prometheus_client import CollectorRegistry, Histogram
+from prometheus_client import generate_latest
+import pytest
+
+from exporter import exposition
+from exporter.exposition import MetricFamily
+
+
+def test_families_sharing_a_name_are_grouped():
+    families = [
+        MetricFamily('openstack_used_vcpus', 'Hypervisor statistic',
+                     ['region', 'host'], [(('RegionOne', 'a'), 2)]),
+        MetricFamily('openstack_free_vcpus', 'Hypervisor statistic',
+                     ['region', 'host'], [(('RegionOne', 'a'), 6)]),
+        MetricFamily('openstack_used_vcpus', 'Hypervisor statistic',
+                     ['region', 'host'], [(('RegionOne', 'b'), 4.5)]),
+    ]
+
+    assert exposition.encode(families) == (
+        b'# HELP openstack_used_vcpus Hypervisor statistic\n'
+        b'# TYPE openstack_used_vcpus gauge\n'
+        b'openstack_used_vcpus{region="RegionOne",host="a"} 2.0\n'
+        b'openstack_used_vcpus{region="RegionOne",host="b"} 4.5\n'
+        b'# HELP openstack_free_vcpus Hypervisor statistic\n'
+        b'# TYPE openstack_free_vcpus gauge\n'
+        b'openstack_free_vcpus{region="RegionOne",host="a"} 6.0\n')
+
+
+def test_labels_and_help_are_escaped():
+    family = MetricFamily(
+        'launch_failure', 'Launch failures\\by "project"\n', ['project'],
+        [((u'a"b\\c\nd', ), 1), ((u'caf\xe9', ), float('inf'))], 'counter')
+    out = io.BytesIO()
+
+    exposition.encode([family], out)
+
+    assert out.getvalue() == (
+        b'# HELP launch_failure Launch failures\\\\by "project"\\n\n'
+        b'# TYPE launch_failure counter\n'
+        b'launch_failure{project="a\\"b\\\\c\\nd"} 1.0\n'
+        b'launch_failure{project="caf\xc3\xa9"} +Inf\n')
+
+
+def test_family_without_labels():
+    family = MetricFamily('openstack_total_used_vcpus', 'total', [],
+                          [((), 3)])
+
+    assert exposition.encode([family]).endswith(
+        b'\nopenstack_total_used_vcpus 3.0\n')
+
+
+def test_name_matcher():
+    matches = exposition.name_matcher([
+        'openstack_used_vcpus', '{__name__=~"openstack_check_.+"}'])
+
+    assert matches('openstack_used_vcpus')
+    assert matches('openstack_check_nova_api')
+    assert not matches('openstack_free_vcpus')
+    assert not matches('x_openstack_check_nova_api')
+
+
+def test_name_matcher_rejects_other_labels():
+    with pytest.raises(ValueError):
+        exposition.name_matcher(['{region="RegionOne"}'])
+    with pytest.raises(ValueError):
+        exposition.name_matcher(['{__name__=~"("}'])
+
+
+def test_filter_families():
+    text = exposition.encode([
+        MetricFamily('openstack_used_vcpus', 'used', ['host'],
+                     [(('a', ), 2)]),
+        MetricFamily('openstack_free_vcpus', 'free', ['host'],
+                     [(('a', ), 6)]),
+    ])
+
+    assert exposition.filter_families(
+        text, lambda name: name == 'openstack_free_vcpus') == (
+        b'# HELP openstack_free_vcpus free\n'
+        b'# TYPE openstack_free_vcpus gauge\n'
+        b'openstack_free_vcpus{host="a"} 6.0\n')
+    assert exposition.filter_families(text, lambda name: False) == b''
+
+
+def test_filter_families_matches_sample_names():
+    registry = CollectorRegistry()
+    Histogram('request_duration_seconds', 'Duration', buckets=(1.0, ),
+              registry=registry).observe(0.5)
+    text = generate_latest(registry)
+    matches = exposition.name_matcher(['request_duration_seconds_count'])
+
+    assert exposition.filter_families(text, matches) == (
+        b'# HELP request_duration_seconds Duration\n'
+        b'# TYPE request_duration_seconds histogram\n'
+        b'request_duration_seconds_count 1.0\n')
+    assert exposition.filter_families(
+        text, exposition.name_matcher(['request_duration_seconds'])) == b''
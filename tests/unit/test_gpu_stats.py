@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+from exporter import gpu_stats
+from exporter.gpu_stats import GPUStats
+
+
+class FakeResponse(object):
+
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+class FakeGnocchi(object):
+
+    def __init__(self):
+        self.requests = []
+
+    def post(self, url, params=None, json=None):
+        self.requests.append((url, params, json))
+        metric_ids = json['operations'][len('(metric '):-1].split(') (')
+        return FakeResponse({'measures': {
+            metric_id.strip('()').split()[0]: {
+                'mean': [['t0', 60, 1.0], ['t1', 60, 2.0], ['t2', 60, None]]}
+            for metric_id in metric_ids}})
+
+
+def test_latest_measures_are_fetched_in_batches(monkeypatch):
+    monkeypatch.setattr(gpu_stats, 'BATCH_SIZE', 2)
+    collector = GPUStats.__new__(GPUStats)
+    collector.gnocchi_api = FakeGnocchi()
+
+    latest = collector.get_latest_measures(['m1', 'm2', 'm3'])
+
+    assert latest == {'m1': 2.0, 'm2': 2.0, 'm3': 2.0}
+    assert len(collector.gnocchi_api.requests) == 2
+    url, params, body = collector.gnocchi_api.requests[0]
+    assert url == 'v1/aggregates'
+    assert params['granularity'] == 60
+    assert 'start' in params
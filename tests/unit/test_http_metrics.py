@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from exporter import http_metrics
+
+
+def test_classify_uses_longest_catalog_prefix(monkeypatch):
+    monkeypatch.setattr(http_metrics, '_endpoints', [])
+    http_metrics.register_catalog([
+        {'type': 'compute', 'endpoints': [
+            {'url': 'http://nova:8774/v2.1', 'interface': 'public',
+             'region_id': 'RegionOne'}]},
+        {'type': 'placement', 'endpoints': [
+            {'url': 'http://nova:8774/v2.1/placement', 'interface': 'public',
+             'region_id': 'RegionOne'}]},
+    ])
+
+    assert http_metrics.classify(
+        'http://nova:8774/v2.1/os-hypervisors/detail?limit=1000') == (
+        'RegionOne', 'compute', 'os-hypervisors/detail')
+    assert http_metrics.classify(
+        'http://nova:8774/v2.1/placement/resource_providers/'
+        '6f8e3b7a-1b2c-4d5e-8f90-123456789abc/inventories') == (
+        'RegionOne', 'placement', 'resource_providers/{id}/inventories')
+    assert http_metrics.classify('http://other/v3/auth/tokens') == (
+        '', 'identity', 'auth/tokens')
+    assert http_metrics.classify('http://other/api/v1/stats') == (
+        '', 'unknown', 'api/v1/stats')
+
+
+def test_classify_labels_the_region_of_endpoints(monkeypatch):
+    monkeypatch.setattr(http_metrics, '_endpoints', [])
+    http_metrics.register_catalog([
+        {'type': 'compute', 'endpoints': [
+            {'url': 'http://nova-1:8774/v2.1', 'region_id': 'RegionOne'},
+            {'url': 'http://nova-2:8774/v2.1', 'region_id': 'RegionTwo'}]},
+        {'type': 'identity', 'endpoints': [
+            {'url': 'http://keystone/v3', 'region_id': 'RegionOne'},
+            {'url': 'http://keystone/v3', 'region_id': 'RegionTwo'}]},
+    ])
+
+    assert http_metrics.classify('http://nova-2:8774/v2.1/servers')[:2] == (
+        'RegionTwo', 'compute')
+    assert http_metrics.classify('http://keystone/v3/projects')[:2] == (
+        '', 'identity')
+
+
+def test_classify_labels_root_urls_with_the_service_of_their_host(
+        monkeypatch):
+    monkeypatch.setattr(http_metrics, '_endpoints', [])
+    http_metrics.register_endpoint(
+        'http://nova:8774/v2.1', 'compute', 'RegionOne')
+    http_metrics.register_endpoint(
+        'http://nova:8774/v2.1/placement', 'placement', 'RegionOne')
+
+    assert http_metrics.classify('http://nova:8774') == (
+        'RegionOne', 'compute', '/')
+    assert http_metrics.classify('http://nova:8774/healthcheck') == (
+        'RegionOne', 'compute', 'healthcheck')
+    assert http_metrics.classify('http://glance:9292/') == (
+        '', 'unknown', '/')
+
+
+class FakeResponse(object):
+    status_code = 200
+    content = b'{"servers": []}'
+
+
+def test_adapter_records_requests(monkeypatch):
+    monkeypatch.setattr(http_metrics, '_endpoints', [])
+    monkeypatch.setattr(HTTPAdapter, 'send',
+                        lambda self, request, **kwargs: FakeResponse())
+    http_metrics.register_endpoint('http://nova:8774/v2.1', 'compute')
+    request = requests.Request(
+        'GET', 'http://nova:8774/v2.1/servers/detail').prepare()
+
+    http_metrics.InstrumentedHTTPAdapter().send(request)
+
+    labels = {'region': '', 'service': 'compute',
+              'endpoint': 'servers/detail'}
+    registry = http_metrics.registry
+    assert registry.get_sample_value(
+        'openstack_exporter_upstream_response_bytes_total', labels) >= 15
+    assert registry.get_sample_value(
+        'openstack_exporter_upstream_responses_total',
+        dict(labels, code='200')) >= 1
+    assert registry.get_sample_value(
+        'openstack_exporter_upstream_request_duration_seconds_count',
+        labels) >= 1
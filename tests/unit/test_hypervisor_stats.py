@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+from exporter import hypervisor_stats
+from exporter.hypervisor_stats import HypervisorStats
+from exporter.oscache import OSCache
+
+
+class FakeOSClient(object):
+    region = 'RegionOne'
+
+    def get_json(self, service, resource):
+        return {'aggregates': [
+            {'id': 1, 'name': 'freepool', 'hosts': ['a.example.com']},
+            {'id': 2, 'name': 'lease', 'hosts': ['a', 'b']},
+            {'id': 3, 'name': 'empty', 'hosts': []},
+        ]}
+
+    def paginate(self, service, resource, entry, params=None, headers=None):
+        for host, vcpus_used, free_ram in (('a', 2, 1000), ('b', 4, 3000)):
+            yield {
+                'hypervisor_hostname': host,
+                'vcpus': 8,
+                'vcpus_used': vcpus_used,
+                'memory_mb_used': 1000,
+                'free_ram_mb': free_ram,
+            }
+
+
+def stats_by_name(stats, **labels):
+    return {
+        s['stat_name']: s['stat_value'] for s in stats
+        if all(s.get(k) == v for k, v in labels.items())}
+
+
+def test_aggregates_and_totals_are_reduced_from_host_columns():
+    collector = HypervisorStats(
+        OSCache(60, 'RegionOne'), FakeOSClient(), 1.5, 1)
+
+    stats = collector.build_cache_data()
+
+    host_b = stats_by_name(stats, host='b')
+    assert host_b['free_vcpus'] == 8
+    assert host_b['used_vcpus'] == 4
+
+    freepool = stats_by_name(stats, aggregate='freepool')
+    assert freepool['aggregate_free_vcpus'] == 10
+    assert freepool['aggregate_free_ram_percent'] == 50.0
+
+    lease = stats_by_name(stats, aggregate='lease')
+    assert lease['aggregate_free_vcpus'] == 18
+    assert lease['aggregate_free_ram_MB'] == 4000
+    assert lease['aggregate_free_ram_percent'] == 66.67
+
+    assert stats_by_name(stats, aggregate='empty')['aggregate_used_vcpus'] == 0
+    assert stats_by_name(stats)['total_free_vcpus'] == 18
+    assert stats_by_name(stats)['total_running_instances'] == 0
+
+
+def test_only_the_leader_reports_aggregates_and_totals():
+    sharding = hypervisor_stats.sharding
+    stats = []
+    try:
+        for index in range(2):
+            sharding.configure(index, 2)
+            collector = HypervisorStats(
+                OSCache(60, 'RegionOne'), FakeOSClient(), 1.5, 1)
+            stats.append(collector.build_cache_data())
+    finally:
+        sharding.configure()
+
+    hosts = [s['host'] for shard in stats for s in shard
+             if s['stat_name'] == 'used_vcpus']
+    assert sorted(hosts) == ['a', 'b']
+    assert stats_by_name(stats[0])['total_free_vcpus'] == 18
+    assert not [s for s in stats[1] if 'host' not in s]
+
+
+def test_each_stat_is_rendered_as_one_family():
+    oscache = OSCache(60, 'RegionOne')
+    collector = HypervisorStats(oscache, FakeOSClient(), 1.5, 1)
+    oscache.cache['hypervisor_stats'] = collector.build_cache_data()
+
+    stats = collector.get_stats()
+
+    assert stats.count(b'# TYPE openstack_used_vcpus gauge\n') == 1
+    assert (b'openstack_used_vcpus{region="RegionOne",host="b",'
+            b'aggregate="",aggregate_id=""} 4.0\n') in stats
+    assert (b'openstack_aggregate_free_vcpus{region="RegionOne",host="",'
+            b'aggregate="lease",aggregate_id="2"} 18.0\n') in stats
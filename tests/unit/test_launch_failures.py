@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+
+from exporter.launch_failures import LaunchFailures
+from exporter.oscache import OSCache
+
+
+def test_changes_are_counted_once_across_refreshes():
+    launch_failures = LaunchFailures(OSCache(60, 'RegionOne'), None)
+    launch_failures.cursors['compute'] = (
+        datetime(2020, 1, 1, 0, 0, 0), frozenset())
+    servers = [
+        ('old', '2019-12-31T23:00:00Z', 'old'),
+        ('a', '2020-01-01T00:00:00Z', 'a'),
+        ('b', '2020-01-01T00:00:05Z', 'b'),
+    ]
+
+    changed, cursor = launch_failures._changes('compute', iter(servers))
+    assert changed == ['a', 'b']
+    assert cursor == (datetime(2020, 1, 1, 0, 0, 5), frozenset(['b']))
+
+    launch_failures.cursors['compute'] = cursor
+    servers.append(('c', '2020-01-01T00:00:05.123456+00:00', 'c'))
+    changed, cursor = launch_failures._changes('compute', iter(servers))
+    assert changed == ['c']
+    assert cursor == (datetime(2020, 1, 1, 0, 0, 5), frozenset(['b', 'c']))
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+from types import ModuleType
+
+import pytest
+
+from exporter import main
+
+
+class Collector(object):
+    SHARDED = False
+    created = []
+
+    def __init__(self, oscache, osclient, *arguments):
+        self.created.append((type(self).__name__, arguments))
+
+
+class ShardedCollector(Collector):
+    SHARDED = True
+
+
+@pytest.fixture
+def collectors(monkeypatch):
+    """ two fake collectors in a module of their own """
+    module = ModuleType('fake_collectors')
+    module.Collector = Collector
+    module.ShardedCollector = ShardedCollector
+    monkeypatch.setattr(main.importlib, 'import_module', lambda name: module)
+    monkeypatch.setattr(main, 'COLLECTORS', OrderedDict([
+        ('check_os_api', ('fake_collectors', 'Collector')),
+        ('hypervisor_stats', ('fake_collectors', 'ShardedCollector')),
+        ('corsa_stats', ('fake_collectors', 'Collector')),
+    ]))
+    monkeypatch.delenv('ENABLED_COLLECTORS', raising=False)
+    Collector.created = []
+    yield Collector.created
+    main.sharding.configure()
+
+
+def test_all_collectors_are_enabled_by_default(collectors):
+    assert main.get_enabled_collectors({}) == [
+        'check_os_api', 'hypervisor_stats']
+    assert main.get_enabled_collectors({'switch_corsa': {}}) == [
+        'check_os_api', 'hypervisor_stats', 'corsa_stats']
+
+
+def test_enabled_collectors_are_read_from_the_environment(collectors,
+                                                          monkeypatch):
+    monkeypatch.setenv('ENABLED_COLLECTORS',
+                       ' hypervisor_stats, ,check_os_api,hypervisor_stats')
+    assert main.get_enabled_collectors({}) == [
+        'hypervisor_stats', 'check_os_api']
+    assert main.get_enabled_collectors(
+        {'ENABLED_COLLECTORS': ['check_os_api', 'check_os_api']}) == [
+            'check_os_api']
+
+
+def test_corsa_needs_a_switch_section(collectors):
+    config = {'ENABLED_COLLECTORS': 'corsa_stats,check_os_api'}
+    assert main.get_enabled_collectors(config) == ['check_os_api']
+    config['switch_corsa'] = {'switches': []}
+    assert main.get_enabled_collectors(config) == [
+        'corsa_stats', 'check_os_api']
+
+
+def test_unknown_and_duplicate_collectors_are_skipped(collectors):
+    main.load_collectors(
+        ['check_os_api', 'nope', 'hypervisor_stats', 'check_os_api'],
+        None, None, {'hypervisor_stats': (1.5, 2.0)})
+    assert collectors == [('Collector', ()), ('ShardedCollector', (1.5, 2.0))]
+
+
+def test_other_shards_only_load_sharded_collectors(collectors):
+    main.sharding.configure(1, 2)
+    main.load_collectors(['check_os_api', 'hypervisor_stats'], None, None, {})
+    assert collectors == [('ShardedCollector', ())]
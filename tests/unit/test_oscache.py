@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+from multiprocessing.pool import ThreadPool
+from threading import Event, Thread
+from time import sleep, time
+import zlib
+
+from exporter.oscache import OSCache, RegionalCaches
+from tests.conftest import FakeCollector, rendered_cache
+
+
+def test_snapshot_contains_rendered_collectors():
+    oscache = rendered_cache([('first', b'first 1.0\n'),
+                              ('second', b'second 2.0\n')])
+    oscache.publish()
+
+    snapshot = oscache.get_snapshot()
+    assert snapshot.body.endswith(b'first 1.0\nsecond 2.0\n')
+    assert snapshot.parts[-2:] == [b'first 1.0\n', b'second 2.0\n']
+    assert snapshot.length == len(snapshot.body)
+    assert snapshot.gzip_length == len(snapshot.gzip_body)
+    assert snapshot.generation == 1
+
+
+def test_rendered_parts_of_selected_collectors():
+    oscache = rendered_cache([('first', b'first 1.0\n'),
+                              ('second', b'second 2.0\n')])
+
+    parts, deflated_parts = oscache.rendered_parts(['second'])
+    assert oscache.collector_keys() == ['first', 'second']
+    assert parts == [b'second 2.0\n']
+    assert zlib.decompressobj(-zlib.MAX_WBITS).decompress(
+        deflated_parts[0]) == parts[0]
+
+
+def test_concurrent_publish_keeps_the_latest_parts():
+    oscache = OSCache(60, 'RegionOne')
+    first = FakeCollector(oscache, 'first', b'first 1.0\n')
+    second = FakeCollector(oscache, 'second', b'second 2.0\n')
+    oscache.render(first)
+    started = Event()
+    resume = Event()
+
+    def slow_stats():
+        if not started.is_set():
+            started.set()
+            resume.wait(5)
+        return b''
+    oscache.get_stats = slow_stats
+    earlier = Thread(target=oscache.publish)
+    earlier.start()
+    assert started.wait(5)
+    oscache.render(second)
+    later = Thread(target=oscache.publish)
+    later.start()
+    sleep(0.1)
+    resume.set()
+    earlier.join()
+    later.join()
+
+    assert oscache.get_snapshot().body == b'first 1.0\nsecond 2.0\n'
+    assert oscache.get_snapshot().generation == 2
+
+
+def test_snapshot_etag_changes_with_generation():
+    oscache = OSCache(60, 'RegionOne')
+    collector = FakeCollector(oscache, 'first', b'first 1.0\n')
+    oscache.render(collector)
+    oscache.publish()
+    etag = oscache.get_snapshot().etag
+
+    assert oscache.get_snapshot().etag == etag
+    oscache.publish()
+    assert oscache.get_snapshot().etag != etag
+
+
+class SlowCollector(FakeCollector):
+
+    def __init__(self, oscache, key, body, event):
+        super(SlowCollector, self).__init__(oscache, key, body)
+        self.event = event
+
+    def build_cache_data(self):
+        self.event.wait(5)
+        return [self.body]
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time() + timeout
+    while not predicate() and time() < deadline:
+        sleep(0.01)
+    return predicate()
+
+
+def test_dispatch_discards_collectors_past_deadline():
+    oscache = OSCache(60, 'RegionOne', workers=2, timeout=0.2)
+    event = Event()
+    fast = FakeCollector(oscache, 'fast', b'fast 1.0\n')
+    slow = SlowCollector(oscache, 'slow', b'slow 1.0\n', event)
+    pool = ThreadPool(2)
+    try:
+        oscache.dispatch(pool, [fast, slow])
+        assert wait_for(lambda: 'fast' in oscache.refresh_status)
+        sleep(0.2)
+        oscache.expire()
+        assert oscache.refresh_status['slow']['status'] == 'timeout'
+    finally:
+        event.set()
+    assert wait_for(lambda: not oscache.in_flight)
+    pool.close()
+    pool.join()
+
+    assert oscache.get_cache_data('fast') == [b'fast 1.0\n']
+    assert oscache.get_cache_data('slow') == []
+    assert oscache.refresh_status['fast']['status'] == 'ok'
+
+
+def test_error_in_result_callback_does_not_stop_the_pool():
+    oscache = OSCache(60, 'RegionOne')
+    collector = FakeCollector(oscache, 'first', b'first 1.0\n')
+    report = oscache._report
+
+    def broken_report(*args, **kwargs):
+        raise RuntimeError('broken')
+    oscache._report = broken_report
+    pool = ThreadPool(1)
+    oscache.dispatch(pool, [collector])
+    assert wait_for(lambda: not oscache.in_flight and not oscache._batches)
+
+    oscache._report = report
+    oscache.dispatch(pool, [collector])
+    assert wait_for(lambda: 'first' in oscache.render_status)
+    pool.close()
+    pool.join()
+    assert oscache.refresh_status['first']['status'] == 'ok'
+
+
+def test_next_interval_is_splayed_around_collector_interval():
+    oscache = OSCache(60, 'RegionOne', intervals={'fast': 30}, splay=0.1)
+    fast = FakeCollector(oscache, 'fast', b'fast 1.0\n')
+    other = FakeCollector(oscache, 'other', b'other 1.0\n')
+
+    for _ in range(100):
+        assert 27 <= oscache.next_interval(fast) <= 33
+        assert 54 <= oscache.next_interval(other) <= 66
+
+
+class FailingCollector(FakeCollector):
+
+    def build_cache_data(self):
+        raise KeyError('hypervisors')
+
+
+def test_get_stats_reports_each_collector():
+    oscache = OSCache(60, 'RegionOne')
+    ok = FakeCollector(oscache, 'ok', b'ok 1.0\n')
+    failing = FailingCollector(oscache, 'failing', b'')
+    pool = ThreadPool(2)
+    oscache.dispatch(pool, [ok, failing])
+    assert wait_for(lambda: 'ok' in oscache.render_status and
+                    'failing' in oscache.refresh_status)
+    oscache.dispatch(pool, [failing])
+    assert wait_for(
+        lambda: oscache.refresh_status['failing']['errors']['KeyError'] == 2)
+    pool.close()
+    pool.join()
+
+    assert oscache.pending() == ['failing']
+    assert oscache.failing() == [('failing', 'failed')]
+
+    stats = oscache.get_stats()
+    assert (b'openstack_exporter_collector_items'
+            b'{collector="ok",region="RegionOne"} 1.0') in stats
+    assert (b'openstack_exporter_collector_rendered_bytes'
+            b'{collector="ok",region="RegionOne"} 7.0') in stats
+    assert (b'openstack_exporter_collector_errors_total'
+            b'{collector="failing",exception="KeyError",region="RegionOne"}'
+            b' 2.0') in stats
+    assert (b'openstack_exporter_collector_last_success_timestamp_seconds'
+            b'{collector="failing"') not in stats
+    assert oscache.refresh_status['ok']['cache_bytes'] > 0
+    assert (b'openstack_exporter_collector_cache_bytes'
+            b'{collector="failing",region="RegionOne"} 0.0') in stats
+
+
+class EmptyCollector(FakeCollector):
+
+    def build_cache_data(self):
+        return None
+
+
+def test_failed_refresh_keeps_last_good_data_until_too_stale():
+    oscache = OSCache(60, 'RegionOne', max_staleness=30)
+    collector = FakeCollector(oscache, 'flaky', b'flaky 1.0\n')
+    pool = ThreadPool(1)
+    oscache.dispatch(pool, [collector])
+    assert wait_for(lambda: 'flaky' in oscache.render_status)
+
+    collector.__class__ = EmptyCollector
+    oscache.dispatch(pool, [collector])
+    assert wait_for(
+        lambda: oscache.refresh_status['flaky']['status'] == 'failed')
+    pool.close()
+    pool.join()
+    assert oscache.get_cache_data('flaky') == [b'flaky 1.0\n']
+    assert b'flaky 1.0\n' in oscache.get_snapshot().body
+    assert oscache.is_ready()
+    assert b'openstack_exporter_collector_last_success_timestamp_seconds' \
+        in oscache.get_snapshot().body
+
+    oscache.evict_stale()
+    assert oscache.get_cache_data('flaky') == [b'flaky 1.0\n']
+    oscache.refresh_status['flaky']['last_success'] -= 31
+    oscache.evict_stale()
+    assert oscache.get_cache_data('flaky') == []
+    assert b'flaky 1.0\n' not in oscache.get_snapshot().body
+
+
+def test_state_is_restored_with_original_timestamps(tmpdir):
+    path = str(tmpdir.join('oscache.state'))
+    oscache = OSCache(60, 'RegionOne', state_path=path)
+    cheap = FakeCollector(oscache, 'cheap', b'cheap 1.0\n')
+    pool = ThreadPool(1)
+    oscache.dispatch(pool, [cheap])
+    assert wait_for(lambda: 'cheap' in oscache.render_status)
+    pool.close()
+    pool.join()
+    oscache.refresh_status['cheap']['duration'] = 0.5
+    oscache.save_state()
+
+    restored = OSCache(60, 'RegionOne', state_path=path)
+    expensive = FakeCollector(restored, 'expensive', b'expensive 1.0\n')
+    cheap = FakeCollector(restored, 'cheap', b'cheap 1.0\n')
+    assert restored.load_state()
+
+    assert restored.get_cache_data('cheap') == [b'cheap 1.0\n']
+    assert b'cheap 1.0\n' in restored.get_snapshot().body
+    assert restored.refresh_status['cheap']['last_success'] == \
+        oscache.refresh_status['cheap']['last_success']
+    assert restored.first_refresh_order() == [cheap, expensive]
+    assert sorted(restored.pending()) == ['cheap', 'expensive']
+    assert not restored.is_ready()
+
+
+def test_missing_state_is_ignored(tmpdir):
+    oscache = OSCache(60, 'RegionOne', state_path=str(tmpdir.join('none')))
+    FakeCollector(oscache, 'first', b'first 1.0\n')
+    assert oscache.load_state() is False
+    assert oscache.get_cache_data('first') == []
+
+
+def test_regional_caches_serve_all_regions():
+    regions = []
+    for region in ('RegionOne', 'RegionTwo'):
+        oscache = OSCache(60, region)
+        collector = FakeCollector(
+            oscache, 'hypervisor_stats', region.encode('ascii') + b' 1.0\n')
+        oscache.cache['hypervisor_stats'] = [
+            {'stat_name': 'total_used_vcpus', 'stat_value': 2}]
+        oscache.render(collector)
+        oscache.publish()
+        regions.append(oscache)
+    caches = RegionalCaches(regions, cross_region_totals=True)
+
+    snapshot = caches.get_snapshot()
+    assert snapshot.body.endswith(b'RegionOne 1.0\nRegionTwo 1.0\n')
+    assert snapshot.body.count(
+        b'# TYPE openstack_exporter_cache_refresh_duration_seconds') == 1
+    assert b'openstack_all_regions_total_used_vcpus 4.0' in snapshot.body
+    assert zlib.decompress(snapshot.gzip_body, 16 + zlib.MAX_WBITS) == \
+        snapshot.body
+    assert caches.get_snapshot() is snapshot
+
+    regions[1].publish()
+    assert caches.get_snapshot().etag != snapshot.etag
+    assert caches.pending() == [
+        'RegionOne/hypervisor_stats', 'RegionTwo/hypervisor_stats']
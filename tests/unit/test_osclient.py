@@ -1,8 +1,116 @@
 # -*- coding: utf-8 -*-
 
+from exporter import osclient
 from exporter.osclient import OSClient
 
 
 def test_uninitialized_token_is_invalid():
     osclient = OSClient(None, None, None, None, None, None, None, None)
     assert osclient.is_valid_token() is False
+
+
+def test_session_adapters_share_one_keystone_session(monkeypatch):
+    for name in ('OS_AUTH_URL', 'OS_USERNAME', 'OS_PASSWORD',
+                 'OS_USER_DOMAIN_NAME', 'OS_PROJECT_NAME',
+                 'OS_PROJECT_DOMAIN_NAME', 'OS_REGION_NAME'):
+        monkeypatch.setenv(name, 'http://keystone/v3')
+    monkeypatch.setattr(osclient, '_keystone_session', None)
+    monkeypatch.setattr(osclient, '_adapters', {})
+
+    compute = osclient.session_adapter('compute')
+    identity = osclient.session_adapter('identity')
+
+    assert osclient.session_adapter('compute') is compute
+    assert compute.session is identity.session
+    assert compute.session is osclient.get_keystone_session()
+
+
+def test_paginate_follows_next_link_markers():
+    pages = {
+        None: {'servers': [{'id': 'a'}, {'id': 'b'}],
+               'servers_links': [{
+                   'rel': 'next',
+                   'href': 'http://public/v2.1/servers/detail?limit=2&marker=b'
+               }]},
+        'b': {'servers': [{'id': 'c'}]},
+    }
+    calls = []
+
+    def get(path, params):
+        calls.append((path, dict(params)))
+        return pages[params.get('marker')]
+
+    servers = osclient.paginate(get, 'servers/detail', 'servers',
+                                params={'all_tenants': True}, limit=2)
+
+    assert [s['id'] for s in servers] == ['a', 'b', 'c']
+    assert calls == [
+        ('servers/detail', {'all_tenants': True, 'limit': 2}),
+        ('servers/detail', {'all_tenants': True, 'limit': 2, 'marker': 'b'}),
+    ]
+
+
+def test_paginate_stops_without_next_link():
+    def get(path, params):
+        return {'projects': [{'id': 'a'}], 'links': {'next': None}}
+
+    projects = osclient.paginate(get, 'v3/projects', 'projects')
+
+    assert list(projects) == [{'id': 'a'}]
+
+
+def test_paginate_follows_links_with_and_without_marker():
+    def get(path, params):
+        if path == 'v3/projects':
+            return {'projects': [{'id': '1'}],
+                    'links': {'next': 'http://keystone/v3/projects?page=2'}}
+        if 'marker' not in params:
+            return {'projects': [{'id': '2'}],
+                    'links': {'next': 'http://keystone/v3/projects?marker=2'}}
+        return {'projects': [{'id': '3'}], 'links': {'next': None}}
+
+    projects = osclient.paginate(get, 'v3/projects', 'projects', limit=None)
+
+    assert [p['id'] for p in projects] == ['1', '2', '3']
+
+
+def test_paginate_stops_when_next_link_repeats():
+    calls = []
+
+    def get(path, params):
+        calls.append(path)
+        return {'hypervisors': [{'id': len(calls)}],
+                'hypervisors_links': [
+                    {'rel': 'next', 'href': 'http://nova/os-hypervisors?p=2'}]}
+
+    hypervisors = osclient.paginate(get, 'os-hypervisors', 'hypervisors')
+
+    assert [h['id'] for h in hypervisors] == [1, 2]
+    assert len(calls) == 2
+
+
+def test_regions_share_the_token_and_get_their_own_catalog(monkeypatch):
+    catalog = [{
+        'name': 'nova', 'type': 'compute',
+        'endpoints': [
+            {'region': region, 'interface': 'public',
+             'url': 'http://nova.{}/v2.1'.format(region)}
+            for region in ('RegionOne', 'RegionTwo')]}]
+
+    one = OSClient('http://keystone/v3', None, None, None, None,
+                   'RegionOne', None, None)
+    two = one.for_region('RegionTwo')
+    requests = []
+
+    def get_token():
+        requests.append(None)
+        token = one._keystone_token
+        token.token = 'token'
+        token.catalog = catalog
+        token.generation += 1
+    monkeypatch.setattr(one, 'get_token', get_token)
+
+    assert one.get_service('nova')['url'] == 'http://nova.RegionOne/v2.1'
+    assert two.get_service('nova')['url'] == 'http://nova.RegionTwo/v2.1'
+    assert two.token == 'token'
+    assert len(requests) == 1
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+import pickle
+
+from exporter.records import Record, footprint
+
+
+class Stat(Record):
+    __slots__ = ('stat_name', 'stat_value', 'host')
+
+
+def test_record_reads_like_a_dict():
+    stat = Stat(stat_name='used_vcpus', stat_value=4)
+
+    assert stat['stat_name'] == 'used_vcpus'
+    assert stat.get('host', '') == ''
+    assert 'host' not in stat
+    assert stat == {'stat_name': 'used_vcpus', 'stat_value': 4}
+    assert stat != Stat(stat_name='used_vcpus', stat_value=5)
+    assert pickle.loads(pickle.dumps(stat, pickle.HIGHEST_PROTOCOL)) == stat
+
+
+def test_label_values_are_interned():
+    first = Stat(host=u''.join([u'host', u'-1']))
+    second = Stat(host=u''.join([u'host', u'-', u'1']))
+
+    assert first.host is second.host
+
+
+def test_records_are_smaller_than_dicts():
+    stats = [('free_vcpus', float(i), u'host-{}'.format(i % 100))
+             for i in range(1000)]
+    records = [Stat(stat_name=name, stat_value=value, host=host)
+               for name, value, host in stats]
+    dicts = [{'stat_name': name, 'stat_value': value, 'host': host}
+             for name, value, host in stats]
+
+    assert footprint(records) < footprint(dicts) * 0.7
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+from threading import Event, Thread
+
+from exporter.request_cache import RequestCache
+
+
+def test_concurrent_requests_are_fetched_once():
+    cache = RequestCache(60)
+    started = Event()
+    release = Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {'aggregates': []}
+
+    results = []
+    threads = [Thread(target=lambda: results.append(
+        cache.get(('compute', 'os-aggregates'), fetch))) for _ in range(4)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert results == [{'aggregates': []}] * 4
+
+
+def test_failed_requests_are_not_cached():
+    cache = RequestCache(60)
+    results = iter([None, {'hosts': []}])
+
+    assert cache.get(('reservation', 'os-hosts'), lambda: next(results)) \
+        is None
+    assert cache.get(('reservation', 'os-hosts'), lambda: next(results)) \
+        == {'hosts': []}
+
+
+def test_expired_entries_are_fetched_again():
+    cache = RequestCache(0)
+    results = iter([1, 2])
+
+    assert cache.get('key', lambda: next(results)) == 1
+    assert cache.get('key', lambda: next(results)) == 2
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+
+from threading import Event, Thread
+from time import time
+import zlib
+
+import pytest
+from six.moves import http_client
+from six.moves.urllib.parse import quote
+
+from exporter.server import OpenstackExporterHandler, ThreadingHTTPServer
+from tests.conftest import rendered_cache
+
+
+@pytest.fixture
+def oscache():
+    oscache = rendered_cache([
+        ('check_os_api', b'openstack_check_api 1.0\n'),
+        ('hypervisor_stats', b'openstack_used_vcpus 2.0\n')])
+    oscache.publish()
+    return oscache
+
+
+@pytest.fixture
+def serve(oscache):
+    """ start a server on a free port, stopped at the end of the test """
+    servers = []
+
+    def start(max_requests=16):
+        server = ThreadingHTTPServer(
+            ('127.0.0.1', 0), OpenstackExporterHandler, oscache,
+            max_requests)
+        thread = Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        servers.append((server, thread))
+        return server
+    yield start
+    for server, thread in servers:
+        server.stopping = True
+        server.shutdown()
+        server.drain(1)
+        server.server_close()
+
+
+def connect(server, timeout=5):
+    return http_client.HTTPConnection(
+        '127.0.0.1', server.server_address[1], timeout=timeout)
+
+
+def get(connection, path, headers=None):
+    connection.request('GET', path, headers=headers or {})
+    response = connection.getresponse()
+    return response, response.read()
+
+
+def test_connection_is_kept_alive(serve):
+    server = serve()
+    connection = connect(server)
+
+    for _ in range(3):
+        response, body = get(connection, '/metrics')
+        assert response.status == 200
+        assert body.endswith(b'openstack_used_vcpus 2.0\n')
+    assert int(response.getheader('Content-Length')) == len(body)
+    connection.close()
+
+
+def test_idle_connection_does_not_hold_a_slot(serve):
+    server = serve(max_requests=1)
+    idle = connect(server)
+    assert get(idle, '/metrics')[0].status == 200
+
+    start = time()
+    other = connect(server, timeout=2)
+    assert get(other, '/metrics')[0].status == 200
+    assert time() - start < 1
+    idle.close()
+    other.close()
+
+
+def test_requests_wait_for_a_slot(serve, oscache):
+    server = serve(max_requests=1)
+    entered = Event()
+    resume = Event()
+    snapshot = oscache.get_snapshot
+
+    def slow_snapshot():
+        if not entered.is_set():
+            entered.set()
+            resume.wait(5)
+        return snapshot()
+    oscache.get_snapshot = slow_snapshot
+    statuses = []
+
+    def scrape():
+        connection = connect(server)
+        statuses.append(get(connection, '/metrics')[0].status)
+        connection.close()
+    first = Thread(target=scrape)
+    first.start()
+    assert entered.wait(5)
+    second = Thread(target=scrape)
+    second.start()
+    second.join(0.5)
+    assert second.is_alive()
+    assert statuses == []
+
+    resume.set()
+    first.join(5)
+    second.join(5)
+    assert statuses == [200, 200]
+
+
+def test_drain_closes_idle_connections(serve):
+    server = serve()
+    idle = connect(server)
+    assert get(idle, '/metrics')[0].status == 200
+
+    start = time()
+    server.stopping = True
+    server.shutdown()
+    assert server.drain(2)
+    assert time() - start < 1
+    idle.sock.settimeout(2)
+    assert idle.sock.recv(1) == b''
+    idle.close()
+
+
+def test_unchanged_snapshot_is_not_modified(serve, oscache):
+    connection = connect(serve())
+    response, body = get(connection, '/metrics')
+    etag = response.getheader('ETag')
+
+    response, body = get(connection, '/metrics', {'If-None-Match': etag})
+    assert response.status == 304
+    assert body == b''
+
+    oscache.publish()
+    response, body = get(connection, '/metrics', {'If-None-Match': etag})
+    assert response.status == 200
+    assert response.getheader('ETag') != etag
+    connection.close()
+
+
+def test_gzip_is_negotiated(serve, oscache):
+    connection = connect(serve())
+    response, body = get(connection, '/metrics',
+                         {'Accept-Encoding': 'deflate, gzip;q=0.5'})
+    assert response.getheader('Content-Encoding') == 'gzip'
+    assert zlib.decompress(body, 16 + zlib.MAX_WBITS) == \
+        oscache.get_snapshot().body
+    gzip_etag = response.getheader('ETag')
+
+    response, body = get(connection, '/metrics',
+                         {'Accept-Encoding': 'gzip;q=0'})
+    assert response.getheader('Content-Encoding') is None
+    assert body == oscache.get_snapshot().body
+    assert response.getheader('ETag') != gzip_etag
+    connection.close()
+
+
+def test_ready_lists_pending_and_failed_collectors(serve, oscache):
+    connection = connect(serve())
+    oscache._report('check_os_api', 'ok', 0.1, items=1, size=10)
+    oscache._report('hypervisor_stats', 'timeout', 30, error='Timeout')
+
+    response, body = get(connection, '/ready')
+    assert response.status == 503
+    assert body == (b'waiting for hypervisor_stats\n'
+                    b'not refreshed: hypervisor_stats (timeout)\n')
+
+    oscache._report('hypervisor_stats', 'ok', 1, items=1, size=10)
+    response, body = get(connection, '/ready')
+    assert response.status == 200
+    assert body == b'ready\n'
+    connection.close()
+
+
+def test_collectors_are_scraped_on_their_own(serve):
+    connection = connect(serve())
+
+    response, body = get(connection, '/metrics/check_os_api')
+    assert response.status == 200
+    assert body == b'openstack_check_api 1.0\n'
+
+    response, body = get(
+        connection, '/metrics?collector=hypervisor_stats,check_os_api')
+    assert body == b'openstack_check_api 1.0\nopenstack_used_vcpus 2.0\n'
+
+    response, body = get(connection, '/metrics/exporter')
+    assert body.startswith(b'# HELP openstack_exporter_')
+    assert b'openstack_check_api' not in body
+
+    response, body = get(connection, '/metrics/check_os_api',
+                         {'Accept-Encoding': 'gzip'})
+    assert zlib.decompress(body, 16 + zlib.MAX_WBITS) == \
+        b'openstack_check_api 1.0\n'
+    connection.close()
+
+
+def test_metric_families_are_filtered_by_name(serve):
+    connection = connect(serve())
+    selector = quote('{__name__=~"openstack_used_.*"}')
+
+    response, body = get(connection, '/metrics?match[]=' + selector)
+    assert response.status == 200
+    assert body == b'openstack_used_vcpus 2.0\n'
+    assert int(response.getheader('Content-Length')) == len(body)
+
+    response, body = get(
+        connection, '/metrics/check_os_api?match[]=openstack_check_api'
+        '&match[]=openstack_used_vcpus', {'Accept-Encoding': 'gzip'})
+    assert response.getheader('Content-Encoding') == 'gzip'
+    assert zlib.decompress(body, 16 + zlib.MAX_WBITS) == \
+        b'openstack_check_api 1.0\n'
+    connection.close()
+
+
+def test_bad_scrape_parameters_are_rejected(serve):
+    connection = connect(serve())
+
+    response, body = get(connection, '/metrics/node_stats')
+    assert response.status == 404
+    assert body == b'unknown collector node_stats\n'
+
+    response, body = get(
+        connection, '/metrics?match[]=' + quote('{region="RegionOne"}'))
+    assert response.status == 400
+    assert body.startswith(b'unsupported metric selector')
+    connection.close()
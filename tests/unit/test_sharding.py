@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+import random
+import uuid
+
+import pytest
+
+from exporter import sharding
+from exporter.sharding import ShardRing
+
+
+def test_ring_spreads_keys_and_moves_few_when_a_shard_is_added():
+    keys = [str(uuid.UUID(int=random.Random(i).getrandbits(128)))
+            for i in range(10000)]
+    two = ShardRing(2)
+    three = ShardRing(3)
+
+    shards = [two.shard_for(key) for key in keys]
+    for shard in range(2):
+        assert 4500 < shards.count(shard) < 5500
+
+    moved = sum(1 for key, shard in zip(keys, shards)
+                if three.shard_for(key) != shard)
+    assert moved < len(keys) * 0.4
+
+
+def test_each_key_is_owned_by_exactly_one_shard():
+    keys = ['host-{}'.format(i) for i in range(100)]
+    owners = []
+    try:
+        for index in range(3):
+            sharding.configure(index, 3)
+            owners.extend(sharding.owned(keys, key=lambda k: k))
+    finally:
+        sharding.configure()
+
+    assert sorted(owners) == sorted(keys)
+    assert sharding.owned(keys, key=lambda k: k) == keys
+
+
+def test_invalid_shard_is_rejected():
+    with pytest.raises(ValueError):
+        sharding.configure(2, 2)
@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+# Copyright 2017 The Openstack-Helm Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" End to end refresh benchmark against tools/fake_openstack.py.
+
+Starts the fake cloud in a separate process, then refreshes each collector
+of the exporter against it with a cold request cache and records:
+
+  * the refresh and render durations of each collector
+  * the requests it sent and the bytes it received, by endpoint
+  * the peak RSS of the benchmark process after it ran
+  * the memory used by its cached data
+  * the size of its part of /metrics
+
+A full cycle of all the collectors refreshed concurrently by OSCache is
+measured last, along with the size of the /metrics body and its gzip
+encoding. The results are written as JSON with --output, and compared with
+the results of a previous run with --compare.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+import requests
+
+TOOLS_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, TOOLS_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(TOOLS_DIR), 'exporter'))
+
+import fake_openstack  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+def start_cloud(args):
+    """ start the fake cloud and wait for all of its services """
+    command = [
+        sys.executable, os.path.join(TOOLS_DIR, 'fake_openstack.py'),
+        '--nodes', str(args.nodes),
+        '--seed', str(args.seed),
+        '--host', args.host,
+        '--port', str(args.port),
+        '--region', args.region,
+        '--latency', str(args.latency),
+        '--jitter', str(args.jitter)]
+    for option in args.service_latency:
+        command += ['--service-latency', option]
+    process = subprocess.Popen(command)
+    ports = len(fake_openstack.SERVICES) + switch_count(args.nodes)
+    deadline = time.time() + args.startup_timeout
+    for offset in range(ports):
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError("fake cloud exited with {}".format(
+                    process.returncode))
+            try:
+                socket.create_connection(
+                    (args.host, args.port + offset), 1).close()
+                break
+            except socket.error:
+                if time.time() > deadline:
+                    process.terminate()
+                    raise RuntimeError("fake cloud did not start")
+                time.sleep(0.2)
+    return process
+
+
+def switch_count(nodes):
+    return max(1, -(-nodes // fake_openstack.PORTS_PER_SWITCH))
+
+
+def peak_rss_kb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return usage // 1024 if sys.platform == 'darwin' else usage
+
+
+class Benchmark(object):
+
+    def __init__(self, args):
+        self.args = args
+        self.stats_url = 'http://{}:{}/_fake'.format(args.host, args.port)
+        os.environ.update({
+            'OS_AUTH_URL': 'http://{}:{}/v3'.format(args.host, args.port),
+            'OS_USERNAME': 'exporter',
+            'OS_PASSWORD': 'password',
+            'OS_PROJECT_NAME': 'service',
+            'OS_USER_DOMAIN_NAME': 'default',
+            'OS_PROJECT_DOMAIN_NAME': 'default',
+            'OS_REGION_NAME': args.region,
+        })
+
+        from osclient import OSClient, configure_sessions, request_cache
+        from oscache import OSCache
+        from records import footprint
+        from check_os_api import CheckOSApi
+        from cinder_services import CinderServiceStats
+        from corsa_stats import CorsaStats
+        from gpu_stats import GPUStats
+        from hypervisor_stats import HypervisorStats
+        from launch_failures import LaunchFailures
+        from neutron_agents import NeutronAgentStats
+        from node_stats import NodeStats
+        from nova_services import NovaServiceStats
+
+        self.request_cache = request_cache
+        self.footprint = footprint
+        configure_sessions(args.pool_size)
+        osclient = OSClient(
+            os.environ['OS_AUTH_URL'], 'password', 'service', 'exporter',
+            'default', args.region, args.timeout, 0)
+        self.oscache = OSCache(
+            3600, args.region, args.workers, args.timeout)
+        switches = [
+            {'name': 'corsa-{}'.format(switch),
+             'address': 'http://{}:{}'.format(
+                 args.host,
+                 args.port + len(fake_openstack.SERVICES) + switch),
+             'token': 'fake'}
+            for switch in range(switch_count(args.nodes))]
+        collectors = [
+            CheckOSApi(self.oscache, osclient),
+            NovaServiceStats(self.oscache, osclient),
+            NeutronAgentStats(self.oscache, osclient),
+            CinderServiceStats(self.oscache, osclient),
+            HypervisorStats(self.oscache, osclient, 1, 1),
+            NodeStats(self.oscache, osclient),
+            GPUStats(self.oscache, osclient),
+            CorsaStats(self.oscache, osclient, switches),
+            LaunchFailures(self.oscache, osclient),
+        ]
+        if args.collectors:
+            collectors = [c for c in collectors
+                          if c.get_cache_key() in args.collectors]
+        self.collectors = collectors
+
+    def reset_counters(self):
+        requests.post(self.stats_url + '/reset').raise_for_status()
+
+    def counters(self):
+        r = requests.get(self.stats_url + '/stats')
+        r.raise_for_status()
+        return r.json()
+
+    def run_collector(self, collector):
+        """ refresh a collector `repeat` times with a cold request cache """
+        key = collector.get_cache_key()
+        durations = []
+        result = {'collector': key}
+        for attempt in range(self.args.repeat):
+            self.request_cache.clear()
+            self.reset_counters()
+            start = time.time()
+            try:
+                data = collector.build_cache_data()
+            except Exception as e:
+                logger.error("collector {} failed: {!r}".format(key, e))
+                result['error'] = repr(e)
+                return result
+            durations.append(time.time() - start)
+            if attempt == 0:
+                endpoints = self.counters()
+        self.oscache.cache[key] = data
+
+        start = time.time()
+        self.oscache.render(collector)
+        render_duration = time.time() - start
+        rendered = self.oscache.rendered.get(key)
+
+        durations.sort()
+        result.update({
+            'refresh_seconds': durations[len(durations) // 2],
+            'refresh_seconds_max': durations[-1],
+            'render_seconds': render_duration,
+            'requests': sum(e['requests'] for e in endpoints.values()),
+            'response_bytes': sum(e['bytes'] for e in endpoints.values()),
+            'endpoints': endpoints,
+            'records': len(data) if hasattr(data, '__len__') else None,
+            'cache_bytes': self.footprint(data),
+            'metrics_bytes': len(rendered[1]) if rendered else None,
+            'peak_rss_kb': peak_rss_kb(),
+        })
+        if rendered is None:
+            result['error'] = 'render failed'
+        return result
+
+    def run_cycle(self):
+        """ refresh all the collectors concurrently, as OSCache does """
+        from multiprocessing.pool import ThreadPool
+
+        self.request_cache.clear()
+        self.reset_counters()
+        pool = ThreadPool(self.args.workers)
+        start = time.time()
+        self.oscache.dispatch(pool, self.collectors)
+        deadline = start + self.args.timeout
+        while self.oscache.in_flight and time.time() < deadline:
+            time.sleep(0.01)
+        duration = time.time() - start
+        pool.close()
+        endpoints = self.counters()
+        snapshot = self.oscache.get_snapshot()
+        return {
+            'refresh_seconds': duration,
+            'requests': sum(e['requests'] for e in endpoints.values()),
+            'response_bytes': sum(e['bytes'] for e in endpoints.values()),
+            'status': {
+                key: status['status'] for key, status
+                in self.oscache.refresh_status.items()},
+            'metrics_bytes': snapshot.length,
+            'metrics_gzip_bytes': snapshot.gzip_length,
+            'peak_rss_kb': peak_rss_kb(),
+        }
+
+    def run(self):
+        results = {
+            'cloud': {
+                'nodes': self.args.nodes,
+                'seed': self.args.seed,
+                'latency': self.args.latency,
+                'jitter': self.args.jitter,
+                'service_latency': self.args.service_latency,
+            },
+            'python': platform.python_version(),
+            'revision': revision(),
+            'timestamp': int(time.time()),
+            'collectors': [],
+        }
+        for collector in self.collectors:
+            results['collectors'].append(self.run_collector(collector))
+        results['cycle'] = self.run_cycle()
+        return results
+
+
+def revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'],
+            cwd=TOOLS_DIR).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+COLUMNS = [
+    ('refresh_seconds', 'refresh s', '{:.3f}'),
+    ('render_seconds', 'render s', '{:.3f}'),
+    ('requests', 'requests', '{}'),
+    ('response_bytes', 'resp bytes', '{}'),
+    ('cache_bytes', 'cache B', '{}'),
+    ('metrics_bytes', 'metrics B', '{}'),
+    ('peak_rss_kb', 'rss KiB', '{}'),
+]
+
+
+def report(results, baseline=None):
+    """ print the results, with the ratio to the baseline when given """
+    rows = list(results['collectors'])
+    rows.append(dict(results['cycle'], collector='cycle'))
+    before = {}
+    if baseline:
+        before = {r['collector']: r for r in baseline['collectors']}
+        before['cycle'] = dict(baseline['cycle'], collector='cycle')
+
+    print('{} nodes, latency {}s, revision {}'.format(
+        results['cloud']['nodes'], results['cloud']['latency'],
+        results['revision']))
+    print('{:<22}'.format('collector') + ''.join(
+        '{:>16}'.format(title) for _, title, _ in COLUMNS))
+    for row in rows:
+        line = '{:<22}'.format(row['collector'])
+        for name, _, fmt in COLUMNS:
+            value = row.get(name)
+            cell = fmt.format(value) if value is not None else '-'
+            old = before.get(row['collector'], {}).get(name)
+            if value is not None and old:
+                cell += ' {:+.0%}'.format(float(value) / old - 1)
+            line += '{:>16}'.format(cell)
+        if row.get('error'):
+            line += '  ' + row['error']
+        print(line)
+    print('/metrics {} bytes, {} bytes gzipped'.format(
+        results['cycle']['metrics_bytes'],
+        results['cycle']['metrics_gzip_bytes']))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the exporter collectors against a fake cloud')
+    parser.add_argument('--nodes', type=int, default=1000,
+                        help='number of bare metal nodes of the fake cloud')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=35000,
+                        help='first port of the fake cloud')
+    parser.add_argument('--region', default='RegionOne')
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--service-latency', action='append', default=[],
+                        metavar='SERVICE=SECONDS')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='refreshes of each collector, the median is '
+                             'reported')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='concurrent collectors of the full cycle')
+    parser.add_argument('--pool-size', type=int, default=10)
+    parser.add_argument('--timeout', type=int, default=300)
+    parser.add_argument('--startup-timeout', type=int, default=120)
+    parser.add_argument('--collectors', nargs='*',
+                        help='cache keys of the collectors to run')
+    parser.add_argument('--output', type=argparse.FileType('w'),
+                        help='write the results as JSON')
+    parser.add_argument('--compare', type=argparse.FileType('r'),
+                        help='results of a previous run to compare with')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(asctime)s:%(levelname)s:%(message)s")
+
+    baseline = json.load(args.compare) if args.compare else None
+    process = start_cloud(args)
+    try:
+        results = Benchmark(args).run()
+    finally:
+        process.terminate()
+        process.wait()
+
+    if args.output:
+        json.dump(results, args.output, indent=2, sort_keys=True)
+    report(results, baseline)
+
+
+if __name__ == '__main__':
+    main()
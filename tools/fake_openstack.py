@@ -0,0 +1,587 @@
+#!/usr/bin/env python
+# Copyright 2017 The Openstack-Helm Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Stand-in for the OpenStack APIs scraped by the exporter.
+
+Serves a synthetic cloud of bare metal nodes: the Keystone token and
+catalog, Nova aggregates, hypervisors, services and servers, Neutron agents,
+Cinder services, Ironic nodes and ports, Blazar hosts, Gnocchi GPU metrics
+and the port statistics of Corsa switches. Each service listens on its own
+port, starting at --port in the order of SERVICES, followed by one port per
+Corsa switch.
+
+Only the requests made by the exporter are implemented. Every request is
+counted by service and path, GET /_fake/stats on any port returns the
+counters and POST /_fake/reset clears them.
+"""
+
+import argparse
+import json
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+from six.moves.urllib import parse as urlparse
+
+logger = logging.getLogger(__name__)
+
+TOKEN = 'fake-token'
+PROJECT_ID = 'fake-service-project'
+# service type, catalog name, path of the catalog URL, status code of the
+# service root
+SERVICES = [
+    ('identity', 'keystone', '/v3', 300),
+    ('compute', 'nova', '/v2.1', 200),
+    ('network', 'neutron', '', 200),
+    ('volumev3', 'cinder', '/v3/' + PROJECT_ID, 300),
+    ('baremetal', 'ironic', '', 200),
+    ('reservation', 'blazar', '/v1', 300),
+    ('metric', 'gnocchi', '', 200),
+]
+NODE_TYPES = [
+    ('compute_skylake', False),
+    ('compute_haswell', False),
+    ('compute_cascadelake', False),
+    ('storage', False),
+    ('gpu_rtx_6000', True),
+    ('gpu_p100', True),
+]
+GPUS_PER_NODE = 4
+GPU_METRICS = ['utilization', 'memory_used', 'temperature']
+PORTS_PER_SWITCH = 48
+# Largest page returned by Nova and Ironic, as with their default max_limit
+MAX_LIMIT = 1000
+
+
+def _timestamp(t):
+    return t.strftime('%Y-%m-%dT%H:%M:%S.000000')
+
+
+class FakeCloud(object):
+    """ Synthetic cloud of `nodes` bare metal nodes, generated from `seed`
+        so that every run serves the same records.
+    """
+
+    def __init__(self, nodes, seed=0, region='RegionOne'):
+        self.region = region
+        self.rng = rng = random.Random(seed)
+        now = datetime.utcnow()
+
+        def uid():
+            return str(uuid.UUID(int=rng.getrandbits(128)))
+
+        self.projects = [
+            {'id': uid(), 'name': 'project-{:05d}'.format(i),
+             'domain_id': 'default', 'enabled': True}
+            for i in range(max(10, nodes // 20))]
+
+        self.nodes = []
+        self.ports = []
+        self.hosts = []
+        self.hypervisors = []
+        self.servers = []
+        self.gpu_resources = []
+        self.switches = max(1, -(-nodes // PORTS_PER_SWITCH))
+        self.aggregates = [{
+            'id': 1, 'name': 'freepool', 'availability_zone': None,
+            'hosts': [], 'metadata': {}}]
+        lease = None
+        for i in range(nodes):
+            node_uuid = uid()
+            node_type, gpu = rng.choice(NODE_TYPES)
+            reserved = rng.random() < 0.6
+            if not reserved:
+                self.aggregates[0]['hosts'].append(node_uuid)
+            else:
+                if lease is None or len(lease['hosts']) >= rng.randint(1, 20):
+                    lease = {
+                        'id': len(self.aggregates) + 1,
+                        'name': uid(),
+                        'availability_zone': None,
+                        'hosts': [],
+                        'metadata': {
+                            'blazar:owner': rng.choice(self.projects)['id']}}
+                    self.aggregates.append(lease)
+                lease['hosts'].append(node_uuid)
+            failed = rng.random() < 0.02
+            updated = now - timedelta(seconds=rng.randint(0, 86400))
+            if failed:
+                provision_state = 'deploy failed'
+            elif reserved:
+                provision_state = 'active'
+            else:
+                provision_state = 'available'
+            self.nodes.append({
+                'uuid': node_uuid,
+                'name': 'node-{:05d}'.format(i),
+                'driver': 'ipmi',
+                'instance_uuid': uid() if reserved else None,
+                'power_state': 'power on' if reserved else 'power off',
+                'provision_state': provision_state,
+                'maintenance': rng.random() < 0.02,
+                'console_enabled': rng.random() < 0.1,
+                'last_error': 'Deploy timed out' if failed else None,
+                'resource_class': 'baremetal',
+                'properties': {'cpus': 48, 'memory_mb': 196608,
+                               'local_gb': 240, 'cpu_arch': 'x86_64'},
+                'created_at': _timestamp(now - timedelta(days=365)),
+                'updated_at': _timestamp(updated),
+            })
+            self.ports.append({
+                'uuid': uid(),
+                'address': '52:54:00:{:02x}:{:02x}:{:02x}'.format(
+                    i >> 16 & 0xff, i >> 8 & 0xff, i & 0xff),
+                'node_uuid': node_uuid,
+                'pxe_enabled': True,
+                'local_link_connection': {
+                    'switch_id': '00:00:00:00:00:{:02x}'.format(
+                        i // PORTS_PER_SWITCH & 0xff),
+                    'switch_info': 'corsa-{}'.format(i // PORTS_PER_SWITCH),
+                    'port_id': 'Ethernet {}'.format(
+                        i % PORTS_PER_SWITCH + 1)},
+            })
+            self.hosts.append({
+                'id': str(i + 1),
+                'hypervisor_hostname': node_uuid,
+                'node_name': 'node-{:05d}'.format(i),
+                'node_type': node_type,
+                'gpu.gpu': gpu,
+                'reservable': True,
+            })
+            self.hypervisors.append({
+                'id': i + 1,
+                'hypervisor_hostname': node_uuid,
+                'hypervisor_type': 'ironic',
+                'state': 'up',
+                'status': 'enabled',
+                'vcpus': 48,
+                'vcpus_used': 48 if reserved else 0,
+                'memory_mb': 196608,
+                'memory_mb_used': 196608 if reserved else 0,
+                'free_ram_mb': 0 if reserved else 196608,
+                'local_gb': 240,
+                'local_gb_used': 240 if reserved else 0,
+                'free_disk_gb': 0 if reserved else 240,
+                'current_workload': 0,
+                'running_vms': 1 if reserved else 0,
+                'host_ip': '10.0.{}.{}'.format(i // 250, i % 250 + 1),
+                'service': {'id': 1, 'host': 'ironic-compute',
+                            'disabled_reason': None},
+            })
+            if reserved or failed:
+                self.servers.append({
+                    'id': uid(),
+                    'name': 'instance-{:05d}'.format(i),
+                    'tenant_id': rng.choice(self.projects)['id'],
+                    'status': 'ERROR' if failed else 'ACTIVE',
+                    'updated': updated.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                })
+            if gpu:
+                self.gpu_resources.append({
+                    'id': node_uuid,
+                    'type': 'cuda',
+                    'metrics': {
+                        'gpu{}.{}'.format(g, metric): uid()
+                        for g in range(GPUS_PER_NODE)
+                        for metric in GPU_METRICS},
+                })
+
+        controllers = ['controller-{:02d}'.format(i) for i in range(3)]
+        self.nova_services = [
+            {'id': i, 'binary': binary, 'host': host, 'zone': 'internal',
+             'status': 'enabled', 'state': 'up'}
+            for i, (binary, host) in enumerate(
+                [(b, h) for b in ('nova-conductor', 'nova-scheduler',
+                                  'nova-consoleauth') for h in controllers] +
+                [('nova-compute', 'ironic-compute')])]
+        self.neutron_agents = [
+            {'id': uid(), 'binary': binary, 'host': host,
+             'admin_state_up': True, 'alive': True}
+            for binary in ('neutron-dhcp-agent', 'neutron-l3-agent',
+                           'neutron-metadata-agent',
+                           'neutron-openvswitch-agent')
+            for host in controllers]
+        self.cinder_services = [
+            {'binary': binary, 'host': host, 'zone': 'nova',
+             'status': 'enabled', 'state': 'up'}
+            for binary in ('cinder-scheduler', 'cinder-volume')
+            for host in controllers]
+
+        self.node_index = {n['uuid']: i for i, n in enumerate(self.nodes)}
+        self.hypervisor_index = {
+            str(h['id']): i for i, h in enumerate(self.hypervisors)}
+        self.port_index = {p['uuid']: i for i, p in enumerate(self.ports)}
+        self.server_index = {s['id']: i for i, s in enumerate(self.servers)}
+
+    def port_stats(self, switch):
+        """ counters of the ports of a switch, increasing between calls """
+        ticks = int(time.time())
+        stats = []
+        for port in range(1, PORTS_PER_SWITCH + 1):
+            base = (switch * PORTS_PER_SWITCH + port) * 1000003
+            stats.append({
+                'port': port,
+                'tx_packets': base + ticks * 100,
+                'tx_bytes': base + ticks * 150000,
+                'tx_errors': 0,
+                'tx_dropped': port % 3,
+                'rx_packets': base + ticks * 90,
+                'rx_bytes': base + ticks * 120000,
+                'rx_errors': 0,
+                'rx_dropped': port % 5,
+            })
+        return {'stats': stats}
+
+
+class RequestCounter(object):
+    """ number of requests and bytes sent, by service and path """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+
+    def count(self, service, method, path, size):
+        key = '{} {} {}'.format(service, method, path)
+        with self.lock:
+            requests, sent = self.requests.get(key, (0, 0))
+            self.requests[key] = (requests + 1, sent + size)
+
+    def reset(self):
+        with self.lock:
+            self.requests.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                key: {'requests': requests, 'bytes': sent}
+                for key, (requests, sent) in self.requests.items()}
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn,
+                          BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class FakeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # set on the per service subclasses created by serve()
+    cloud = None
+    counter = None
+    service = None
+    root_status = 200
+    latency = 0
+    jitter = 0
+    base_urls = {}
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def _dispatch(self, method):
+        url = urlparse.urlparse(self.path)
+        self.query = urlparse.parse_qs(url.query)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        self.body = json.loads(body.decode('utf-8')) if body else None
+
+        if url.path == '/_fake/stats':
+            return self._send(200, self.counter.stats())
+        if url.path == '/_fake/reset':
+            self.counter.reset()
+            return self._send(204)
+
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+        handler = getattr(self, '{}_{}'.format(
+            self.service, method.lower()).replace('-', '_'), None)
+        path = url.path.rstrip('/') or '/'
+        if path == '/':
+            response = (self.root_status, {'versions': {}})
+        elif handler is None:
+            response = (404, None)
+        else:
+            response = handler(path)
+        size = self._send(*response)
+        # Normalize ids so that counts are grouped by endpoint
+        self.counter.count(
+            self.service, method,
+            re.sub(r'/[0-9a-f-]{32,36}(?=/|$)', '/{id}', path), size)
+
+    def _send(self, status, response=None, headers=None):
+        body = json.dumps(response).encode('utf-8') \
+            if response is not None else b''
+        self.send_response(status)
+        if response is not None:
+            self.send_header('Content-Type', 'application/json')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return len(body)
+
+    def _param(self, name, default=None):
+        return self.query.get(name, [default])[0]
+
+    def _page(self, records, index, key, path):
+        """ page of records following the marker, with the link to the
+            next page if there is one
+        """
+        limit = int(self._param('limit') or 0) or MAX_LIMIT
+        limit = min(limit, MAX_LIMIT)
+        marker = self._param('marker')
+        start = index[marker] + 1 if marker in index else 0
+        page = records[start:start + limit]
+        next_url = None
+        if start + limit < len(records):
+            params = dict((k, v[0]) for k, v in self.query.items())
+            params.update(limit=limit, marker=page[-1][key])
+            next_url = '{}{}?{}'.format(
+                self.base_urls[self.service], path, urlparse.urlencode(params))
+        return page, next_url
+
+    def identity_post(self, path):
+        if path != '/v3/auth/tokens':
+            return 404, None
+        expires = datetime.utcnow() + timedelta(hours=1)
+        catalog = [
+            {'type': service_type, 'name': name, 'id': name,
+             'endpoints': [
+                 {'id': '{}-{}'.format(name, interface),
+                  'interface': interface,
+                  'region': self.cloud.region,
+                  'region_id': self.cloud.region,
+                  'url': self.base_urls[service_type] + suffix}
+                 for interface in ('public', 'internal', 'admin')]}
+            for service_type, name, suffix, _ in SERVICES]
+        token = {
+            'methods': ['password'],
+            'expires_at': expires.strftime('%Y-%m-%dT%H:%M:%S.000000Z'),
+            'issued_at': _timestamp(datetime.utcnow()),
+            'user': {'id': 'exporter', 'name': 'exporter',
+                     'domain': {'id': 'default', 'name': 'Default'}},
+            'project': {'id': PROJECT_ID, 'name': 'service',
+                        'domain': {'id': 'default', 'name': 'Default'}},
+            'roles': [{'id': 'admin', 'name': 'admin'}],
+            'catalog': catalog,
+        }
+        return 201, {'token': token}, {'X-Subject-Token': TOKEN}
+
+    def identity_get(self, path):
+        if path == '/v3/projects':
+            return 200, {
+                'projects': self.cloud.projects,
+                'links': {'self': self.base_urls['identity'] + path,
+                          'next': None, 'previous': None}}
+        if path == '/v3/auth/tokens':
+            return 200, {}
+        return 404, None
+
+    def compute_get(self, path):
+        cloud = self.cloud
+        if path == '/v2.1/os-aggregates':
+            return 200, {'aggregates': cloud.aggregates}
+        if path == '/v2.1/os-services':
+            return 200, {'services': cloud.nova_services}
+        if path == '/v2.1/os-hypervisors/detail':
+            page, next_url = self._page(
+                cloud.hypervisors, cloud.hypervisor_index, 'id', path)
+            response = {'hypervisors': page}
+            if next_url:
+                response['hypervisors_links'] = [
+                    {'rel': 'next', 'href': next_url}]
+            return 200, response
+        if path == '/v2.1/servers/detail':
+            servers = cloud.servers
+            since = self._param('changes-since')
+            if since:
+                servers = [s for s in servers if s['updated'] >= since]
+            index = dict((s['id'], i) for i, s in enumerate(servers))
+            page, next_url = self._page(servers, index, 'id', path)
+            response = {'servers': page}
+            if next_url:
+                response['servers_links'] = [
+                    {'rel': 'next', 'href': next_url}]
+            return 200, response
+        return 404, None
+
+    def network_get(self, path):
+        if path == '/v2.0/agents':
+            return 200, {'agents': self.cloud.neutron_agents}
+        return 404, None
+
+    def volumev3_get(self, path):
+        if path == '/v3/{}/os-services'.format(PROJECT_ID):
+            return 200, {'services': self.cloud.cinder_services}
+        return 404, None
+
+    def baremetal_get(self, path):
+        cloud = self.cloud
+        if path == '/v1':
+            return 200, {'id': 'v1', 'version': {
+                'id': 'v1', 'version': '1.58', 'min_version': '1.1',
+                'status': 'CURRENT'}}
+        if path in ('/v1/nodes', '/v1/nodes/detail'):
+            page, next_url = self._page(
+                cloud.nodes, cloud.node_index, 'uuid', path)
+            if path == '/v1/nodes':
+                page = [
+                    dict((k, n[k]) for k in (
+                        'uuid', 'name', 'instance_uuid', 'power_state',
+                        'provision_state', 'maintenance'))
+                    for n in page]
+            response = {'nodes': page}
+            if next_url:
+                response['next'] = next_url
+            return 200, response
+        if path in ('/v1/ports', '/v1/ports/detail'):
+            page, next_url = self._page(
+                cloud.ports, cloud.port_index, 'uuid', path)
+            response = {'ports': page}
+            if next_url:
+                response['next'] = next_url
+            return 200, response
+        return 404, None
+
+    def reservation_get(self, path):
+        if path == '/v1/os-hosts':
+            return 200, {'hosts': self.cloud.hosts}
+        return 404, None
+
+    def metric_post(self, path):
+        cloud = self.cloud
+        if path == '/v1/search/resource/cuda':
+            return 200, cloud.gpu_resources
+        if path == '/v1/aggregates':
+            operations = (self.body or {}).get('operations', '')
+            metric_ids = re.findall(r'\(([0-9a-f-]{36}) \w+\)', operations)
+            now = datetime.utcnow().replace(second=0, microsecond=0)
+            measures = {}
+            for metric_id in metric_ids:
+                value = int(metric_id[:4], 16) % 100
+                measures[metric_id] = {'mean': [
+                    [_timestamp(now - timedelta(minutes=m)) + '+00:00',
+                     60.0, float(value + m)]
+                    for m in range(4, -1, -1)]}
+            return 200, {'measures': measures}
+        return 404, None
+
+    def corsa_get(self, path):
+        if path == '/api/v1/stats/ports':
+            return 200, self.cloud.port_stats(self.switch)
+        return 404, None
+
+
+def serve(cloud, host, port, latency=0, jitter=0, service_latency=None):
+    """ start the fake services in background threads.
+
+        Returns the servers and the root URL of each service, the Corsa
+        switches are named corsa-0, corsa-1...
+    """
+    counter = RequestCounter()
+    base_urls = {}
+    servers = []
+    names = [(service_type, root_status)
+             for service_type, _, _, root_status in SERVICES]
+    names += [('corsa-{}'.format(switch), 200)
+              for switch in range(cloud.switches)]
+    for offset, (name, root_status) in enumerate(names):
+        base_urls[name] = 'http://{}:{}'.format(host, port + offset)
+    for offset, (name, root_status) in enumerate(names):
+        service = 'corsa' if name.startswith('corsa-') else name
+        attrs = {
+            'cloud': cloud,
+            'counter': counter,
+            'service': service,
+            'root_status': root_status,
+            'latency': (service_latency or {}).get(service, latency),
+            'jitter': jitter,
+            'base_urls': base_urls,
+        }
+        if service == 'corsa':
+            attrs['switch'] = int(name.split('-')[1])
+
+        # BaseHTTPRequestHandler is an old style class on Python 2
+        class handler(FakeHandler):
+            pass
+        for attr, value in attrs.items():
+            setattr(handler, attr, value)
+        server = ThreadingHTTPServer((host, port + offset), handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        servers.append(server)
+    return servers, base_urls
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Fake OpenStack APIs serving a synthetic cloud')
+    parser.add_argument('--nodes', type=int, default=1000,
+                        help='number of bare metal nodes')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=35000,
+                        help='port of the first service')
+    parser.add_argument('--region', default='RegionOne')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0,
+                        help='random seconds added on top of the latency')
+    parser.add_argument('--service-latency', action='append', default=[],
+                        metavar='SERVICE=SECONDS',
+                        help='latency of one service type, e.g. compute=0.5')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s:%(levelname)s:%(message)s")
+
+    service_latency = {}
+    for option in args.service_latency:
+        service, _, seconds = option.partition('=')
+        service_latency[service] = float(seconds)
+
+    cloud = FakeCloud(args.nodes, args.seed, args.region)
+    servers, base_urls = serve(
+        cloud, args.host, args.port, args.latency, args.jitter,
+        service_latency)
+    logger.info("Serving {} nodes, {} switches, Keystone at {}/v3".format(
+        len(cloud.nodes), cloud.switches, base_urls['identity']))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for server in servers:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()